@@ -0,0 +1,51 @@
+"""
+compares compiled serializer with generic to_dict on every row of a table
+
+    $ python -m benchmarks.bench_serializer --db tests/db.sqlite3 --table Track
+"""
+import argparse
+import timeit
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.inspection import inspect
+
+from flask_autocrud import AutoCrud
+from flask_autocrud.serializer import generic_to_dict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='tests/db.sqlite3', help='sqlite database file')
+    parser.add_argument('--table', default='Track', help='model name')
+    parser.add_argument('--number', type=int, default=20, help='repetitions')
+    parser.add_argument('--related', action='store_true', help='load related resources')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite+pysqlite:///{}'.format(args.db)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    with app.app_context():
+        db = SQLAlchemy(app)
+        autocrud = AutoCrud(app, db)
+        model = autocrud.models[args.table]
+        rows = model.query.all()
+
+        if args.related:
+            for r in rows:
+                for rel in inspect(model).relationships:
+                    getattr(r, rel.key)
+
+        for links in (False, True):
+            assert all(r.to_dict(links) == generic_to_dict(r, links) for r in rows)
+            generic = timeit.timeit(lambda: [generic_to_dict(r, links) for r in rows], number=args.number)
+            compiled = timeit.timeit(lambda: [r.to_dict(links) for r in rows], number=args.number)
+
+            print("{} rows, links={}: generic {:.3f}s, compiled {:.3f}s, speedup x{:.1f}".format(
+                len(rows), links, generic, compiled, generic / compiled
+            ))
+
+
+if __name__ == '__main__':
+    main()
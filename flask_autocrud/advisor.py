@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import Index, UniqueConstraint
+
+EQUALITY_OPS = {'==', 'eq', 'in', 'is_null'}
+
+Pattern = namedtuple('Pattern', 'model equality ranges sorting')
+
+
+class Stats(object):
+    __slots__ = ('calls', 'total', 'max')
+
+    def __init__(self):
+        """
+        calls and elapsed seconds of requests with the same pattern
+        """
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        """
+
+        :param elapsed: seconds
+        """
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+def pattern(model, data):
+    """
+    columns of model used by filters, split by equality and range operators, and by sorting
+
+    :param model: model class
+    :param data: dict passed to dict2sqla
+    :return: Pattern or None if no column of model is used
+    """
+    columns = model.columns()
+    equality, ranges = set(), set()
+
+    def leaves(f):
+        if 'field' in f:
+            return [f]
+        return [i for k in ('and', 'or', 'not') for c in f.get(k, []) for i in leaves(c)]
+
+    def walk(filters):
+        for f in filters:
+            if 'and' in f:
+                walk(f['and'])
+                continue
+            if 'not' in f:
+                continue
+
+            # values of the same column in or, as sent by query string, still use one index
+            items = leaves(f)
+            fields = {(i.get('model'), i.get('field')) for i in items}
+            if len(fields) != 1:
+                continue
+
+            (owner, field), = fields
+            if owner in (None, model.__name__) and field in columns:
+                ops = {i.get('op') for i in items}
+                (equality if ops <= EQUALITY_OPS else ranges).add(field)
+
+    walk(data.get('filters') or [])
+    sorting = []
+    for s in data.get('sorting') or []:
+        field = s.get('field')
+        if s.get('model') in (None, model.__name__) and field in columns and field not in sorting:
+            sorting.append(field)
+
+    if not (equality or ranges or sorting):
+        return None
+    return Pattern(model.__name__, tuple(sorted(equality)), tuple(sorted(ranges - equality)), tuple(sorting))
+
+
+def suggestion(p):
+    """
+    equality columns first, then sort columns or the first range column
+
+    :param p: Pattern
+    :return: tuple of columns
+    """
+    rest = [c for c in p.sorting if c not in p.equality] or list(p.ranges[:1])
+    return p.equality + tuple(rest)
+
+
+def covered(indexes, columns, equality):
+    """
+
+    :param indexes: list of tuples of indexed columns
+    :param columns: suggested index
+    :param equality: number of leading columns that can be in any order
+    :return: True if an index starts with the suggested columns
+    """
+    for index in indexes:
+        if (
+            set(index[:equality]) == set(columns[:equality])
+            and tuple(index[equality:len(columns)]) == tuple(columns[equality:])
+        ):
+            return True
+    return False
+
+
+def table_indexes(model):
+    """
+    indexes found by reflection or declared, primary key and unique constraints
+
+    :param model: model class
+    :return: list of tuples of attribute names
+    """
+    table = model.__table__
+    keys = {c.name: k for k, c in model.columns().items()}
+
+    indexes = [table.primary_key.columns]
+    indexes += [i.columns for i in table.indexes]
+    indexes += [u.columns for u in table.constraints if isinstance(u, UniqueConstraint)]
+    return [tuple(keys.get(c.name, c.name) for c in i) for i in indexes if len(i) > 0]
+
+
+class IndexAdvisor(object):
+    def __init__(self, auto_index=False, threshold=10):
+        """
+        records filter and sort patterns of collection requests with their elapsed time,
+        suggests composite indexes for patterns not covered by existing ones
+
+        :param auto_index: create suggested indexes on SQLite
+        :param threshold: calls of a pattern before its index is created
+        """
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._tried = set()
+        self._auto_index = auto_index
+        self._threshold = threshold
+
+    def observe(self, model, data, started):
+        """
+
+        :param model: model class
+        :param data: dict passed to dict2sqla
+        :param started: time.perf_counter() at request start
+        :return: in auto index mode the pattern whose index must be created, only once
+        """
+        p = pattern(model, data)
+        if p is None:
+            return None
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats.setdefault(p, Stats())
+            stats.add(elapsed)
+
+            if self._auto_index and stats.calls >= self._threshold and p not in self._tried:
+                self._tried.add(p)
+                return p
+
+        return None
+
+    def advice(self, models):
+        """
+
+        :param models: dict of model classes by name
+        :return: list of dict with suggested indexes, most expensive first
+        """
+        with self._lock:
+            stats = list(self._stats.items())
+
+        advice = {}
+        for p, s in stats:
+            model = models.get(p.model)
+            columns = suggestion(p)
+            if model is None or covered(table_indexes(model), columns, len(p.equality)):
+                continue
+
+            key = (p.model, columns)
+            item = advice.setdefault(key, dict(
+                model=p.model,
+                table=model.__table__.name,
+                columns=list(columns),
+                patterns=[],
+                calls=0,
+                total_ms=0.0,
+                max_ms=0.0,
+            ))
+            item['patterns'].append(dict(equality=list(p.equality), ranges=list(p.ranges), sorting=list(p.sorting)))
+            item['calls'] += s.calls
+            item['total_ms'] += s.total * 1000
+            item['max_ms'] = max(item['max_ms'], s.max * 1000)
+
+        for item in advice.values():
+            item['avg_ms'] = item['total_ms'] / item['calls']
+
+        return sorted(advice.values(), key=lambda i: i['total_ms'], reverse=True)
+
+    def create_index(self, bind, model, p):
+        """
+        dev mode only: index is created on SQLite if still not covered
+
+        :param bind: engine or connection
+        :param model: model class
+        :param p: Pattern
+        :return: created Index or None
+        """
+        columns = suggestion(p)
+        if bind.dialect.name != 'sqlite' or not columns:
+            return None
+
+        with self._lock:
+            if covered(table_indexes(model), columns, len(p.equality)):
+                return None
+
+            table = model.__table__
+            name = "ix_autocrud_{}_{}".format(table.name, '_'.join(columns)).lower()
+            index = Index(name, *[model.columns()[c] for c in columns])
+            try:
+                index.create(bind=bind)
+            except Exception:
+                table.indexes.discard(index)
+                raise
+            return index
+
+    def clear(self):
+        """
+        forgets all observed patterns
+        """
+        with self._lock:
+            self._stats.clear()
+            self._tried.clear()
@@ -0,0 +1,237 @@
+import datetime
+import decimal
+import re
+
+from sqlalchemy import String, and_, cast, func, not_, or_, select
+
+FUNCTIONS = {
+    'count': func.count,
+    'sum': func.sum,
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max,
+}
+
+NUMERIC_FUNCTIONS = ('sum', 'avg')
+NUMERIC_TYPES = (int, float, decimal.Decimal)
+
+EXPRESSION = re.compile(r'^(\w+)\((\*|\w+)\)$')
+
+OPERATORS = {
+    '==': lambda c, v: c == v,
+    'eq': lambda c, v: c == v,
+    '!=': lambda c, v: c != v,
+    'ne': lambda c, v: c != v,
+    '>': lambda c, v: c > v,
+    'gt': lambda c, v: c > v,
+    '<': lambda c, v: c < v,
+    'lt': lambda c, v: c < v,
+    '>=': lambda c, v: c >= v,
+    'ge': lambda c, v: c >= v,
+    '<=': lambda c, v: c <= v,
+    'le': lambda c, v: c <= v,
+    'in': lambda c, v: c.in_(v),
+    'not_in': lambda c, v: c.notin_(v),
+    'is_null': lambda c, v: c.is_(None),
+    'is_not_null': lambda c, v: c.isnot(None),
+}
+
+
+def is_expression(value):
+    """
+
+    :param value: query string key or field name
+    :return: True if value looks like an aggregate function, i.e. sum(Total)
+    """
+    return EXPRESSION.match(value or '') is not None
+
+
+def coerce(value, python_type):
+    """
+    values from query string are strings, they are compared with aggregates as numbers or dates
+
+    :param value: value or list of values
+    :param python_type: type of aggregate result
+    :return: converted value
+    """
+    if isinstance(value, list):
+        return [coerce(v, python_type) for v in value]
+    if not isinstance(value, str) or python_type is str:
+        return value
+
+    if python_type in (int, float, decimal.Decimal):
+        number = decimal.Decimal(value)
+        return int(number) if python_type is int and number == number.to_integral_value() else float(number)
+    if python_type in (datetime.date, datetime.datetime, datetime.time):
+        return python_type.fromisoformat(value)
+    return value
+
+
+def prefix_filter(column, prefix):
+    """
+    values starting with prefix ignoring case, columns that are not strings are compared as text
+
+    :param column: column object
+    :param prefix: string
+    :return: sql expression
+    """
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if column.type.python_type is not str:
+        column = cast(column, String)
+    return column.ilike(escaped + '%', escape='\\')
+
+
+class Aggregation(object):
+    __slots__ = ('model', 'group', 'functions', 'having', 'sorting', 'invalid', '_columns', '_types')
+
+    def __init__(self, model, group=None, functions=None, having=None, sorting=None):
+        """
+        rows grouped by model columns with aggregate functions of other columns,
+        group with no function gives the count of rows of every group
+
+        :param model: model class
+        :param group: list of column names
+        :param functions: list of aggregate expressions: count(*), sum(col), avg(col), min(col), max(col)
+        :param having: filters on aggregate expressions, same format of sqlalchemy-filters
+        :param sorting: list of dict with field, column or aggregate expression, and direction
+        """
+        self.model = model
+        self.invalid = []
+        self._columns = {}
+        self._types = {}
+
+        columns = model.columns()
+        self.group = []
+        for g in group or []:
+            if g in columns:
+                self.group.append(g)
+                self._columns[g] = columns[g]
+            else:
+                self.invalid.append(g)
+
+        self.functions = []
+        for f in functions or (['count(*)'] if self.group else []):
+            if self._expression(f) is not None and f not in self.functions:
+                self.functions.append(f)
+
+        self.having = self._having(having or [])
+
+        self.sorting = []
+        for s in sorting or []:
+            field, direction = s.get('field'), s.get('direction')
+            if direction not in ('asc', 'desc'):
+                self.invalid.append(direction)
+            elif field in self.group or self._expression(field) is not None:
+                self.sorting.append((field, direction))
+
+    def _expression(self, text):
+        """
+
+        :param text: aggregate expression
+        :return: sql expression or None if not valid
+        """
+        if text in self._columns:
+            return self._columns[text]
+
+        match = EXPRESSION.match(text or '')
+        columns = self.model.columns()
+        if match is None:
+            self.invalid.append(text)
+            return None
+
+        name, field = match.groups()
+        column = columns.get(field)
+        if name not in FUNCTIONS or (field == '*') != (name == 'count') or (field != '*' and column is None):
+            self.invalid.append(text)
+            return None
+
+        python_type = int if name == 'count' else column.type.python_type
+        if name in NUMERIC_FUNCTIONS:
+            if python_type not in NUMERIC_TYPES:
+                self.invalid.append(text)
+                return None
+            python_type = float if name == 'avg' else python_type
+
+        expr = FUNCTIONS[name]() if field == '*' else FUNCTIONS[name](column)
+        self._columns[text] = expr
+        self._types[text] = python_type
+        return expr
+
+    def _having(self, filters):
+        """
+
+        :param filters: list of filters on aggregate expressions
+        :return: sql expression or None
+        """
+        def build(f):
+            for op, combine in (('and', and_), ('or', or_), ('not', lambda *c: not_(and_(*c)))):
+                if op in f:
+                    children = [build(i) for i in f[op]]
+                    return None if any(c is None for c in children) else combine(*children)
+
+            field, op = f.get('field'), f.get('op')
+            if op not in OPERATORS:
+                self.invalid.append(op)
+                return None
+            if not is_expression(field):
+                self.invalid.append(field)
+                return None
+
+            expr = self._expression(field)
+            if expr is None:
+                return None
+
+            try:
+                value = coerce(f.get('value'), self._types[field])
+            except (ValueError, ArithmeticError):
+                self.invalid.append(f.get('value'))
+                return None
+            return OPERATORS[op](expr, value)
+
+        conditions = [build(f) for f in filters]
+        if not conditions or any(c is None for c in conditions):
+            return None
+        return and_(*conditions)
+
+    def statement(self, query):
+        """
+        joins and filters of query are kept, selected columns and order are replaced
+
+        :param query: query with filters applied
+        :return: select statement, labels are g0..gN for groups and a0..aN for functions
+        """
+        stm = query.order_by(None).statement
+        group = [self._columns[g] for g in self.group]
+        columns = [c.label("g{}".format(i)) for i, c in enumerate(group)]
+        columns += [self._columns[f].label("a{}".format(i)) for i, f in enumerate(self.functions)]
+
+        aggregate = stm.with_only_columns(columns).order_by(None)
+        for f in stm.froms:
+            aggregate = aggregate.select_from(f)
+
+        if group:
+            aggregate = aggregate.group_by(*group)
+        if self.having is not None:
+            aggregate = aggregate.having(self.having)
+
+        order = [self._columns[f].asc() if d == 'asc' else self._columns[f].desc() for f, d in self.sorting]
+        order += [c.asc() for g, c in zip(self.group, group) if g not in dict(self.sorting)]
+        return aggregate.order_by(*order)
+
+    @staticmethod
+    def count(statement):
+        """
+
+        :param statement: as returned by Aggregation.statement
+        :return: select count of groups
+        """
+        return select([func.count()]).select_from(statement.order_by(None).alias('autocrud_groups'))
+
+    def rows(self, result):
+        """
+
+        :param result: result of statement
+        :return: list of dict with group columns and aggregate expressions as keys
+        """
+        keys = self.group + self.functions
+        return [dict(zip(keys, r)) for r in result]
@@ -1,15 +1,27 @@
 import flask
+from flask import current_app as cap
 from flask_errors_handler import ErrorHandler
 from flask_response_builder import ResponseBuilder
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.automap import automap_base
 
+from . import batch
+from .advisor import IndexAdvisor
+from .builders import NdJsonBuilder
+from .cache import cache_factory
 from .config import HttpStatus, set_default_config
+from .core import READ_ENGINES
 from .model import Model
+from .pagination import COUNT_POLICIES, CountCache
+from .qs2sqla import QueryPlanCache
+from .relations import STRATEGIES
+from .schema import Encoded
+from .search import LANGUAGE, SEARCH_BACKENDS, build_indexes, index_command
 from .service import Service
 
 
 class AutoCrud(object):
-    def __init__(self, app=None, db=None, models=None, builder=None, error=None, **kwargs):
+    def __init__(self, app=None, db=None, models=None, builder=None, error=None, cache=None, **kwargs):
         """
 
         :param db:
@@ -17,17 +29,22 @@ class AutoCrud(object):
         :param models:
         :param builder:
         :param error:
+        :param cache:
         """
         self._db = db
         self._api = None
         self._models = {}
+        self._cache = None
+        self._plans = None
+        self._advisor = None
+        self._counter = None
         self._response_error = None
         self._response_builder = None
 
         if app is not None:
             self.init_app(
                 app, self._db,
-                models=models, builder=builder, error=error,
+                models=models, builder=builder, error=error, cache=cache,
                 **kwargs
             )
 
@@ -55,6 +72,30 @@ class AutoCrud(object):
         """
         return self._response_error
 
+    @property
+    def cache(self):
+        """
+
+        :return:
+        """
+        return self._cache
+
+    @property
+    def query_plans(self):
+        """
+
+        :return: QueryPlanCache instance, None if disabled
+        """
+        return self._plans
+
+    @property
+    def index_advisor(self):
+        """
+
+        :return: IndexAdvisor instance, None if disabled
+        """
+        return self._advisor
+
     @property
     def models(self):
         """
@@ -63,7 +104,23 @@ class AutoCrud(object):
         """
         return self._models
 
-    def init_app(self, app, db, models=None, builder=None, error=None, **kwargs):
+    def search_indexes(self, models=None, drop=False):
+        """
+        builds full text indexes used by _search, also with: flask autocrud-search-index
+
+        :param models: names of models, default all
+        :param drop: drop indexes instead of building them
+        :return: list of (model name, backend name) changed
+        """
+        try:
+            models = [self._models[m] for m in models or self._models.keys()]
+        except KeyError as exc:
+            raise ValueError("unknown model: {}".format(exc))
+
+        language = cap.config['AUTOCRUD_SEARCH_LANGUAGE']
+        return build_indexes(self._db.session(), models, language, drop)
+
+    def init_app(self, app, db, models=None, builder=None, error=None, cache=None, **kwargs):
         """
 
         :param app:
@@ -71,6 +128,7 @@ class AutoCrud(object):
         :param models:
         :param builder:
         :param error:
+        :param cache: cache backend instance, overrides AUTOCRUD_CACHE_BACKEND
         :return:
         """
         self._db = db
@@ -80,12 +138,54 @@ class AutoCrud(object):
         if not self._response_builder:
             self._response_builder = ResponseBuilder()
             self._response_builder.init_app(app)
+
+        ndjson = NdJsonBuilder('application/x-ndjson')
+        self._response_builder.register_builder('ndjson', ndjson, **app.config)
+        app.config['RB_DEFAULT_ACCEPTABLE_MIMETYPES'] = {
+            *app.config['RB_DEFAULT_ACCEPTABLE_MIMETYPES'], ndjson.mimetype
+        }
         if not self._response_error:
             self._response_error = ErrorHandler()
             self._response_error.init_app(app, response=self._response_builder.on_accept())
 
         set_default_config(app)
 
+        if app.config['AUTOCRUD_COUNT_POLICY'] not in COUNT_POLICIES:
+            raise ValueError(
+                "'AUTOCRUD_COUNT_POLICY' must be one of: {}".format(', '.join(COUNT_POLICIES))
+            )
+        if app.config['AUTOCRUD_READ_ENGINE'] not in READ_ENGINES:
+            raise ValueError(
+                "'AUTOCRUD_READ_ENGINE' must be one of: {}".format(', '.join(READ_ENGINES))
+            )
+        if app.config['AUTOCRUD_RELATED_STRATEGY'] not in STRATEGIES:
+            raise ValueError(
+                "'AUTOCRUD_RELATED_STRATEGY' must be one of: {}".format(', '.join(STRATEGIES))
+            )
+        if app.config['AUTOCRUD_SEARCH_BACKEND'] not in SEARCH_BACKENDS:
+            raise ValueError(
+                "'AUTOCRUD_SEARCH_BACKEND' must be one of: {}".format(', '.join(SEARCH_BACKENDS))
+            )
+        if not LANGUAGE.match(app.config['AUTOCRUD_SEARCH_LANGUAGE'] or ''):
+            raise ValueError("'AUTOCRUD_SEARCH_LANGUAGE' must be the name of a text search configuration")
+        backend = None
+        if app.config['AUTOCRUD_CACHE_ENABLED'] is True or app.config['AUTOCRUD_COUNT_POLICY'] == 'cached':
+            backend = cache or cache_factory(app.config)
+
+        if app.config['AUTOCRUD_CACHE_ENABLED'] is True:
+            self._cache = backend
+        if app.config['AUTOCRUD_COUNT_POLICY'] == 'cached':
+            self._counter = CountCache(backend, ttl=app.config['AUTOCRUD_COUNT_CACHE_TTL'])
+
+        if app.config['AUTOCRUD_QUERY_PLAN_CACHE_SIZE']:
+            self._plans = QueryPlanCache(maxsize=app.config['AUTOCRUD_QUERY_PLAN_CACHE_SIZE'])
+
+        if app.config['AUTOCRUD_INDEX_ADVISOR_ENABLED'] is True:
+            self._advisor = IndexAdvisor(
+                auto_index=app.config['AUTOCRUD_AUTO_INDEX'] is True,
+                threshold=app.config['AUTOCRUD_AUTO_INDEX_THRESHOLD']
+            )
+
         subdomain = app.config['AUTOCRUD_SUBDOMAIN']
         self._api = flask.Blueprint('flask_autocrud', __name__, subdomain=subdomain)
 
@@ -109,13 +209,33 @@ class AutoCrud(object):
                 if not app.config['AUTOCRUD_FETCH_ENABLED']:
                     model.__methods__ -= {'FETCH'}
 
+        # urls and methods of all models are known only now
+        for m in self._models.values():
+            m.serializer(compile=True)
+            m.schema(compile=True)
+
         if app.config['AUTOCRUD_RESOURCES_URL_ENABLED']:
             self._register_resources_route(
                 app.config['AUTOCRUD_BASE_URL'] + app.config['AUTOCRUD_RESOURCES_URL']
             )
 
+        if app.config['AUTOCRUD_BATCH_ENABLED']:
+            url = app.config['AUTOCRUD_BASE_URL'] + app.config['AUTOCRUD_BATCH_URL']
+            for m in self._models.values():
+                if m.__url__.rstrip('/') == url.rstrip('/'):
+                    raise ValueError(
+                        "'AUTOCRUD_BATCH_URL' must not be the url of model '{}'".format(m.__name__)
+                    )
+            self._register_batch_route(url)
+
+        if self._advisor is not None and app.config['AUTOCRUD_INDEX_ADVISOR_URL']:
+            self._register_advice_route(
+                app.config['AUTOCRUD_BASE_URL'] + app.config['AUTOCRUD_INDEX_ADVISOR_URL']
+            )
+
         self._response_error.api_register(self._api)
         app.register_blueprint(self._api)
+        app.cli.add_command(index_command)
 
         if not hasattr(app, 'extensions'):
             app.extensions = dict()
@@ -154,6 +274,10 @@ class AutoCrud(object):
             (Service,), {
                 '_model': model,
                 '_db': self._db,
+                '_cache': self._cache,
+                '_plans': self._plans,
+                '_advisor': self._advisor,
+                '_counter': self._counter,
                 '_response': self._response_builder,
                 **kwargs
             }
@@ -165,6 +289,9 @@ class AutoCrud(object):
         if conf['AUTOCRUD_METADATA_ENABLED'] is True:
             add_route(conf['AUTOCRUD_METADATA_URL'])
 
+        if conf['AUTOCRUD_DISTINCT_ENABLED'] is True:
+            add_route(conf['AUTOCRUD_DISTINCT_URL'] + '/<path:facets>', {'GET'})
+
         self._models[model.__name__] = model
         pk = model.columns().get(model.primary_key_field())
         pk_type = pk.type.python_type.__name__
@@ -176,14 +303,52 @@ class AutoCrud(object):
 
         :return:
         """
+        resources = Encoded({res: cls.__url__ for res, cls in self._models.items()})
+
         @self._api.route(url)
-        @self.response_builder.on_accept()
         def index():
             if not self._models:
                 flask.abort(HttpStatus.NOT_FOUND, 'no resources available')
 
-            response = {}
-            for res, cls in self._models.items():
-                response[res] = cls.__url__
+            conditional = cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True
+            return resources.response(self.response_builder, conditional)
 
-            return response
+    def _register_advice_route(self, url):
+        """
+
+        :return:
+        """
+        @self._api.route(url)
+        @self.response_builder.on_accept()
+        def index_advice():
+            return dict(advice=self._advisor.advice(self._models))
+
+    def _register_batch_route(self, url):
+        """
+
+        :return:
+        """
+        def allowed(endpoint):
+            view = cap.view_functions.get(endpoint)
+            return isinstance(getattr(view, 'view_class', None), type) and issubclass(view.view_class, Service)
+
+        @self._api.route(url, methods=['POST'])
+        @self.response_builder.on_accept()
+        def batch_request():
+            payload = flask.request.get_json(silent=True)
+            atomic = False
+            if isinstance(payload, dict):
+                atomic = payload.get('atomic') is True
+                payload = payload.get('requests')
+
+            if not isinstance(payload, list) or not payload:
+                flask.abort(HttpStatus.BAD_REQUEST, 'a list of requests is required')
+
+            max_size = cap.config['AUTOCRUD_BATCH_MAX_SIZE']
+            if max_size and len(payload) > max_size:
+                flask.abort(HttpStatus.PAYLOAD_TOO_LARGE, response=dict(max_size=max_size))
+
+            try:
+                return batch.execute(self._db.session(), payload, allowed, atomic)
+            except IntegrityError as exc:
+                flask.abort(HttpStatus.CONFLICT, response=dict(error=str(exc.orig)))
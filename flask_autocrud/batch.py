@@ -0,0 +1,151 @@
+import flask
+from flask import current_app as cap
+from sqlalchemy import text
+
+from .config import HttpStatus as status
+
+NOT_INHERITED_HEADERS = {
+    'accept',
+    'content-length',
+    'content-type',
+    'x-http-method-override',
+    'if-match',
+    'if-none-match',
+    'if-modified-since',
+    'if-unmodified-since',
+}
+
+
+def begin(session):
+    """
+    pysqlite does not start a transaction before SAVEPOINT, so the release
+    of the first savepoint would commit: the transaction is started explicitly
+
+    :param session: database session
+    """
+    conn = session.connection()
+    if conn.dialect.name == 'sqlite' and not conn.connection.in_transaction:
+        conn.execute(text("BEGIN"))
+
+
+def end_savepoint(session, commit):
+    """
+    releases or rolls back the savepoint of a sub request if the service has not already done it
+
+    :param session: database session
+    :param commit: True release, False rollback
+    """
+    transaction = session.transaction
+    if transaction is not None and transaction.nested:
+        if commit:
+            session.commit()
+        else:
+            session.rollback()
+
+
+def sub_response(response):
+    """
+
+    :param response: response object of a sub request
+    :return: dict with status, headers and body
+    """
+    if response.is_json:
+        body = response.get_json(silent=True)
+    else:
+        body = response.get_data(as_text=True) or None
+
+    return dict(
+        status=response.status_code,
+        headers={k: v for k, v in response.headers.items() if k != 'Content-Length'},
+        body=body
+    )
+
+
+def error_response(code, message):
+    """
+
+    :param code: status code
+    :param message: error description
+    :return: dict like sub_response
+    """
+    return dict(status=code, headers={}, body=dict(message=message))
+
+
+def dispatch(item, allowed):
+    """
+    dispatches a sub request to its view in process, without passing through wsgi:
+    a request context is pushed so that hooks, routing and error handlers work as usual
+
+    :param item: dict with method, url, body and headers
+    :param allowed: function that tells if an endpoint can be called
+    :return: dict like sub_response
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('url'), str) or not item['url'].startswith('/'):
+        return error_response(status.BAD_REQUEST, "'url' is required and must be absolute")
+
+    # headers of the batch request, i.e. Authorization and Cookie, are defaults of every sub request
+    inherited = {k: v for k, v in flask.request.headers.items() if k.lower() not in NOT_INHERITED_HEADERS}
+    headers = {**inherited, 'Accept': 'application/json', **(item.get('headers') or {})}
+    options = dict(
+        method=(item.get('method') or 'GET').upper(),
+        base_url=flask.request.host_url,
+        headers=headers
+    )
+    if item.get('body') is not None:
+        options['json'] = item['body']
+
+    with cap.test_request_context(item['url'], **options):
+        rule = flask.request.url_rule
+        if rule is not None and not allowed(rule.endpoint):
+            return error_response(status.NOT_FOUND, "'{}' can not be called in batch".format(item['url']))
+
+        try:
+            response = cap.full_dispatch_request()
+        except Exception as exc:  # pragma: no cover
+            cap.logger.exception(exc)
+            return error_response(status.INTERNAL_SERVER_ERROR, str(exc))
+
+        return sub_response(response)
+
+
+def execute(session, items, allowed, atomic=False):
+    """
+    executes sub requests in a single transaction, every one within a savepoint,
+    commits are released savepoints so the only commit is the final one.
+    Cached data of written models is invalidated after the final commit, so that
+    concurrent readers can not cache uncommitted data again
+
+    :param session: database session
+    :param items: list of sub requests
+    :param allowed: function that tells if an endpoint can be called
+    :param atomic: if True a failed sub request rolls back all and stops the batch
+    :return: list of sub responses, status code of batch
+    """
+    responses = []
+    invalidated = set()
+    flask.g.autocrud_batch = invalidated
+
+    try:
+        begin(session)
+        for item in items:
+            session.begin_nested()
+            res = dispatch(item, allowed)
+            failed = res['status'] >= status.BAD_REQUEST
+            end_savepoint(session, commit=not failed)
+            responses.append(res)
+
+            if failed and atomic:
+                session.rollback()
+                return responses, res['status']
+
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        flask.g.autocrud_batch = None
+
+    for service, model in invalidated:
+        service._invalidate(model)
+
+    return responses, status.SUCCESS
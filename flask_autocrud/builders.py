@@ -0,0 +1,37 @@
+from flask import json
+from flask_response_builder.builders.builder import Builder
+from flask_response_builder.builders.encoders import JsonEncoder
+
+
+class NdJsonBuilder(Builder):
+    def _build(self, data, **kwargs):
+        """
+
+        :param data: list of objects, one per line, or a single object
+        :return:
+        """
+        return self.to_me(data, **kwargs)
+
+    @staticmethod
+    def to_me(data, **kwargs):
+        """
+
+        :param data:
+        :return:
+        """
+        kwargs.setdefault('cls', JsonEncoder)
+        kwargs.setdefault('separators', (',', ':'))
+
+        if not isinstance(data, (list, tuple)):
+            data = (data,)
+
+        return "".join(json.dumps(i, **kwargs) + "\n" for i in data)
+
+    @staticmethod
+    def to_dict(data, **kwargs):
+        """
+
+        :param data:
+        :return:
+        """
+        return [json.loads(line, **kwargs) for line in data.splitlines() if line.strip()]
@@ -0,0 +1,334 @@
+from collections import OrderedDict
+
+from sqlalchemy import Integer, UniqueConstraint, literal, literal_column, select, text
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.inspection import inspect
+from sqlalchemy.sql.dml import Insert
+
+
+SQLITE_UPSERT_VERSION = (3, 24, 0)
+
+
+def supports_returning(dialect):
+    """
+
+    :param dialect: sqlalchemy dialect
+    :return: True if a multi values insert can return primary keys
+    """
+    return dialect.name == 'postgresql' and bool(dialect.implicit_returning)
+
+
+def chunks(items, size):
+    """
+
+    :param items: list
+    :param size: max length of every chunk, 0 means one chunk
+    :return: generator of lists
+    """
+    size = size or len(items) or 1
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def to_row(model, item):
+    """
+    converts model attributes into table columns, the initial version
+    is set here because core statements do not apply the mapper generator
+
+    :param model: model class
+    :param item: dict of attributes
+    :return: dict of columns
+    """
+    mapper = inspect(model)
+    row = {mapper.column_attrs[k].columns[0].key: v for k, v in item.items()}
+
+    version = mapper.version_id_col
+    if version is not None and mapper.version_id_generator is not False and version.key not in row:
+        row[version.key] = mapper.version_id_generator(None)
+
+    return row
+
+
+def derives_keys(dialect, table, pk):
+    """
+    generated keys of a batch are consecutive on SQLite, that locks the database while writing,
+    and on MySQL for a multi values insert, so they are derived from the last inserted id
+
+    :param dialect: sqlalchemy dialect
+    :param table: table object
+    :param pk: primary key column
+    :return: True if generated keys can be derived
+    """
+    return (
+        dialect.name in ('sqlite', 'mysql')
+        and len(table.primary_key.columns) == 1
+        and isinstance(pk.type, Integer)
+    )
+
+
+def insert_generated(session, table, rows):
+    """
+
+    :param session: database session
+    :param table: table object
+    :param rows: list of dict of columns without primary key
+    :return: generated primary keys
+    """
+    if session.bind.dialect.name == 'mysql':
+        session.execute(table.insert().values(rows))
+        first = session.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+    else:
+        session.execute(table.insert(), rows)
+        first = session.execute(text("SELECT last_insert_rowid()")).scalar() - len(rows) + 1
+    return list(range(first, first + len(rows)))
+
+
+def insert_many(session, model, items, chunk_size):
+    """
+    inserts rows in batches: multi values insert with returning where supported
+    otherwise executemany, generated keys are derived from last inserted id
+    on SQLite and MySQL and are not known on other databases.
+    Items are grouped by their fields because a statement is compiled once for all rows
+
+    :param session: database session
+    :param model: model class
+    :param items: list of validated dict of attributes
+    :param chunk_size: rows inserted by a single statement
+    :return: primary key of every item, None if not known
+    """
+    table = model.__table__
+    pk_field = model.primary_key_field()
+    pk = inspect(model).column_attrs[pk_field].columns[0]
+    returning = supports_returning(session.bind.dialect)
+    derived = derives_keys(session.bind.dialect, table, pk)
+
+    groups = OrderedDict()
+    for n, i in enumerate(items):
+        groups.setdefault(tuple(sorted(i.keys())), []).append(n)
+
+    pks = [i.get(pk_field) for i in items]
+    for indexes in groups.values():
+        for chunk in chunks(indexes, chunk_size):
+            rows = [to_row(model, items[n]) for n in chunk]
+            if returning:
+                result = session.execute(table.insert().values(rows).returning(pk))
+                for n, r in zip(chunk, result):
+                    pks[n] = r[0]
+            elif pks[chunk[0]] is None and derived:
+                for n, key in zip(chunk, insert_generated(session, table, rows)):
+                    pks[n] = key
+            else:
+                session.execute(table.insert(), rows)
+
+    return pks
+
+
+class SQLiteUpsert(Insert):
+    """
+    INSERT ... ON CONFLICT DO UPDATE of sqlite 3.24+, not provided by sqlalchemy 1.3 dialect
+    """
+
+    def __init__(self, table, index_elements, set_):
+        """
+
+        :param table: table object
+        :param index_elements: columns of conflict target
+        :param set_: dict of column key and sql expression
+        """
+        super().__init__(table)
+        self.index_elements = index_elements
+        self.update_set = set_
+
+
+@compiles(SQLiteUpsert, 'sqlite')
+def _compile_sqlite_upsert(element, compiler, **kwargs):
+    """
+
+    :param element: SQLiteUpsert instance
+    :param compiler: sql compiler
+    :return: sql string
+    """
+    sql = compiler.visit_insert(element, **kwargs)
+    quote = compiler.preparer.quote
+    target = ", ".join(quote(c.name) for c in element.index_elements)
+
+    if not element.update_set:
+        return "{} ON CONFLICT ({}) DO NOTHING".format(sql, target)
+
+    return "{} ON CONFLICT ({}) DO UPDATE SET {}".format(sql, target, ", ".join(
+        "{} = {}".format(quote(element.table.c[k].name), compiler.process(v, **kwargs))
+        for k, v in element.update_set.items()
+    ))
+
+
+def conflict_target(table, row):
+    """
+
+    :param table: table object
+    :param row: dict of columns
+    :return: columns of primary key or of the first unique constraint given by row
+    """
+    candidates = [table.primary_key.columns]
+    candidates += [c.columns for c in table.constraints if isinstance(c, UniqueConstraint)]
+    candidates += [i.columns for i in table.indexes if i.unique]
+
+    for columns in candidates:
+        if len(columns) > 0 and all(c.key in row for c in columns):
+            return list(columns)
+
+    return None
+
+
+def next_version(mapper):
+    """
+    integer versions are incremented by the database, others are generated
+
+    :param mapper: model mapper with version_id_col
+    :return: sql expression
+    """
+    column = mapper.version_id_col
+    if column.type.python_type is int:
+        return column + 1
+    return literal(mapper.version_id_generator(None), type_=column.type)
+
+
+def update_values(model, row, target):
+    """
+    values set when the row already exists: given columns, version incremented
+    and onupdate defaults, because core statements do not apply them
+
+    :param model: model class
+    :param row: dict of columns
+    :param target: columns of conflict target
+    :return: dict of column key and sql expression
+    """
+    mapper = inspect(model)
+    keys = [c.key for c in target]
+    values = {}
+
+    for c in model.__table__.columns:
+        if c.key in keys:
+            continue
+        if c is mapper.version_id_col and mapper.version_id_generator is not False:
+            values[c.key] = next_version(mapper)
+        elif c.key in row:
+            values[c.key] = literal(row[c.key], type_=c.type)
+        elif c.onupdate is not None and not c.onupdate.is_sequence:
+            arg = c.onupdate.arg
+            if c.onupdate.is_callable:
+                values[c.key] = literal(arg(None), type_=c.type)
+            elif c.onupdate.is_clause_element:
+                values[c.key] = arg
+            else:
+                values[c.key] = literal(arg, type_=c.type)
+
+    return values
+
+
+def upsert(session, model, item):
+    """
+    inserts or updates a row in one statement with dialect native upsert:
+    postgresql and sqlite ON CONFLICT DO UPDATE, mysql ON DUPLICATE KEY UPDATE
+
+    :param session: database session
+    :param model: model class
+    :param item: validated dict of attributes
+    :return: primary key of the row, True if it was inserted
+    :raise ValueError: if item does not give primary key or unique columns
+    :raise NotImplementedError: if dialect has no native upsert
+    """
+    table = model.__table__
+    dialect = session.bind.dialect.name
+    if dialect == 'sqlite':
+        version = getattr(session.bind.dialect.dbapi, 'sqlite_version_info', (0,))
+        if tuple(version) < SQLITE_UPSERT_VERSION:
+            raise NotImplementedError("upsert requires sqlite 3.24 or later")
+    pk_field = model.primary_key_field()
+    pk = inspect(model).column_attrs[pk_field].columns[0]
+
+    row = to_row(model, item)
+    target = conflict_target(table, row)
+    if target is None:
+        raise ValueError("primary key or unique columns are required")
+
+    def existing():
+        return session.query(pk).filter(*[c == row[c.key] for c in target]).scalar()
+
+    values = update_values(model, row, target)
+    if dialect == 'postgresql':
+        stm = postgresql.insert(table).values(row)
+        if values:
+            stm = stm.on_conflict_do_update(index_elements=target, set_=values)
+        else:
+            stm = stm.on_conflict_do_nothing(index_elements=target)
+        # xmax is 0 only for rows inserted by the statement
+        result = session.execute(stm.returning(pk, literal_column('xmax = 0'))).first()
+        if result is not None:
+            return result[0], bool(result[1])
+        created = False
+    elif dialect == 'sqlite':
+        # the existence check runs in the same transaction of the upsert
+        created = existing() is None
+        session.execute(SQLiteUpsert(table, target, values).values(row))
+    elif dialect == 'mysql':
+        stm = mysql.insert(table).values(row)
+        result = session.execute(stm.on_duplicate_key_update(**(values or {pk.name: pk})))
+        # affected rows are 1 for an insert, 2 for an update and 0 for an unchanged row
+        created = result.rowcount == 1
+    else:
+        raise NotImplementedError("upsert not supported by {}".format(dialect))
+
+    if pk.key in row:
+        return row[pk.key], created
+
+    return existing(), created
+
+
+def by_keys(query, model):
+    """
+    UPDATE and DELETE with joins are rejected by some databases (i.e. SQLite):
+    rows of a query on more tables are selected by primary key in a subquery
+
+    :param query: query with filters applied
+    :param model: model class
+    :return: query on model table only
+    """
+    froms = query.statement.froms
+    if len(froms) == 1 and froms[0] is model.__table__:
+        return query
+
+    pk = getattr(model, model.primary_key_field())
+    keys = query.with_entities(pk.label('pk')).subquery()
+    # derived table: MySQL does not select from the updated table in a subquery
+    return query.session.query(model).filter(pk.in_(select([keys.c.pk])))
+
+
+def update_many(query, model, item):
+    """
+    single UPDATE ... WHERE of rows selected by query, version is incremented
+    and onupdate defaults are applied by core
+
+    :param query: query with filters applied
+    :param model: model class
+    :param item: validated dict of attributes
+    :return: number of rows matched
+    """
+    mapper = inspect(model)
+    values = {mapper.column_attrs[k].columns[0]: v for k, v in item.items()}
+
+    if mapper.version_id_col is not None and mapper.version_id_generator is not False:
+        values[mapper.version_id_col] = next_version(mapper)
+
+    return by_keys(query, model).update(values, synchronize_session=False)
+
+
+def delete_many(query, model):
+    """
+    single DELETE ... WHERE of rows selected by query
+
+    :param query: query with filters applied
+    :param model: model class
+    :return: number of rows matched
+    """
+    return by_keys(query, model).delete(synchronize_session=False)
@@ -0,0 +1,453 @@
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class BaseCache(ABC):
+    """
+    interface of cache backends: entries are tagged with the models they depend on
+    in order to be invalidated on writes, expired entries can be served as stale
+    """
+
+    @abstractmethod
+    def __len__(self):
+        """
+
+        :return: number of entries
+        """
+
+    @abstractmethod
+    def get_entry(self, key):
+        """
+
+        :param key:
+        :return: value and stale flag, value is None if missing or expired
+        """
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: None if missing or expired
+        """
+        value, stale = self.get_entry(key)
+        return None if stale else value
+
+    @abstractmethod
+    def set(self, key, value, tags=(), ttl=None):
+        """
+
+        :param key:
+        :param value:
+        :param tags: names of models the value depends on
+        :param ttl: overrides default ttl
+        """
+
+    @abstractmethod
+    def start_refresh(self, key):
+        """
+        prevents that many requests refresh the same stale entry
+
+        :param key:
+        :return: True if the caller has to refresh the entry
+        """
+
+    @abstractmethod
+    def end_refresh(self, key):
+        """
+
+        :param key:
+        """
+
+    @abstractmethod
+    def invalidate(self, tag):
+        """
+        removes every entry tagged with the given model name
+
+        :param tag:
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+
+        """
+
+
+class MemoryCache(BaseCache):
+    def __init__(self, maxsize=1024, ttl=60, stale_ttl=0):
+        """
+        in process LRU cache with expiration, every entry is tagged
+        with the models it depends on in order to be invalidated on writes
+
+        :param maxsize: max number of entries, the least recently used is removed first
+        :param ttl: seconds before an entry expires
+        :param stale_ttl: seconds an expired entry can still be served while it is refreshed
+        """
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._stale_ttl = stale_ttl
+        self._data = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+
+        :return: number of entries, expired ones included
+        """
+        return len(self._data)
+
+    def get_entry(self, key):
+        """
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None, False
+
+            value, expire, _ = item
+            now = time.monotonic()
+            if expire + self._stale_ttl < now:
+                del self._data[key]
+                return None, False
+
+            self._data.move_to_end(key)
+            return value, expire < now
+
+    def set(self, key, value, tags=(), ttl=None):
+        """
+
+        :param key:
+        :param value:
+        :param tags:
+        :param ttl:
+        """
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self._maxsize > 0:
+                self._data.popitem(last=False)
+
+            self._data[key] = (value, time.monotonic() + ttl, frozenset(tags))
+            self._refreshing.discard(key)
+
+    def start_refresh(self, key):
+        """
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        """
+
+        :param key:
+        """
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, tag):
+        """
+
+        :param tag:
+        """
+        with self._lock:
+            for k in [k for k, v in self._data.items() if tag in v[2]]:
+                del self._data[k]
+
+    def clear(self):
+        """
+
+        """
+        with self._lock:
+            self._data.clear()
+            self._refreshing.clear()
+
+
+def _canonical(value):
+    """
+    json serialization of values found in cache keys
+
+    :param value: bytes, set or any other object
+    :return: json serializable value
+    """
+    if isinstance(value, bytes):
+        return dict(bytes=value.hex())
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return str(value)
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, path, secret, namespace='', maxsize=1024, ttl=60, stale_ttl=0):
+        """
+        cache shared by all processes of a host via a sqlite file: every worker reads
+        the entries stored by the others and invalidations are seen by all of them.
+        Entries are signed, those not signed with secret are ignored
+
+        :param path: database file, readable and writable only by the owner if created
+        :param secret: key used to sign entries, i.e. SECRET_KEY of the app
+        :param namespace: prefix of keys and tags, apps sharing the file see only their own entries
+        :param maxsize: max number of entries, the oldest is removed first
+        :param ttl: seconds before an entry expires
+        :param stale_ttl: seconds an expired entry can still be served while it is refreshed
+        """
+        if not path:
+            raise ValueError("path of sqlite cache is required")
+        if not secret:
+            raise ValueError("secret of sqlite cache is required")
+
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._stale_ttl = stale_ttl
+        self._path = path
+        self._secret = secret.encode() if isinstance(secret, str) else secret
+        self._namespace = namespace
+        self._local = threading.local()
+
+        os.close(os.open(self._path, os.O_CREAT | os.O_RDWR, 0o600))
+
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value BLOB, expire REAL, refreshing INTEGER DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_entry_expire ON cache_entry (expire)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_tag ("
+                "key TEXT, tag TEXT, PRIMARY KEY (tag, key)) WITHOUT ROWID"
+            )
+
+    def _connection(self):
+        """
+        one connection per thread and per process: connections must not be shared after fork
+
+        :return:
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _hash(self, key):
+        """
+        digest of canonical json, the same in every process unlike pickle of sets
+
+        :param key:
+        :return:
+        """
+        data = json.dumps([self._namespace, key], sort_keys=True, default=_canonical)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def _tag(self, tag):
+        """
+
+        :param tag:
+        :return:
+        """
+        return "{}:{}".format(self._namespace, tag)
+
+    def _dumps(self, value):
+        """
+
+        :param value:
+        :return: signature followed by pickled value
+        """
+        data = pickle.dumps(value, protocol=4)
+        return hmac.new(self._secret, data, hashlib.sha256).digest() + data
+
+    def _loads(self, payload):
+        """
+
+        :param payload: as returned by _dumps
+        :return: value, None if signature does not match
+        """
+        signature, data = payload[:32], payload[32:]
+        if not hmac.compare_digest(signature, hmac.new(self._secret, data, hashlib.sha256).digest()):
+            return None
+        return pickle.loads(data)
+
+    def __len__(self):
+        """
+
+        :return:
+        """
+        return self._connection().execute(
+            "SELECT COUNT(DISTINCT key) FROM cache_tag WHERE tag LIKE ?", (self._tag('%'),)
+        ).fetchone()[0]
+
+    def get_entry(self, key):
+        """
+
+        :param key:
+        :return:
+        """
+        row = self._connection().execute(
+            "SELECT value, expire FROM cache_entry WHERE key = ? AND expire >= ?",
+            (self._hash(key), time.time() - self._stale_ttl)
+        ).fetchone()
+
+        value = self._loads(row[0]) if row is not None else None
+        if value is None:
+            return None, False
+
+        return value, row[1] < time.time()
+
+    def set(self, key, value, tags=(), ttl=None):
+        """
+
+        :param key:
+        :param value:
+        :param tags:
+        :param ttl:
+        """
+        h = self._hash(key)
+        ttl = self._ttl if ttl is None else ttl
+        conn = self._connection()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entry (key, value, expire, refreshing) VALUES (?, ?, ?, 0)",
+                (h, self._dumps(value), time.time() + ttl)
+            )
+            conn.execute("DELETE FROM cache_tag WHERE key = ?", (h,))
+            conn.executemany("INSERT INTO cache_tag (key, tag) VALUES (?, ?)", [(h, self._tag(t)) for t in set(tags)])
+
+            if self._maxsize > 0:
+                self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn):
+        """
+        removes expired entries and the oldest ones over maxsize
+
+        :param conn: connection in transaction
+        """
+        now = time.time()
+        conn.execute("DELETE FROM cache_entry WHERE expire < ?", (now - self._stale_ttl,))
+
+        exceeding = conn.execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0] - self._maxsize
+        if exceeding > 0:
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN "
+                "(SELECT key FROM cache_entry ORDER BY expire LIMIT ?)", (exceeding,)
+            )
+
+        conn.execute("DELETE FROM cache_tag WHERE key NOT IN (SELECT key FROM cache_entry)")
+
+    def start_refresh(self, key):
+        """
+
+        :param key:
+        :return:
+        """
+        cur = self._connection().execute(
+            "UPDATE cache_entry SET refreshing = 1 WHERE key = ? AND refreshing = 0", (self._hash(key),)
+        )
+        return cur.rowcount == 1
+
+    def end_refresh(self, key):
+        """
+
+        :param key:
+        """
+        self._connection().execute(
+            "UPDATE cache_entry SET refreshing = 0 WHERE key = ?", (self._hash(key),)
+        )
+
+    def invalidate(self, tag):
+        """
+
+        :param tag:
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_tag WHERE tag = ?)", (self._tag(tag),)
+            )
+            conn.execute("DELETE FROM cache_tag WHERE tag = ?", (self._tag(tag),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        """
+
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_tag WHERE tag LIKE ?)", (self._tag('%'),)
+            )
+            conn.execute("DELETE FROM cache_tag WHERE key NOT IN (SELECT key FROM cache_entry)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+CACHE_BACKENDS = {
+    'memory': MemoryCache,
+    'sqlite': SQLiteCache,
+}
+
+
+def cache_factory(conf):
+    """
+
+    :param conf: app configuration
+    :return: cache backend instance
+    """
+    backend = conf['AUTOCRUD_CACHE_BACKEND']
+    options = dict(
+        maxsize=conf['AUTOCRUD_CACHE_MAX_SIZE'],
+        ttl=conf['AUTOCRUD_CACHE_TTL'],
+        stale_ttl=conf['AUTOCRUD_CACHE_STALE_TTL']
+    )
+
+    if isinstance(backend, BaseCache):
+        return backend
+    if isinstance(backend, type) and issubclass(backend, BaseCache):
+        return backend(**options)
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(
+            "'AUTOCRUD_CACHE_BACKEND' must be one of: {}".format(', '.join(CACHE_BACKENDS))
+        )
+
+    if backend == 'sqlite':
+        if not conf['AUTOCRUD_CACHE_PATH'] or not conf.get('SECRET_KEY'):
+            raise ValueError("'sqlite' cache backend requires 'AUTOCRUD_CACHE_PATH' and 'SECRET_KEY'")
+
+        options['path'] = conf['AUTOCRUD_CACHE_PATH']
+        options['secret'] = conf['SECRET_KEY']
+        options['namespace'] = hashlib.sha1("{}|{}|{}".format(
+            conf.get('SQLALCHEMY_DATABASE_URI'), conf.get('AUTOCRUD_SUBDOMAIN'), conf.get('AUTOCRUD_BASE_URL')
+        ).encode()).hexdigest()
+    return CACHE_BACKENDS[backend](**options)
@@ -0,0 +1,176 @@
+import datetime
+import decimal
+import io
+
+try:
+    import pyarrow
+    from pyarrow import ipc, parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+FORMATS = {
+    'arrow':   ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# rows of a parquet row group: small groups compress poorly and slow down readers
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+
+
+def available():
+    """
+
+    :return: True if pyarrow is installed
+    """
+    return pyarrow is not None
+
+
+def arrow_type(column):
+    """
+    maps a sqlalchemy column to the arrow type
+
+    :param column: model column
+    :return: arrow data type
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return pyarrow.string()
+
+    if python_type is bool:
+        return pyarrow.bool_()
+    if python_type is int:
+        return pyarrow.int64()
+    if python_type is float:
+        return pyarrow.float64()
+    if python_type is decimal.Decimal:
+        precision = getattr(column.type, 'precision', None)
+        scale = getattr(column.type, 'scale', None)
+        if precision:
+            return pyarrow.decimal128(precision, scale or 0)
+        return pyarrow.float64()
+    if python_type is datetime.datetime:
+        return pyarrow.timestamp('us')
+    if python_type is datetime.date:
+        return pyarrow.date32()
+    if python_type is datetime.time:
+        return pyarrow.time64('us')
+    if python_type is datetime.timedelta:
+        return pyarrow.duration('us')
+    if python_type is bytes:
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+def schema(model, fields):
+    """
+
+    :param model: model class
+    :param fields: list of columns name
+    :return: arrow schema
+    """
+    columns = model.columns()
+    return pyarrow.schema([
+        pyarrow.field(f, arrow_type(columns[f]), nullable=bool(columns[f].nullable)) for f in fields
+    ])
+
+
+def record_batches(result, arrow_schema, chunk_size):
+    """
+    builds record batches straight from database cursor chunks
+
+    :param result: core result proxy
+    :param arrow_schema: schema of batches
+    :param chunk_size: rows fetched at once
+    :return: generator of record batches
+    """
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        arrays = []
+        for i, field in enumerate(arrow_schema):
+            values = [r[i] for r in rows]
+            if pyarrow.types.is_floating(field.type):
+                values = [float(v) if v is not None else None for v in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+
+        yield pyarrow.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+
+
+class _Sink(io.RawIOBase):
+    """
+    write only buffer that can be drained without resetting its position,
+    parquet writer uses the position to build the footer
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _writer(fmt, sink, arrow_schema):
+    """
+
+    :param fmt: arrow or parquet
+    :param sink: file like object
+    :param arrow_schema:
+    :return:
+    """
+    if fmt == 'parquet':
+        return parquet.ParquetWriter(sink, arrow_schema)
+    return ipc.new_stream(sink, arrow_schema)
+
+
+def columnar_stream(fmt, batches, arrow_schema, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    writes batches as arrow ipc stream or parquet file, every arrow batch is sent when ready,
+    parquet batches are buffered until a row group is full
+
+    :param fmt: arrow or parquet
+    :param batches: iterable of record batches
+    :param arrow_schema:
+    :param row_group_size: rows of a parquet row group
+    :return: generator of bytes
+    """
+    sink = _Sink()
+    writer = _writer(fmt, sink, arrow_schema)
+    pending, rows = [], 0
+
+    for b in batches:
+        if fmt != 'parquet':
+            writer.write_batch(b)
+            yield sink.drain()
+            continue
+
+        pending.append(b)
+        rows += b.num_rows
+        if rows >= row_group_size:
+            table = pyarrow.Table.from_batches(pending, schema=arrow_schema)
+            full = rows - rows % row_group_size
+            writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+            pending, rows = table.slice(full).to_batches(), rows - full
+            yield sink.drain()
+
+    if rows:
+        writer.write_table(pyarrow.Table.from_batches(pending, schema=arrow_schema), row_group_size=row_group_size)
+    writer.close()
+    yield sink.drain()
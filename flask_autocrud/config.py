@@ -8,14 +8,17 @@ class HttpStatus:
     CREATED = 201
     NO_CONTENT = 204
     PARTIAL_CONTENT = 206
+    MULTI_STATUS = 207
     NOT_MODIFIED = 304
     BAD_REQUEST = 400
     NOT_FOUND = 404
     CONFLICT = 409
     PRECONDITION_FAILED = 412
+    PAYLOAD_TOO_LARGE = 413
     UNPROCESSABLE_ENTITY = 422
     PRECONDITION_REQUIRED = 428
     INTERNAL_SERVER_ERROR = 500
+    NOT_IMPLEMENTED = 501
 
 
 ALLOWED_METHODS = {
@@ -48,6 +51,38 @@ def set_default_config(app):
     app.config.setdefault('AUTOCRUD_EXPORT_ENABLED', True)
     app.config.setdefault('AUTOCRUD_QUERY_STRING_FILTERS_ENABLED', True)
     app.config.setdefault('AUTOCRUD_CONDITIONAL_REQUEST_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_COUNT_POLICY', 'exact')
+    app.config.setdefault('AUTOCRUD_COUNT_CACHE_TTL', 60)
+    app.config.setdefault('AUTOCRUD_WINDOW_COUNT_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_STREAM_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_STREAM_CHUNK_SIZE', 100)
+    app.config.setdefault('AUTOCRUD_EXPORT_UNLIMITED', False)
+    app.config.setdefault('AUTOCRUD_CACHE_ENABLED', False)
+    app.config.setdefault('AUTOCRUD_CACHE_TTL', 60)
+    app.config.setdefault('AUTOCRUD_CACHE_STALE_TTL', 0)
+    app.config.setdefault('AUTOCRUD_CACHE_MAX_SIZE', 1024)
+    app.config.setdefault('AUTOCRUD_CACHE_BACKEND', 'memory')
+    app.config.setdefault('AUTOCRUD_CACHE_PATH', None)
+    app.config.setdefault('AUTOCRUD_QUERY_PLAN_CACHE_SIZE', 256)
+    app.config.setdefault('AUTOCRUD_READ_ENGINE', 'orm')
+    app.config.setdefault('AUTOCRUD_RELATED_STRATEGY', 'selectin')
+    app.config.setdefault('AUTOCRUD_SEARCH_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_SEARCH_BACKEND', 'auto')
+    app.config.setdefault('AUTOCRUD_SEARCH_LANGUAGE', 'simple')
+    app.config.setdefault('AUTOCRUD_AGGREGATE_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_DISTINCT_ENABLED', True)
+    app.config.setdefault('AUTOCRUD_DISTINCT_URL', '/_distinct')
+    app.config.setdefault('AUTOCRUD_OPTIMISTIC_INSERT', False)
+    app.config.setdefault('AUTOCRUD_BULK_MAX_SIZE', 1000)
+    app.config.setdefault('AUTOCRUD_BULK_CHUNK_SIZE', 500)
+    app.config.setdefault('AUTOCRUD_BULK_MAX_ROWS', 1000)
+    app.config.setdefault('AUTOCRUD_BATCH_ENABLED', False)
+    app.config.setdefault('AUTOCRUD_BATCH_URL', '/batch')
+    app.config.setdefault('AUTOCRUD_BATCH_MAX_SIZE', 100)
+    app.config.setdefault('AUTOCRUD_INDEX_ADVISOR_ENABLED', False)
+    app.config.setdefault('AUTOCRUD_INDEX_ADVISOR_URL', '/_admin/index-advice')
+    app.config.setdefault('AUTOCRUD_AUTO_INDEX', False)
+    app.config.setdefault('AUTOCRUD_AUTO_INDEX_THRESHOLD', 10)
 
     app.url_map.converters.update({
         'str': UnicodeConverter,
@@ -87,6 +122,15 @@ scalarFields = namedtuple(
         'related',
         'as_table',
         'no_links',
+        'cursor',
+        'no_count',
+        'stream',
+        'format',
+        'links',
+        'search',
+        'group',
+        'agg',
+        'prefix',
     )
 )
 
@@ -106,7 +150,16 @@ class Fields:
         export='_export',
         related='_related',
         as_table='_as_table',
-        no_links='_no_links'
+        no_links='_no_links',
+        cursor='_cursor',
+        no_count='_no_count',
+        stream='_stream',
+        format='_format',
+        links='_links',
+        search='_search',
+        group='_group',
+        agg='_agg',
+        prefix='_prefix',
     )
 
     vector = vectorFields(
@@ -0,0 +1,246 @@
+from sqlalchemy import Table
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import ColumnProperty, RelationshipProperty
+
+from . import config
+from .serializer import Row
+
+READ_ENGINES = (
+    'orm',
+    'core',
+)
+
+LAZY_STRATEGIES = ('select', True, 'dynamic', 'noload', None, 'raise', 'raise_on_sql')
+
+
+def supported(model, related=None):
+    """
+    rows can be read without ORM only if instances would not load anything else:
+    eager relationships, polymorphic mappings and composites are left to ORM
+
+    :param model: model class
+    :param related: names of related models to load
+    :return:
+    """
+    models = [model] + [model.related(name)[0].property.mapper.class_ for name in related or ()]
+    for m in models:
+        mapper = inspect(m)
+        if (
+            mapper.inherits is not None
+            or mapper.polymorphic_on is not None
+            or len(mapper.composites) > 0
+            or any(r.lazy not in LAZY_STRATEGIES for r in mapper.relationships)
+        ):
+            return False
+
+    return True
+
+
+class Entity(object):
+    __slots__ = ('model', 'keys', 'columns', 'start', 'pks', 'partial')
+
+    def __init__(self, model, fields, start):
+        """
+        columns loaded for a model, ordered as the ORM populates instances:
+        iterating the property set of the mapper
+
+        :param model: model class
+        :param fields: requested fields, primary key is always loaded
+        :param start: position of first column in result rows
+        """
+        mapper = inspect(model)
+        pks = [mapper.get_property_by_column(c).key for c in mapper.primary_key]
+        loaded = set(fields) | set(pks)
+
+        self.model = model
+        self.start = start
+        self.keys = tuple(p.key for p in mapper._prop_set if isinstance(p, ColumnProperty) and p.key in loaded)
+        self.columns = [getattr(model, k) for k in self.keys]
+        self.pks = tuple(start + self.keys.index(k) for k in pks)
+        self.partial = mapper.allow_partial_pks
+
+    def identity(self, row):
+        """
+
+        :param row: result row
+        :return: primary key values, None if row has no instance (i.e. outer join)
+        """
+        ident = tuple(row[i] for i in self.pks)
+        missing = [v is None for v in ident]
+        if all(missing) if self.partial else any(missing):
+            return None
+        return ident
+
+    def data(self, row):
+        """
+
+        :param row: result row
+        :return: dict of loaded columns
+        """
+        return dict(zip(self.keys, row[self.start:self.start + len(self.keys)]))
+
+
+class Related(Entity):
+    __slots__ = ('key', 'uselist')
+
+    def __init__(self, instance, fields, start):
+        """
+
+        :param instance: relationship attribute
+        :param fields: requested fields of related model
+        :param start: position of first column in result rows
+        """
+        super().__init__(instance.property.mapper.class_, fields, start)
+        self.key = instance.key
+        self.uselist = instance.property.uselist
+
+
+class Plan(object):
+    __slots__ = ('entity', 'related', 'order', 'extras', 'statement', 'unique')
+
+    def __init__(self, query, data, syntax=None):
+        """
+        core select of the same rows of an ORM query built by Qs2Sqla.dict2sqla:
+        only loaded columns, joins, filters, sorting and pagination are kept
+
+        :param query: ORM query with a model as first entity, followed by other columns
+        :param data: dict passed to dict2sqla
+        :param syntax: syntax of Qs2Sqla
+        """
+        syntax = syntax or config.default_syntax
+        descriptions = query.column_descriptions
+        model = descriptions[0]['entity']
+        fields = data.get('fields') or list(model.columns().keys())
+
+        self.entity = Entity(model, fields, 0)
+        columns = list(self.entity.columns)
+
+        self.related = []
+        for name, spec in (data.get('related') or {}).items():
+            instance, rel_columns = model.related(name)
+            if not (len(spec) > 0 and spec[0] != syntax.ALL):
+                spec = list(rel_columns)
+
+            rel = Related(instance, spec, len(columns))
+            columns += rel.columns
+            self.related.append(rel)
+
+        joined = {r.key: r for r in self.related}
+        self.order = [
+            joined[p.key] for p in inspect(model)._prop_set
+            if isinstance(p, RelationshipProperty) and p.key in joined
+        ]
+
+        self.extras = range(len(columns), len(columns) + len(descriptions) - 1)
+        columns += [d['expr'] for d in descriptions[1:]]
+
+        stm = query.statement
+        self.statement = stm.with_only_columns([c.label("c{}".format(i)) for i, c in enumerate(columns)])
+        for f in stm.froms:
+            self.statement = self.statement.select_from(f)
+
+        # a single table can not repeat rows, as joins for filters on related models do
+        self.unique = not self.related and len(stm.froms) == 1 and isinstance(stm.froms[0], Table)
+
+    def rows(self, result):
+        """
+        rows are unique as ORM ones: by instance and other columns,
+        related instances are shared and collections have no duplicates
+
+        :param result: iterable of result rows
+        :return: generator of Row, or tuple if query has other columns
+        """
+        if self.unique:
+            for r in result:
+                parent = Row(self.entity.model, self.entity.data(r))
+                yield (parent, *(r[i] for i in self.extras)) if self.extras else parent
+            return
+
+        seen = set()
+        parents = {}
+        instances = {}
+
+        for r in result:
+            ident = self.entity.identity(r)
+            extras = tuple(r[i] for i in self.extras)
+            if not self.related:
+                if (ident, extras) not in seen:
+                    seen.add((ident, extras))
+                    parent = Row(self.entity.model, self.entity.data(r))
+                    yield (parent, *extras) if self.extras else parent
+                continue
+
+            parent = parents.get(ident)
+            if parent is None:
+                parent = Row(self.entity.model, self.entity.data(r))
+                parents[ident] = parent
+                for rel in self.order:
+                    parent.data[rel.key] = [] if rel.uselist else self._instance(rel, r, instances)
+
+            for rel in self.related:
+                if rel.uselist:
+                    child = self._instance(rel, r, instances)
+                    if child is not None and child not in parent.data[rel.key]:
+                        parent.data[rel.key].append(child)
+
+            if (ident, extras) not in seen:
+                seen.add((ident, extras))
+                yield (parent, *extras) if self.extras else parent
+
+    @staticmethod
+    def _instance(rel, row, instances):
+        """
+
+        :param rel: Related instance
+        :param row: result row
+        :param instances: loaded rows by model and identity
+        :return: Row or None
+        """
+        ident = rel.identity(row)
+        if ident is None:
+            return None
+
+        key = (rel.model, ident)
+        if key not in instances:
+            instances[key] = Row(rel.model, rel.data(row))
+        return instances[key]
+
+
+def fetch(query, data, syntax=None):
+    """
+
+    :param query: ORM query
+    :param data: dict passed to dict2sqla
+    :param syntax: syntax of Qs2Sqla
+    :return: list like query.all()
+    """
+    plan = Plan(query, data, syntax)
+    return list(plan.rows(query.session.execute(plan.statement)))
+
+
+def iterate(query, data, chunk_size, syntax=None):
+    """
+    fetches rows in chunks with server side cursors, if the driver supports them,
+    all rows are fetched when collections are loaded because parents are not sorted
+
+    :param query: ORM query
+    :param data: dict passed to dict2sqla
+    :param chunk_size: number of rows fetched at once
+    :param syntax: syntax of Qs2Sqla
+    :return: iterator of rows
+    """
+    plan = Plan(query, data, syntax)
+    if plan.related:
+        return iter(list(plan.rows(query.session.execute(plan.statement))))
+
+    # executed now as ORM does, so that errors are raised before the response is started
+    result = query.session.execute(plan.statement.execution_options(stream_results=True))
+
+    def chunks():
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+    return plan.rows(chunks())
@@ -1,18 +1,23 @@
 from sqlalchemy.inspection import inspect
 
 from .config import ALLOWED_METHODS
+from .schema import ModelSchema
+from .serializer import Serializer, generic_to_dict
 
 
 class Model(object):
     __pks__ = None
     __url__ = None
     __cols__ = None
-    __rels__ = None
     __table__ = None
     __hidden__ = []
     __version__ = '1'
+    __version_field__ = None
+    __updated_field__ = None
     __description__ = None
     __methods__ = ALLOWED_METHODS
+    __serializer__ = None
+    __schema__ = None
 
     collection_suffix = 'List'
 
@@ -42,46 +47,69 @@ class Model(object):
                     pass
 
     @classmethod
-    def _load_related(cls, **kwargs):
+    def columns(cls):
         """
 
+        :return:
         """
-        cls.__rels__ = {}
+        if cls.__cols__ is None:
+            cls._load_columns()
 
-        for r in inspect(cls).relationships:
-            try:
-                rel = r.argument.class_
-            except AttributeError:
-                rel = r.argument
+        return cls.__cols__
+
+    @classmethod
+    def required(cls):
+        """
 
-            key = rel.__name__
-            columns = rel().columns()
-            instance = getattr(cls, r.key)
-            cls.__rels__.update({key: dict(instance=instance, columns=columns)})
+        :return:
+        """
+        schema = cls.schema()
+        return schema.ordered(schema.required)
 
     @classmethod
-    def columns(cls):
+    def version_field(cls):
         """
+        the attribute mapped as version_id_col, if any
 
         :return:
         """
-        if cls.__cols__ is None:
-            cls._load_columns()
+        if cls.__version_field__ is None:
+            cls.__version_field__ = ''
+            col = inspect(cls).version_id_col
+            if col is not None:
+                for prop in inspect(cls).column_attrs:
+                    if col in prop.columns:
+                        cls.__version_field__ = prop.key
 
-        return cls.__cols__
+        return cls.__version_field__ or None
 
     @classmethod
-    def required(cls):
+    def updated_field(cls):
         """
+        the attribute that holds the last modification time, if any
 
         :return:
         """
-        columns = []
-        for col, c in cls.columns().items():
-            if not (c.nullable or c.primary_key) or (c.primary_key and not c.autoincrement):
-                columns.append(col)
+        return cls.__updated_field__ or None
 
-        return columns
+    @classmethod
+    def is_versioned(cls):
+        """
+
+        :return: True if ETag can be derived from version or modification time
+        """
+        return bool(cls.version_field() or cls.updated_field())
+
+    @classmethod
+    def version_columns(cls):
+        """
+
+        :return: primary key, version and modification time columns
+        """
+        return [
+            getattr(cls, f) if f else None
+            for f in (cls.primary_key_field(), cls.version_field(), cls.updated_field())
+        ]
 
     @classmethod
     def searchable(cls):
@@ -89,12 +117,8 @@ class Model(object):
 
         :return:
         """
-        columns = []
-        for col, c in cls.columns().items():
-            if c.type.python_type is str:
-                columns.append(col)
-
-        return columns
+        schema = cls.schema()
+        return schema.ordered(schema.searchable)
 
     @classmethod
     def optional(cls):
@@ -102,12 +126,8 @@ class Model(object):
 
         :return:
         """
-        columns = []
-        for col, c in cls.columns().items():
-            if c.nullable:
-                columns.append(col)
-
-        return columns
+        schema = cls.schema()
+        return schema.ordered(schema.optional)
 
     @classmethod
     def primary_key_field(cls):
@@ -127,18 +147,15 @@ class Model(object):
         :param name:
         :return:
         """
-        if not cls.__rels__:
-            cls._load_related(**kwargs)
-
+        related = cls.schema().related
         if name is None:
-            return cls.__rels__
+            return related
 
-        for k in cls.__rels__.keys():
-            if k == name:
-                return cls.__rels__.get(k).get('instance'), \
-                       cls.__rels__.get(k).get('columns')
+        rel = related.get(name)
+        if rel is None:
+            return None, None
 
-        return None, None
+        return rel['instance'], rel['columns']
 
     @classmethod
     def submodel_from_url(cls, url):
@@ -147,14 +164,7 @@ class Model(object):
         :param url:
         :return:
         """
-        for r in inspect(cls).relationships:
-            try:
-                rel = r.argument.class_
-            except AttributeError:
-                rel = r.argument
-
-            if rel.__url__ == url:
-                return rel
+        return cls.schema().submodels.get(url)
 
     @classmethod
     def validate(cls, data):
@@ -162,9 +172,9 @@ class Model(object):
 
         :param data:
         """
-        fields = cls.required() + cls.optional()
-        unknown = [k for k in data if k not in fields]
-        missing = list(set(cls.required()) - set(data.keys()))
+        schema = cls.schema()
+        unknown = [k for k in data if k not in schema.fields]
+        missing = schema.ordered(schema.required - data.keys())
 
         return missing if len(missing) else None, unknown if len(unknown) else None
 
@@ -174,87 +184,78 @@ class Model(object):
 
         :return:
         """
-        related = {}
-        fields = []
-
-        for r in inspect(cls).relationships:
-            try:
-                rel = r.argument.class_
-            except AttributeError:
-                rel = r.argument
-            related.update({rel.__name__: rel.__url__})
-
-        for col, c in cls.columns().items():
-            fields.append(dict(
-                name=col,
-                type=c.type.python_type.__name__,
-                key=c.primary_key,
-                nullable=c.nullable,
-                unique=c.unique,
-                description=c.comment
-            ))
-
-        return dict(
-            url=cls.__url__,
-            name=cls.__name__,
-            methods=list(cls.__methods__),
-            description=cls.__description__ or cls.__table__.comment,
-            related=related,
-            fields=fields
-        )
+        return cls.schema().meta.data
 
-    def to_dict(self, links=False):
+    @classmethod
+    def schema(cls, compile=False):
         """
 
-        :param links:
-        :return:
+        :param compile: compile again, i.e. after urls and methods are set
+        :return: schema compiled for this model
+        """
+        schema = cls.__dict__.get('__schema__')
+        if schema is None or compile:
+            schema = ModelSchema(cls)
+            cls.__schema__ = schema
+
+        return schema
+
+    @classmethod
+    def serializer(cls, compile=False):
+        """
+
+        :param compile: compile again, i.e. after urls of related models are set
+        :return: serializer compiled for this model
         """
-        resp = {}
-        data = self if isinstance(self, dict) else self.__dict__
+        serializer = cls.__dict__.get('__serializer__')
+        if serializer is None or compile:
+            serializer = Serializer(cls)
+            cls.__serializer__ = serializer
 
-        for k, v in data.items():
-            if k.startswith('_') or k in self.__hidden__:
-                continue
+        return serializer
 
-            if isinstance(v, Model):
-                resp.update({v.__class__.__name__: v.to_dict(links)})
-            elif isinstance(v, list):
-                if len(v) > 0:
-                    name = v[0].__class__.__name__ + self.collection_suffix
-                    resp.update({name: [i.to_dict(links) for i in v]})
-            else:
-                resp.update({k: v})
+    def to_dict(self, links=False):
+        """
 
-        if links:
-            resp['_links'] = self.links()
+        :param links:
+        :return:
+        """
+        if isinstance(self, dict):
+            return generic_to_dict(self, links)
 
-        return resp
+        return self.serializer()(self, links)
 
     def links(self):
         """
 
         :return:
         """
-        link_dict = dict(self=self.resource_uri())
-        for r in inspect(self.__class__).relationships:
-            try:
-                key = r.argument.class_.__name__
-                url = r.argument.class_.__url__
-            except AttributeError:
-                key = r.argument.__name__
-                url = r.argument.__url__
+        return self.serializer().links(self)
 
-            link_dict[key] = "{}{}".format(self.resource_uri(), url)
+    @classmethod
+    def link_templates(cls):
+        """
 
-        return link_dict
+        :return: links with primary key field as placeholder
+        """
+        return cls.serializer().templates
 
     def resource_uri(self):
         """
 
         :return:
         """
-        pk = getattr(self, self.primary_key_field())
-        return "{}/{}".format(self.__url__, pk) if pk else None
+        return self.serializer().resource_uri(self)
+
+    def version_info(self):
+        """
+
+        :return: values of primary key, version and modification time
+        """
+        return tuple(
+            getattr(self, f) if f else None
+            for f in (self.primary_key_field(), self.version_field(), self.updated_field())
+        )
 
     def update(self, attributes):
         """
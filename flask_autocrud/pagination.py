@@ -0,0 +1,215 @@
+import json
+import math
+from collections import namedtuple
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import DBAPIError
+
+from .cache import MemoryCache
+
+COUNT_POLICIES = (
+    'exact',
+    'none',
+    'estimated',
+    'cached',
+)
+
+Pagination = namedtuple(
+    'Pagination',
+    ('page_number', 'page_size', 'num_pages', 'total_results', 'has_next')
+)
+
+
+def aggregate_query(query, columns):
+    """
+    builds a lightweight aggregate statement: order by and load options are removed,
+    joins are preserved because they decide which rows belong to the page
+
+    :param query: query with filters applied
+    :param columns: aggregate expressions
+    :return: select statement
+    """
+    stm = query.order_by(None).statement
+    aggregate = stm.with_only_columns(columns).order_by(None)
+
+    for f in stm.froms:
+        aggregate = aggregate.select_from(f)
+
+    return aggregate
+
+
+def count_query(query, key=None):
+    """
+
+    :param query: query with filters applied
+    :param key: primary key column, rows are counted once even if joined to many related rows
+    :return: select count statement
+    """
+    return aggregate_query(query, [func.count(key.distinct()) if key is not None else func.count()])
+
+
+def supports_window(dialect):
+    """
+
+    :param dialect: sqlalchemy dialect
+    :return: True if COUNT(*) OVER () can be used
+    """
+    if dialect.name == 'sqlite':
+        return getattr(dialect.dbapi, 'sqlite_version_info', (0,)) >= (3, 25)
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or (0,)
+        return version >= (8,) or (getattr(dialect, '_is_mariadb', False) and version >= (10, 2))
+    return dialect.name in ('postgresql', 'mssql', 'oracle')
+
+
+def windowed(query, page_number, page_size):
+    """
+    adds the total count of rows as last column of every row of the page
+
+    :param query: query to paginate
+    :param page_number: page to return starts from 1
+    :param page_size: max number of rows
+    :return: paginated query
+    """
+    query = query.add_columns(func.count().over())
+    return query.offset(((page_number or 1) - 1) * page_size).limit(page_size)
+
+
+def estimated_count(session, table):
+    """
+    reads the rows number from the statistics of the database
+
+    :param session: database session
+    :param table: table object
+    :return: None if statistics are not available
+    """
+    dialect = session.bind.dialect.name
+    if dialect == 'sqlite':
+        stm = text("SELECT stat FROM sqlite_stat1 WHERE tbl = :name")
+    elif dialect == 'postgresql':
+        stm = text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)")
+    elif dialect == 'mysql':
+        stm = text(
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = :name"
+        )
+    else:
+        return None
+
+    name = table.name
+    if dialect == 'postgresql' and table.schema:
+        name = "{}.{}".format(table.schema, table.name)
+
+    try:
+        rows = session.execute(stm, dict(name=name)).fetchall()
+    except DBAPIError:
+        session.rollback()
+        return None
+
+    counts = []
+    for r in rows:
+        try:
+            counts.append(int(str(r[0]).split()[0]))
+        except (ValueError, IndexError):
+            pass
+
+    count = max(counts) if counts else None
+    return count if count is not None and count >= 0 else None
+
+
+def paginate(query, page_number=None, page_size=None, total_results=None):
+    """
+    same as sqlalchemy_filters.apply_pagination but the count is given by the caller,
+    if total_results is None one more row is fetched in order to know if there is a next page
+
+    :param query: query to paginate
+    :param page_number: page to return starts from 1
+    :param page_size: max number of rows
+    :param total_results: count of rows or None if unknown
+    :return: paginated query, pagination object
+    """
+    page_number = page_number or 1
+
+    if total_results is None:
+        if page_size is not None:
+            query = query.offset((page_number - 1) * page_size).limit(page_size + 1)
+        return query, Pagination(page_number, page_size, None, None, None)
+
+    if page_size is not None:
+        query = query.limit(page_size)
+
+    if page_size is None or page_size > total_results > 0:
+        page_size = total_results
+
+    if page_size:
+        query = query.offset((page_number - 1) * page_size)
+        num_pages = math.ceil(total_results / page_size)
+    else:
+        num_pages = 0
+
+    return query, Pagination(page_number, page_size, num_pages, total_results, page_number < num_pages)
+
+
+class CountCache:
+    def __init__(self, backend=None, ttl=60):
+        """
+        counts stored into a cache backend, it can be shared with response cache
+
+        :param backend: cache backend, default MemoryCache
+        :param ttl: seconds before a count expires
+        """
+        self._ttl = ttl
+        self._backend = backend or MemoryCache(ttl=ttl)
+
+    @staticmethod
+    def key(model, data):
+        """
+
+        :param model: model class
+        :param data: dict with filters and related as passed to dict2sqla
+        :return: (model name, involved models, normalized filters)
+        """
+        models = {model.__name__}
+        models.update((data.get('related') or {}).keys())
+
+        def walk(f):
+            if isinstance(f, dict):
+                if f.get('model'):
+                    models.add(f.get('model'))
+                for v in f.values():
+                    walk(v)
+            elif isinstance(f, list):
+                for v in f:
+                    walk(v)
+
+        filters = data.get('filters') or []
+        walk(filters)
+
+        normalized = json.dumps(
+            dict(filters=filters, related=sorted((data.get('related') or {}).keys()), search=data.get('search')),
+            sort_keys=True, default=str
+        )
+        return model.__name__, tuple(sorted(models)), normalized
+
+    def get(self, key):
+        """
+
+        :param key: as returned by CountCache.key
+        :return: None if missing or expired
+        """
+        return self._backend.get(('count', *key))
+
+    def set(self, key, value):
+        """
+
+        :param key: as returned by CountCache.key
+        :param value:
+        """
+        self._backend.set(('count', *key), value, tags=key[1], ttl=self._ttl)
+
+    def invalidate(self, model_name):
+        """
+
+        :param model_name:
+        """
+        self._backend.invalidate(model_name)
@@ -1,23 +1,139 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
 import sqlalchemy_filters as sqlaf
+from sqlalchemy import and_, bindparam, or_
 from sqlalchemy.exc import ArgumentError
 from sqlalchemy.orm import contains_eager
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BindParameter
 from sqlalchemy_filters import exceptions
 
 from . import config
+from .search import search_backend
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+PARAM_TYPES = (str, int, float, decimal.Decimal, datetime.date, datetime.time)
+SCALAR_OPS = {
+    '==', 'eq', '!=', 'ne', '>', 'gt', '<', 'lt', '>=', 'ge', '<=', 'le', 'like', 'ilike', 'not_ilike'
+}
+LIST_OPS = {'in', 'not_in'}
+
+
+class QueryPlanCache:
+    def __init__(self, maxsize=256):
+        """
+        in process LRU cache of queries built by Qs2Sqla.dict2sqla,
+        queries are stored without session and filter values are bound parameters
+
+        :param maxsize: max number of plans, the least recently used is removed first
+        """
+        self._hits = 0
+        self._misses = 0
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+
+        :return: number of plans
+        """
+        return len(self._data)
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: None if missing
+        """
+        with self._lock:
+            plan = self._data.get(key)
+            if plan is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._data.move_to_end(key)
+            return plan
+
+    def set(self, key, plan):
+        """
+
+        :param key:
+        :param plan: query and invalid fields
+        """
+        with self._lock:
+            self._data[key] = plan
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def info(self):
+        """
+
+        :return: hits, misses, maxsize and current size
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._maxsize, len(self._data))
+
+    def clear(self):
+        """
+
+        """
+        with self._lock:
+            self._data.clear()
+            self._hits = self._misses = 0
+
+
+def freeze(value):
+    """
+
+    :param value: spec as passed to dict2sqla with bound parameters
+    :return: hashable shape, bound parameters are replaced by their kind and type
+    """
+    if isinstance(value, BindParameter):
+        return 'param', value.expanding, value.type.__class__.__name__
+    if isinstance(value, dict):
+        return 'dict', tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return 'list', tuple(freeze(v) for v in value)
+
+    try:
+        hash(value)
+    except TypeError:
+        return 'value', type(value).__name__, repr(value)
+    return 'value', type(value).__name__, value
 
 
 class Qs2Sqla:
-    def __init__(self, model, syntax=None, arguments=None):
+    def __init__(self, model, syntax=None, arguments=None, plans=None):
         """
 
         :param model:
         :param syntax:
         :param arguments:
+        :param plans: QueryPlanCache instance, None disables the cache
         """
         self._model = model
+        self._plans = plans
         self._syntax = syntax or config.default_syntax
         self._arguments = arguments or config.default_arguments
 
+    @property
+    def model(self):
+        """
+
+        :return:
+        """
+        return self._model
+
     @property
     def syntax(self):
         """
@@ -92,6 +208,140 @@ class Qs2Sqla:
 
         return page, limit, invalid
 
+    def get_cursor(self, conf):
+        """
+
+        :param conf:
+        :return: None if keyset pagination is not requested
+        """
+        return conf.get(self._arguments.scalar.cursor)
+
+    @staticmethod
+    def encode_cursor(values, backward=False):
+        """
+
+        :param values: values of the keyset columns
+        :param backward: True if the cursor points to the previous page
+        :return: opaque token
+        """
+        def to_json(v):
+            if isinstance(v, (datetime.date, datetime.time)):
+                return v.isoformat()
+            return str(v)
+
+        data = json.dumps(dict(v=list(values), b=backward), default=to_json, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token, keys):
+        """
+
+        :param token: opaque token
+        :param keys: list of keyset columns name
+        :return: values of the keyset columns, backward flag
+        """
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            data = json.loads(data.decode())
+            values, backward = data['v'], bool(data.get('b'))
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+            raise ValueError(token)
+
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(token)
+
+        columns = self._model.columns()
+        for i, k in enumerate(keys):
+            if values[i] is None:
+                continue
+            if isinstance(values[i], (list, dict)):
+                raise ValueError(token)
+
+            try:
+                python_type = columns[k].type.python_type
+            except NotImplementedError:
+                continue  # encoded as is
+
+            try:
+                if python_type in (datetime.datetime, datetime.date, datetime.time):
+                    values[i] = python_type.fromisoformat(values[i])
+                elif python_type is decimal.Decimal:
+                    values[i] = decimal.Decimal(values[i])
+            except (ValueError, TypeError, decimal.InvalidOperation):
+                raise ValueError(token)
+
+        return values, backward
+
+    def keyset(self, query, sorting, token, limit):
+        """
+        applies keyset pagination: the query is ordered by sorting fields plus the primary key
+        and the values of these columns for the last row seen are used as seek predicate
+
+        :param query: query with filters already applied
+        :param sorting: list of sort dict as returned by parse
+        :param token: cursor token, empty for first page
+        :param limit: page size
+        :return: query, keys, backward, invalid
+        """
+        invalid = []
+        model = self._model
+        columns = model.columns()
+        pk = model.primary_key_field()
+
+        keys = []
+        for s in sorting:
+            field, direction = s.get('field'), s.get('direction')
+            if s.get('model') not in (None, model.__name__) or field not in columns:
+                invalid.append(field)
+            elif direction not in ('asc', 'desc'):
+                invalid.append(direction)
+            elif field not in dict(keys):
+                keys.append((field, direction))
+
+        if pk not in dict(keys):
+            keys.append((pk, 'asc'))
+
+        values, backward = [], False
+        if token:
+            try:
+                values, backward = self.decode_cursor(token, [k for k, _ in keys])
+            except ValueError:
+                invalid.append(self._arguments.scalar.cursor)
+
+        # NULL is greater than any value: last in ascending order, first in descending order
+        order, seek = [], []
+        for i, (field, direction) in enumerate(keys):
+            col = columns[field]
+            asc = (direction == 'asc') != backward
+            nullable = getattr(col.expression, 'nullable', True)
+            if nullable:
+                order.append(col.is_(None).asc() if asc else col.is_(None).desc())
+            order.append(col.asc() if asc else col.desc())
+
+            if values:
+                cond = [
+                    columns[f].is_(None) if v is None else columns[f] == v
+                    for (f, _), v in zip(keys[:i], values[:i])
+                ]
+                if values[i] is None:
+                    if asc:
+                        continue
+                    cond.append(col.isnot(None))
+                elif asc:
+                    cond.append(or_(col > values[i], col.is_(None)) if nullable else col > values[i])
+                else:
+                    cond.append(col < values[i])
+                seek.append(and_(*cond))
+
+        query = query.order_by(*order)
+        if seek:
+            query = query.filter(or_(*seek))
+
+        query = query.add_columns(*[columns[k] for k, _ in keys])
+        if limit:
+            query = query.limit(limit + 1)
+
+        return query, keys, backward, invalid
+
     def get_filter(self, f, v):
         """
 
@@ -176,8 +426,94 @@ class Qs2Sqla:
                 invalid.append(k)
         return resp, invalid
 
+    def parametrize(self, spec, params):
+        """
+        replaces filter values with bound parameters typed by value as literals are,
+        None and values of other operators are kept because they change the statement (i.e. IS NULL)
+
+        :param spec: filters as returned by parse
+        :param params: dict filled with parameters values
+        :return: filters with bound parameters
+        """
+        if isinstance(spec, list):
+            return [self.parametrize(f, params) for f in spec]
+        if not isinstance(spec, dict):
+            return spec
+        if 'field' not in spec:
+            return {k: self.parametrize(v, params) for k, v in spec.items()}
+
+        value = spec.get('value')
+        op = spec.get('op')
+        if op in SCALAR_OPS and isinstance(value, PARAM_TYPES):
+            expanding = False
+        elif op in LIST_OPS and isinstance(value, list) and value and all(isinstance(v, PARAM_TYPES) for v in value):
+            expanding = True
+        else:
+            return spec
+
+        column = self._model.columns().get(spec.get('field'))
+        if spec.get('model') not in (None, self._model.__name__) or column is None:
+            return spec
+
+        # same type given to literals compared with the column, i.e. strings compared with dates stay strings
+        values = value if expanding else [value]
+        types = {type(v) for v in values}
+        if len(types) > 1:
+            return spec
+        type_ = column.type.coerce_compared_value(operators.eq, values[0])
+
+        name = "qs_{}".format(len(params))
+        params[name] = value
+        return dict(spec, value=bindparam(name, value, type_=type_, expanding=expanding))
+
     def dict2sqla(self, data, **kwargs):
         """
+        with a plan cache, the query is built once for every shape of data:
+        same fields, related, sorting and filters with different values
+
+        :param data:
+        :return:
+        """
+        if self._plans is None:
+            return self._build(data, **kwargs)
+
+        params = {}
+        search = data.get('search')
+        if search:
+            values = []
+            for v in search['values']:
+                name = "qs_{}".format(len(params))
+                params[name] = v
+                values.append(bindparam(name, v))
+            search = dict(search, values=values)
+
+        data = dict(
+            fields=data.get('fields'),
+            related=data.get('related'),
+            filters=self.parametrize(data.get('filters') or [], params),
+            sorting=data.get('sorting'),
+            search=search
+        )
+
+        key = (self._model, freeze(data), freeze(kwargs))
+        plan = self._plans.get(key)
+        if plan is None:
+            query, invalid = self._build(data, **kwargs)
+            if query is not None:
+                query = query.with_session(None)
+            plan = query, tuple(invalid)
+            self._plans.set(key, plan)
+
+        query, invalid = plan
+        if query is not None:
+            query = query.with_session(self._model.query.session)
+            if params:
+                query = query.params(params)
+
+        return query, list(invalid)
+
+    def _build(self, data, **kwargs):
+        """
 
         :param data:
         :return:
@@ -190,6 +526,7 @@ class Qs2Sqla:
         related = data.get('related') or {}
         filters = data.get('filters') or []
         sort = data.get('sorting') or []
+        search = data.get('search')
 
         for k in fields:
             if k not in model.columns().keys():
@@ -241,7 +578,16 @@ class Qs2Sqla:
         for f in filters:
             query = apply(query, f, sqlaf.apply_filters)
 
+        rank = []
+        if search:
+            backend = search_backend(search['backend'], search.get('language'))
+            query, rank = backend.apply(query, model, search['values'])
+
         for s in sort:
             query = apply(query, s, sqlaf.apply_sort)
 
+        # with keyset pagination rows are ordered by keys only
+        if rank and kwargs.get('ranked', True):
+            query = query.order_by(*rank)
+
         return query, invalid
@@ -0,0 +1,215 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Load, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .core import Entity
+from .pagination import supports_window
+from .serializer import Row
+
+STRATEGIES = (
+    'join',
+    'selectin',
+)
+
+PATH_SEP = '.'
+LIMIT_SEP = ':'
+
+
+class Node(object):
+    __slots__ = ('name', 'instance', 'model', 'columns', 'limit', 'children')
+
+    def __init__(self, name, instance, columns):
+        """
+        relationship loaded after parents, with its nested relationships
+
+        :param name: name of related model
+        :param instance: relationship attribute
+        :param columns: fields to load, primary key is always loaded
+        """
+        self.name = name
+        self.instance = instance
+        self.model = instance.property.mapper.class_
+        self.columns = list(columns)
+        self.limit = None
+        self.children = []
+
+    @property
+    def uselist(self):
+        """
+
+        :return: True if relationship is a collection
+        """
+        return self.instance.property.uselist
+
+    def walk(self):
+        """
+
+        :return: generator of this node and of nested ones
+        """
+        yield self
+        for c in self.children:
+            yield from c.walk()
+
+
+def parse(model, related, syntax):
+    """
+    every key is a path of related models separated by dot, each one optionally followed
+    by the max number of children loaded for every parent: Album:10.Track:5
+    Requested fields are applied to the last model of the path, the others load all fields
+
+    :param model: model class
+    :param related: dict of path and requested fields, as passed to dict2sqla
+    :param syntax: syntax of Qs2Sqla
+    :return: list of Node, invalid
+    """
+    nodes, invalid = [], []
+
+    for path, fields in related.items():
+        level, parent = nodes, model
+        parts = path.split(PATH_SEP)
+
+        for i, part in enumerate(parts):
+            name, _, limit = part.partition(LIMIT_SEP)
+            instance, columns = parent.related(name)
+            if instance is None:
+                invalid.append(name)
+                break
+
+            node = next((n for n in level if n.name == name), None)
+            if node is None:
+                node = Node(name, instance, columns.keys())
+                level.append(node)
+
+            if limit:
+                if not limit.isdigit() or int(limit) < 1:
+                    invalid.append(part)
+                    break
+                node.limit = int(limit)
+
+            if i == len(parts) - 1 and len(fields) > 0 and fields[0] != syntax.ALL:
+                unknown = [f for f in fields if f not in columns]
+                if unknown:
+                    invalid += unknown
+                    break
+                node.columns = list(fields)
+
+            level, parent = node.children, node.model
+
+    return nodes, invalid
+
+
+def identity(obj, key):
+    """
+
+    :param obj: model instance or Row
+    :param key: primary key field
+    :return:
+    """
+    return obj.data.get(key) if isinstance(obj, Row) else getattr(obj, key)
+
+
+def children_query(session, model, ids, node, entities):
+    """
+    one query for a relationship of all parents: joined from parents with IN of their keys,
+    a window function limits the children of every parent where supported, otherwise
+    all children are read and limited by load
+
+    :param session: database session
+    :param model: parent model
+    :param ids: primary key values of parents
+    :param node: Node instance
+    :param entities: function that given the aliased model returns what to select and load options
+    :return: query of parent key followed by entities
+    """
+    target = aliased(node.model)
+    parent_key = getattr(model, model.primary_key_field())
+    child_key = getattr(target, node.model.primary_key_field())
+    columns, options = entities(target)
+
+    query = session.query(parent_key, *columns) \
+        .select_from(model) \
+        .join(target, node.instance) \
+        .filter(parent_key.in_(ids)) \
+        .options(*options)
+
+    if node.limit and supports_window(session.bind.dialect):
+        rank = func.row_number().over(partition_by=parent_key, order_by=child_key).label('autocrud_rank')
+        query = query.add_columns(rank).from_self().filter(rank <= node.limit)
+
+    return query.order_by(parent_key, child_key)
+
+
+def full(children, parent, limit):
+    """
+
+    :param children: dict of children by parent key
+    :param parent: parent key
+    :param limit: max number of children of a parent, None means no limit
+    :return: True if no other child can be added to parent
+    """
+    return bool(limit) and len(children.get(parent, ())) >= limit
+
+
+def attach(parent, node, children):
+    """
+
+    :param parent: model instance or Row
+    :param node: Node instance
+    :param children: list of children of parent
+    """
+    value = children if node.uselist else (children[0] if children else None)
+    if isinstance(parent, Row):
+        parent.data[node.instance.key] = value
+    else:
+        set_committed_value(parent, node.instance.key, value)
+
+
+def load(session, model, parents, nodes):
+    """
+    loads related models of parents with a query for every relationship, whatever
+    the number of parents, nested ones are loaded for all children at once.
+    Model instances get children instances, Row objects get Row children
+
+    :param session: database session
+    :param model: model class of parents
+    :param parents: list of model instances or Row
+    :param nodes: list of Node
+    """
+    if not parents or not nodes:
+        return
+
+    pk = model.primary_key_field()
+    ids = list({identity(p, pk): None for p in parents})
+    rows = isinstance(parents[0], Row)
+
+    for node in nodes:
+        children, loaded = {}, {}
+
+        if rows:
+            entity = Entity(node.model, node.columns, 1)
+            query = children_query(
+                session, model, ids, node, lambda t: ([getattr(t, k) for k in entity.keys], ())
+            )
+            for r in query:
+                ident = entity.identity(r)
+                if ident is None or full(children, r[0], node.limit):
+                    continue
+                child = loaded.get(ident)
+                if child is None:
+                    child = loaded[ident] = Row(node.model, entity.data(r))
+                children.setdefault(r[0], []).append(child)
+        else:
+            query = children_query(
+                session, model, ids, node, lambda t: ([t], (Load(t).load_only(*node.columns),))
+            )
+            for r in query:
+                if full(children, r[0], node.limit):
+                    continue
+                child = r[1]
+                loaded[id(child)] = child
+                children.setdefault(r[0], []).append(child)
+
+        for p in parents:
+            attach(p, node, children.get(identity(p, pk), []))
+
+        load(session, node.model, list(loaded.values()), node.children)
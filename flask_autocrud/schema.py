@@ -0,0 +1,126 @@
+from types import MappingProxyType
+
+import flask
+from sqlalchemy.inspection import inspect
+from werkzeug.http import generate_etag
+
+from .config import HttpStatus as status
+
+
+class Encoded(object):
+    __slots__ = ('data', '_bodies')
+
+    def __init__(self, data):
+        """
+        static body encoded once for every negotiated mimetype
+
+        :param data: dict to encode
+        """
+        self.data = data
+        self._bodies = {}
+
+    def response(self, response_builder, conditional=True):
+        """
+        requests with a query string are built every time,
+        because builders may read arguments (i.e. jsonp callback)
+
+        :param response_builder: ResponseBuilder instance
+        :param conditional: set strong ETag and answer If-None-Match
+        :return: response object
+        """
+        mimetype, builder = response_builder.get_mimetype_accept()
+        entry = self._bodies.get(mimetype)
+        if entry is None:
+            res = response_builder.build_response(builder, self.data)
+            body = res.get_data()
+            entry = (body, res.headers.get('Content-Type'), generate_etag(body))
+            if not flask.request.query_string:
+                self._bodies[mimetype] = entry
+
+        body, content_type, etag = entry
+        if not conditional:
+            return flask.Response(body, content_type=content_type)
+
+        if etag in flask.request.if_none_match:
+            response = flask.Response(status=status.NOT_MODIFIED)
+        else:
+            response = flask.Response(body, content_type=content_type)
+
+        response.set_etag(etag)
+        return response
+
+
+class ModelSchema(object):
+    __slots__ = (
+        'columns', 'order', 'primary_key', 'required', 'optional',
+        'searchable', 'fields', 'submodels', 'related', 'meta'
+    )
+
+    def __init__(self, model):
+        """
+        what hot paths need to know about a model, read once from its columns and relationships
+
+        :param model: model class
+        """
+        columns = model.columns()
+        skip = (model.version_field(), model.updated_field())
+
+        self.columns = MappingProxyType(dict(columns))
+        self.order = tuple(columns)
+        self.primary_key = model.primary_key_field()
+        self.required = frozenset(
+            k for k, c in columns.items()
+            if k not in skip and (not (c.nullable or c.primary_key) or (c.primary_key and not c.autoincrement))
+        )
+        self.optional = frozenset(k for k, c in columns.items() if c.nullable)
+        self.searchable = frozenset(k for k, c in columns.items() if c.type.python_type is str)
+        self.fields = self.required | self.optional
+
+        submodels = {}
+        related = {}
+        for r in inspect(model).relationships:
+            rel = r.mapper.class_
+            submodels.setdefault(rel.__url__, rel)
+            related[rel.__name__] = MappingProxyType(dict(
+                instance=getattr(model, r.key),
+                columns=rel.columns()
+            ))
+
+        self.submodels = MappingProxyType(submodels)
+        self.related = MappingProxyType(related)
+        self.meta = Encoded(dict(
+            url=model.__url__,
+            name=model.__name__,
+            methods=sorted(model.__methods__),
+            description=model.__description__ or model.__table__.comment,
+            related={k: v['instance'].property.mapper.class_.__url__ for k, v in related.items()},
+            fields=[
+                dict(
+                    name=k,
+                    type=c.type.python_type.__name__,
+                    key=c.primary_key,
+                    nullable=c.nullable,
+                    unique=c.unique,
+                    description=c.comment
+                ) for k, c in columns.items()
+            ]
+        ))
+
+    def __setattr__(self, key, value):
+        """
+        attributes are set only once, by __init__
+        """
+        try:
+            getattr(self, key)
+        except AttributeError:
+            return super().__setattr__(key, value)
+
+        raise AttributeError("'{}' is read only".format(key))
+
+    def ordered(self, names):
+        """
+
+        :param names: set of column names
+        :return: list of names in column order
+        """
+        return [k for k in self.order if k in names]
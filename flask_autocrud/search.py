@@ -0,0 +1,366 @@
+import re
+import time
+from functools import reduce
+
+import click
+from flask import current_app as cap
+from flask.cli import with_appcontext
+from sqlalchemy import Index, and_, func, literal_column, or_, select, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import column, table
+
+SEARCH_BACKENDS = (
+    'auto',
+    'like',
+    'fts5',
+    'tsvector',
+)
+
+WORD = re.compile(r'\w+', re.UNICODE)
+LANGUAGE = re.compile(r'^\w+$')
+
+
+def words(value):
+    """
+
+    :param value: search terms as sent by client
+    :return: list of words, punctuation and operators are ignored
+    """
+    return WORD.findall(value or '')
+
+
+class LikeSearch:
+    name = 'like'
+
+    def __init__(self, language=None):
+        """
+        fallback without index: every word must be contained in one of searchable columns
+
+        :param language: not used
+        """
+        self.language = language
+
+    def supported(self, session, model):
+        """
+
+        :param session: database session
+        :param model: model class
+        :return: True if backend can be used for model
+        """
+        return len(model.searchable()) > 0
+
+    def exists(self, session, model):
+        """
+
+        :param session: database session
+        :param model: model class
+        :return: True if index is built
+        """
+        return True
+
+    def create(self, session, model):
+        """
+
+        :param session: database session
+        :param model: model class
+        """
+
+    def drop(self, session, model):
+        """
+
+        :param session: database session
+        :param model: model class
+        """
+
+    def values(self, terms):
+        """
+
+        :param terms: list of words
+        :return: values bound to the statement
+        """
+        return ["%{}%".format(t.replace('\\', '\\\\').replace('_', '\\_')) for t in terms]
+
+    def apply(self, query, model, values):
+        """
+
+        :param query: query to filter
+        :param model: model class
+        :param values: as returned by values, can be bound parameters
+        :return: query, order by expressions of rank
+        """
+        columns = [getattr(model, k) for k in model.searchable()]
+        return query.filter(and_(*[or_(*[c.ilike(v, escape='\\') for c in columns]) for v in values])), []
+
+
+class Fts5Search(LikeSearch):
+    name = 'fts5'
+
+    def __init__(self, language=None):
+        """
+        sqlite FTS5 external content table kept in sync by triggers, ranked by bm25
+
+        :param language: not used, tokenizer is unicode61
+        """
+        super().__init__(language)
+
+    @staticmethod
+    def table_name(model):
+        """
+
+        :param model: model class
+        :return: name of the shadow table
+        """
+        return "{}_fts".format(model.__table__.name)
+
+    def supported(self, session, model):
+        pk = list(model.__table__.primary_key.columns)
+        return (
+            session.get_bind().dialect.name == 'sqlite'
+            and len(pk) == 1 and pk[0].type.python_type is int
+            and super().supported(session, model)
+        )
+
+    def exists(self, session, model):
+        stm = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+        return session.execute(stm, dict(name=self.table_name(model))).first() is not None
+
+    def create(self, session, model):
+        quote = session.get_bind().dialect.identifier_preparer.quote
+        name = self.table_name(model)
+        source = model.__table__.name
+        key = list(model.__table__.primary_key.columns)[0].name
+        pk = quote(key)
+        cols = [quote(model.columns()[k].name) for k in model.searchable()]
+
+        def trigger(suffix, event, body):
+            return "CREATE TRIGGER {} AFTER {} ON {} BEGIN {} END".format(
+                quote("{}_{}".format(name, suffix)), event, quote(source), body
+            )
+
+        def row(action, prefix):
+            values = ', '.join("{}.{}".format(prefix, c) for c in [pk, *cols])
+            if action is None:
+                return "INSERT INTO {0}(rowid, {1}) VALUES ({2});".format(quote(name), ', '.join(cols), values)
+            return "INSERT INTO {0}({0}, rowid, {1}) VALUES ('{2}', {3});".format(
+                quote(name), ', '.join(cols), action, values
+            )
+
+        for stm in (
+            "CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', content_rowid='{}')".format(
+                quote(name), ', '.join(cols), source.replace("'", "''"), key.replace("'", "''")
+            ),
+            trigger('ai', 'INSERT', row(None, 'new')),
+            trigger('ad', 'DELETE', row('delete', 'old')),
+            trigger('au', 'UPDATE', row('delete', 'old') + ' ' + row(None, 'new')),
+            "INSERT INTO {0}({0}) VALUES ('rebuild')".format(quote(name)),
+        ):
+            session.execute(text(stm))
+
+    def drop(self, session, model):
+        quote = session.get_bind().dialect.identifier_preparer.quote
+        name = self.table_name(model)
+        for suffix in ('ai', 'ad', 'au'):
+            session.execute(text("DROP TRIGGER IF EXISTS {}".format(quote("{}_{}".format(name, suffix)))))
+        session.execute(text("DROP TABLE IF EXISTS {}".format(quote(name))))
+
+    def values(self, terms):
+        return [' '.join('"{}"'.format(t) for t in terms)]
+
+    def apply(self, query, model, values):
+        name = self.table_name(model)
+        fts = table(name, column('rowid'), column('rank'), column(name))
+        match = select([fts.c.rowid, fts.c.rank]) \
+            .where(fts.c[name].op('MATCH')(values[0])) \
+            .alias('autocrud_search')
+
+        pk = getattr(model, model.primary_key_field())
+        return query.join(match, match.c.rowid == pk), [match.c.rank, pk]
+
+
+class TsVectorSearch(LikeSearch):
+    name = 'tsvector'
+
+    def __init__(self, language=None):
+        """
+        postgres GIN expression index on the tsvector of searchable columns, ranked by ts_rank
+
+        :param language: text search configuration, default simple
+        """
+        language = language or 'simple'
+        if not LANGUAGE.match(language):
+            raise ValueError("invalid text search configuration: '{}'".format(language))
+        super().__init__(language)
+
+    @staticmethod
+    def index_name(model):
+        """
+
+        :param model: model class
+        :return: name of the index
+        """
+        return "{}_search_idx".format(model.__table__.name)
+
+    def document(self, model):
+        """
+        same expression of the index, so that the planner can use it
+
+        :param model: model class
+        :return: tsvector expression
+        """
+        columns = [func.coalesce(model.columns()[k], literal_column("''")) for k in model.searchable()]
+        doc = reduce(lambda a, b: a.op('||')(literal_column("' '")).op('||')(b), columns)
+        return func.to_tsvector(self._config(), doc)
+
+    def _config(self):
+        """
+
+        :return: regconfig literal
+        """
+        return literal_column("'{}'::regconfig".format(self.language))
+
+    def supported(self, session, model):
+        return session.get_bind().dialect.name == 'postgresql' and super().supported(session, model)
+
+    def exists(self, session, model):
+        stm = text("SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexname = :name")
+        params = dict(table=model.__table__.name, name=self.index_name(model))
+        return session.execute(stm, params).first() is not None
+
+    def create(self, session, model):
+        index = Index(self.index_name(model), self.document(model), postgresql_using='gin', _table=model.__table__)
+        try:
+            session.execute(CreateIndex(index))
+        finally:
+            model.__table__.indexes.discard(index)
+
+    def drop(self, session, model):
+        quote = session.get_bind().dialect.identifier_preparer.quote
+        schema = model.__table__.schema
+        name = quote(self.index_name(model))
+        session.execute(text("DROP INDEX IF EXISTS {}".format("{}.{}".format(quote(schema), name) if schema else name)))
+
+    def values(self, terms):
+        return [' '.join(terms)]
+
+    def apply(self, query, model, values):
+        vector = self.document(model)
+        ts_query = func.plainto_tsquery(self._config(), values[0])
+        pk = getattr(model, model.primary_key_field())
+        return query.filter(vector.op('@@')(ts_query)), [func.ts_rank(vector, ts_query).desc(), pk]
+
+
+BACKENDS = {b.name: b for b in (LikeSearch, Fts5Search, TsVectorSearch)}
+
+# seconds an index found or missing is remembered, indexes built or dropped by other processes are seen after it
+RESOLVE_TTL = 60
+
+_resolved = {}
+
+
+def search_backend(name, language=None):
+    """
+
+    :param name: one of SEARCH_BACKENDS except auto
+    :param language: text search configuration
+    :return: backend instance
+    """
+    return BACKENDS[name](language)
+
+
+def _resolved_key(session, model):
+    """
+
+    :param session: database session
+    :param model: model class
+    :return: key of resolved backend
+    """
+    return str(session.get_bind().url), model.__table__.name
+
+
+def forget(session, model):
+    """
+    called when a query with the resolved index fails, i.e. dropped by another process
+
+    :param session: database session
+    :param model: model class
+    :return: True if a full text index was remembered for the model
+    """
+    entry = _resolved.pop(_resolved_key(session, model), None)
+    return entry is not None and entry[0] != LikeSearch.name
+
+
+def resolve(session, model, name, language=None):
+    """
+    with auto the first index built for model is used, like search otherwise:
+    the result is remembered for RESOLVE_TTL seconds, explicit backends do not check the index
+
+    :param session: database session
+    :param model: model class
+    :param name: one of SEARCH_BACKENDS
+    :param language: text search configuration
+    :return: backend instance, None if model has no searchable columns
+    """
+    like = LikeSearch(language)
+    if not like.supported(session, model):
+        return None
+
+    if name != 'auto':
+        backend = search_backend(name, language)
+        return backend if backend.supported(session, model) else like
+
+    key = _resolved_key(session, model)
+    found, expire = _resolved.get(key, (None, 0))
+    if expire > time.monotonic():
+        return search_backend(found, language)
+
+    found = like
+    for backend in (Fts5Search(language), TsVectorSearch(language)):
+        if backend.supported(session, model) and backend.exists(session, model):
+            found = backend
+            break
+
+    _resolved[key] = (found.name, time.monotonic() + RESOLVE_TTL)
+    return found
+
+
+def build_indexes(session, models, language=None, drop=False):
+    """
+    creates or drops the full text index of every model supported by the database
+
+    :param session: database session
+    :param models: list of model classes
+    :param language: text search configuration
+    :param drop: drop indexes instead of creating them
+    :return: list of (model name, backend name) changed
+    """
+    changed = []
+    for model in models:
+        for backend in (Fts5Search(language), TsVectorSearch(language)):
+            if not backend.supported(session, model):
+                continue
+
+            _resolved.pop(_resolved_key(session, model), None)
+            if backend.exists(session, model) is not drop:
+                continue
+
+            if drop:
+                backend.drop(session, model)
+            else:
+                backend.create(session, model)
+            changed.append((model.__name__, backend.name))
+
+    session.commit()
+    return changed
+
+
+@click.command('autocrud-search-index')
+@click.option('--drop', is_flag=True, default=False, help='drop indexes instead of building them')
+@click.argument('models', nargs=-1)
+@with_appcontext
+def index_command(drop, models):
+    """
+    builds full text indexes of searchable columns
+    """
+    autocrud = cap.extensions['autocrud']
+    for name, backend in autocrud.search_indexes(models or None, drop=drop):
+        click.echo("{} {} index of {}".format('dropped' if drop else 'built', backend, name))
@@ -0,0 +1,254 @@
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import ColumnProperty
+
+from . import model as _model
+
+SKIP = 0
+COLUMN = 1
+OTHER = 2
+
+
+def serialize_attribute(resp, key, value, links, suffix):
+    """
+    related instances are nested under their class name, not empty collections
+    under class name with suffix, other values under attribute name
+
+    :param resp: dict to update
+    :param key: attribute name
+    :param value: attribute value
+    :param links: include _links in nested resources
+    :param suffix: collection suffix
+    """
+    if isinstance(value, (_model.Model, Row)):
+        resp[type_name(value)] = value.to_dict(links)
+    elif isinstance(value, list):
+        if len(value) > 0:
+            resp[type_name(value[0]) + suffix] = [i.to_dict(links) for i in value]
+    else:
+        resp[key] = value
+
+
+def type_name(value):
+    """
+
+    :param value: model instance, row or any value
+    :return: name of model class
+    """
+    return value.model.__name__ if isinstance(value, Row) else value.__class__.__name__
+
+
+def generic_to_dict(obj, links=False):
+    """
+    walks every loaded attribute of a model instance checking each of them
+
+    :param obj: model instance
+    :param links: include _links
+    :return:
+    """
+    resp = {}
+    data = obj if isinstance(obj, dict) else obj.__dict__
+
+    for k, v in data.items():
+        if k.startswith('_') or k in obj.__hidden__:
+            continue
+        serialize_attribute(resp, k, v, links, obj.collection_suffix)
+
+    if links:
+        resp['_links'] = generic_links(obj)
+
+    return resp
+
+
+def generic_links(obj):
+    """
+    inspects relationships of the model on every call
+
+    :param obj: model instance
+    :return:
+    """
+    pk = getattr(obj, obj.primary_key_field())
+    uri = "{}/{}".format(obj.__url__, pk) if pk else None
+
+    link_dict = dict(self=uri)
+    for r in inspect(obj.__class__).relationships:
+        try:
+            key = r.argument.class_.__name__
+            url = r.argument.class_.__url__
+        except AttributeError:
+            key = r.argument.__name__
+            url = r.argument.__url__
+
+        link_dict[key] = "{}{}".format(uri, url)
+
+    return link_dict
+
+
+class Row(object):
+    __slots__ = ('model', 'data')
+
+    def __init__(self, model, data):
+        """
+        values of a model read by a core statement, without instrumentation and identity map
+
+        :param model: model class
+        :param data: dict ordered as __dict__ of a loaded instance
+        """
+        self.model = model
+        self.data = data
+
+    def to_dict(self, links=False):
+        """
+
+        :param links: include _links
+        :return: same output of to_dict of a loaded instance
+        """
+        serializer = self.model.serializer()
+        resp = serializer.serialize(self.data, links)
+        if links:
+            resp['_links'] = serializer.links_for(self.data.get(serializer.primary_key))
+
+        return resp
+
+
+class Serializer(object):
+    __slots__ = (
+        '_plan', '_columns', '_known', '_hidden', '_suffix', '_pk', '_self_link', '_related_links', 'templates'
+    )
+
+    def __init__(self, model):
+        """
+        compiles once what to_dict needs: the kind of every mapped attribute,
+        hidden fields, relationships and link templates
+
+        :param model: model class
+        """
+        mapper = inspect(model)
+        hidden = model.__hidden__
+
+        self._plan = {}
+        self._hidden = hidden
+        self._suffix = model.collection_suffix
+        self._pk = model.primary_key_field()
+
+        for prop in mapper.attrs:
+            if prop.key.startswith('_') or prop.key in hidden:
+                self._plan[prop.key] = SKIP
+            elif isinstance(prop, ColumnProperty) and not self._holds_list(prop):
+                self._plan[prop.key] = COLUMN
+            else:
+                self._plan[prop.key] = OTHER
+
+        self._columns = frozenset(k for k, v in self._plan.items() if v is COLUMN)
+        self._known = frozenset(k for k, v in self._plan.items() if v is not OTHER) | {'_sa_instance_state'}
+        self._self_link = "{}/{{}}".format(model.__url__)
+        self._related_links = tuple(
+            (r.mapper.class_.__name__, "{}/{{}}{}".format(model.__url__, r.mapper.class_.__url__))
+            for r in mapper.relationships
+        )
+
+        placeholder = "{{{}}}".format(self._pk)
+        self.templates = dict(self=self._self_link.format(placeholder))
+        self.templates.update((name, t.format(placeholder)) for name, t in self._related_links)
+
+    @staticmethod
+    def _holds_list(prop):
+        """
+
+        :param prop: column property
+        :return: True if values can be lists (i.e. ARRAY)
+        """
+        try:
+            return issubclass(prop.columns[0].type.python_type, list)
+        except NotImplementedError:
+            return True
+
+    @property
+    def primary_key(self):
+        """
+
+        :return: name of primary key field
+        """
+        return self._pk
+
+    def _pk_value(self, obj):
+        """
+
+        :param obj: model instance
+        :return:
+        """
+        pk = obj.__dict__.get(self._pk)
+        return getattr(obj, self._pk) if pk is None else pk
+
+    def resource_uri(self, obj):
+        """
+
+        :param obj: model instance
+        :return:
+        """
+        pk = self._pk_value(obj)
+        return self._self_link.format(pk) if pk else None
+
+    def links(self, obj):
+        """
+
+        :param obj: model instance
+        :return:
+        """
+        return self.links_for(self._pk_value(obj))
+
+    def links_for(self, pk):
+        """
+
+        :param pk: primary key value
+        :return:
+        """
+        if not pk:
+            link_dict = dict(self=None)
+            for name, template in self._related_links:
+                link_dict[name] = "None" + template[template.index('{}') + 2:]
+            return link_dict
+
+        pk = str(pk)
+        link_dict = dict(self=self._self_link.format(pk))
+        for name, template in self._related_links:
+            link_dict[name] = template.format(pk)
+        return link_dict
+
+    def __call__(self, obj, links=False):
+        """
+        rows with only columns loaded, the common case, are copied by a single comprehension,
+        otherwise attributes are checked one by one keeping the same order
+
+        :param obj: model instance
+        :param links: include _links
+        :return: same output of generic_to_dict
+        """
+        resp = self.serialize(obj.__dict__, links, obj.__hidden__)
+        if links:
+            resp['_links'] = self.links(obj)
+
+        return resp
+
+    def serialize(self, data, links=False, hidden=None):
+        """
+
+        :param data: __dict__ of instance or data of row
+        :param links: include _links in nested resources
+        :param hidden: hidden fields, default those of model
+        :return: dict without _links
+        """
+        if data.keys() <= self._known:
+            columns = self._columns
+            return {k: v for k, v in data.items() if k in columns}
+
+        resp = {}
+        plan = self._plan
+        hidden = self._hidden if hidden is None else hidden
+        for k, v in data.items():
+            kind = plan.get(k)
+            if kind is COLUMN:
+                resp[k] = v
+            elif kind is OTHER or (kind is None and not (k.startswith('_') or k in hidden)):
+                serialize_attribute(resp, k, v, links, self._suffix)
+
+        return resp
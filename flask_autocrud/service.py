@@ -1,21 +1,73 @@
+import csv
+import datetime
+import functools
+import io
+import itertools
+import json
+import threading
+import time
+
 import colander
 import flask
-import sqlalchemy_filters as sqlaf
 from flask import current_app as cap
 from flask.views import MethodView
+from flask_response_builder.builders.json import JsonBuilder
 from flask_response_builder.dictutils import to_flatten
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import MethodNotAllowed, NotImplemented
-from werkzeug.http import generate_etag
+from werkzeug.http import generate_etag, http_date, parse_date, quote_etag
+from werkzeug.urls import url_encode
 
+from . import aggregate, columnar, core, relations, search
+from .builders import NdJsonBuilder
+from .bulk import chunks, delete_many, insert_many, update_many, upsert
 from .config import HttpStatus as status
+from .model import Model
+from .pagination import (
+    CountCache,
+    aggregate_query,
+    count_query,
+    estimated_count,
+    paginate,
+    supports_window,
+    windowed
+)
 from .qs2sqla import Qs2Sqla
+from .streaming import csv_stream, iterate, json_stream, ndjson_stream, stream_response
 from .validators import FetchPayloadSchema
 
 
+def search_fallback(build):
+    """
+    a full text index dropped by another process makes the query fail: the index is forgotten
+    and the response is built again, with like search if the index is missing
+
+    :param build: method building a response of model from data
+    :return:
+    """
+    @functools.wraps(build)
+    def wrapper(self, model, builder, data, *args, **kwargs):
+        try:
+            return build(self, model, builder, data, *args, **kwargs)
+        except OperationalError:
+            session = self._db.session()
+            if not (data.get('search') and search.forget(session, model)):
+                raise
+            session.rollback()
+            return build(self, model, builder, data, *args, **kwargs)
+
+    return wrapper
+
+
 class Service(MethodView):
     _db = None
     _model = None
+    _cache = None
+    _plans = None
+    _advisor = None
+    _counter = None
     _response = None
     syntax = None
     arguments = None
@@ -42,8 +94,137 @@ class Service(MethodView):
         if controller is None:
             raise NotImplemented()
 
+        # responses within a batch may depend on its uncommitted writes
+        if flask.g.get('autocrud_batch') is not None:
+            return controller(*args, **kwargs)
+
+        if self._cache is not None and name.upper() in ('GET', 'FETCH'):
+            return self._cached_response(name.upper(), controller, *args, **kwargs)
+
         return controller(*args, **kwargs)
 
+    def _cache_key(self, name):
+        """
+        request normalized: method, path, query string, negotiated mimetype, credentials and body
+
+        :param name: GET or FETCH
+        :return:
+        """
+        mimetype, _ = self._response.get_mimetype_accept()
+        body = None
+        if name == 'FETCH':
+            payload = flask.request.get_json(silent=True)
+            body = json.dumps(payload, sort_keys=True) if payload is not None else flask.request.get_data()
+
+        return (
+            name,
+            flask.request.method,
+            flask.request.headers.get('X-HTTP-Method-Override'),
+            flask.request.path,
+            tuple(sorted(flask.request.args.items(multi=True))),
+            mimetype,
+            # responses can depend on the user
+            flask.request.headers.get('Authorization'),
+            flask.request.headers.get('Cookie'),
+            body
+        )
+
+    def _cached_response(self, name, controller, *args, **kwargs):
+        """
+        serves GET and FETCH from cache, a stale entry is served while
+        another thread refreshes it
+
+        :param name: GET or FETCH
+        :param controller: method that builds the response
+        :return:
+        """
+        key = self._cache_key(name)
+        entry, stale = self._cache.get_entry(key)
+
+        if entry is None:
+            response = controller(*args, **kwargs)
+            self._store_response(key, response)
+            return response
+
+        if stale and self._cache.start_refresh(key):
+            # the refresh must build the full response, conditional headers of the client do not apply
+            app = cap._get_current_object()
+            conditional = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+            environ = {k: v for k, v in flask.request.environ.items() if k not in conditional}
+            environ['wsgi.input'] = io.BytesIO(flask.request.get_data())
+
+            def refresh():
+                with app.request_context(environ):
+                    try:
+                        self._store_response(key, controller(*args, **kwargs))
+                    except Exception:
+                        cap.logger.exception('unable to refresh cached response')
+                    finally:
+                        self._cache.end_refresh(key)
+
+            threading.Thread(target=refresh, daemon=True).start()
+
+        body, code, headers, etag = entry
+        if etag and cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True:
+            none_match = flask.request.if_none_match
+            if none_match and etag in none_match:
+                return flask.Response(status=status.NOT_MODIFIED, headers={'ETag': '"{}"'.format(etag)})
+
+        modified = next((v for k, v in headers if k.lower() == 'last-modified'), None)
+        if modified is not None:
+            self._check_modified(parse_date(modified))
+
+        return flask.Response(body, status=code, headers=headers)
+
+    def _store_response(self, key, response):
+        """
+        only complete successful responses are stored
+
+        :param key: cache key
+        :param response: response object
+        """
+        if response.is_streamed or response.status_code not in (status.SUCCESS, status.PARTIAL_CONTENT):
+            return
+
+        etag, _ = response.get_etag()
+        entry = (response.get_data(), response.status_code, list(response.headers.items()), etag)
+        self._cache.set(key, entry, self._cache_tags())
+
+    def _cache_tags(self):
+        """
+        models whose rows can be in the response: self model, subresource model and their
+        relationships, models of nested related paths and of filters
+
+        :return: set of model names
+        """
+        model = self._model
+        subresource = (flask.request.view_args or {}).get('subresource')
+        base = (model.submodel_from_url("/" + subresource) if subresource else None) or model
+
+        qsqla = Qs2Sqla(base, self.syntax, self.arguments)
+        payload = flask.request.get_json(silent=True) if flask.request.method == 'FETCH' else None
+        if isinstance(payload, dict):
+            filters, related = payload.get('filters'), list(payload.get('related') or {})
+        else:
+            _, args = self._aggregate_args(qsqla, flask.request.args)
+            filters = qsqla.parse(args)[0].get('filters')
+            related = qsqla.clear_empty(flask.request.args.get(qsqla.arguments.scalar.related) or '')
+
+        tags = {model.__name__, *CountCache.key(base, dict(filters=filters))[1]}
+        for m in {model, base}:
+            tags.update(r['instance'].property.mapper.class_.__name__ for r in m.related().values())
+
+        for path in related:
+            parent = base
+            for part in path.split(relations.PATH_SEP):
+                instance, _ = parent.related(part.partition(relations.LIMIT_SEP)[0])
+                if instance is None:
+                    break
+                parent = instance.property.mapper.class_
+                tags.add(parent.__name__)
+
+        return tags
+
     def delete(self, resource_id):
         """
 
@@ -51,6 +232,10 @@ class Service(MethodView):
         :return:
         """
 
+        if resource_id is None:
+            _, builder = self._response.get_mimetype_accept()
+            return self._bulk_write(builder, lambda q: delete_many(q, self._model))
+
         @self._response.no_content
         def _delete():
             model = self._model
@@ -63,6 +248,7 @@ class Service(MethodView):
             self._check_etag(resource)
             session.delete(resource)
             session.commit()
+            self._invalidate()
 
         return _delete()
 
@@ -73,13 +259,18 @@ class Service(MethodView):
         """
         model = self._model
         _, builder = self._response.get_mimetype_accept()
-        data = self._validate_new_data()
+        if isinstance(flask.request.get_json(silent=True), list):
+            return self._bulk_create(builder, flask.request.get_json())
+
+        if 'resolution=merge-duplicates' in self._preferences():
+            return self._upsert(builder)
 
-        resource = model.query.filter_by(**data).first()
+        data = self._validate_new_data()
 
         try:
-            if resource:
-                raise IntegrityError(statement=None, params=None, orig=None)
+            if cap.config['AUTOCRUD_OPTIMISTIC_INSERT'] is not True:
+                if model.query.filter_by(**data).first():
+                    raise IntegrityError(statement=None, params=None, orig=None)
 
             resource = model(**data)
             res = self._add_resource(resource)
@@ -89,9 +280,180 @@ class Service(MethodView):
             flask.abort(status.CONFLICT)
 
         return self._response_with_etag(
-            builder, (res, status.CREATED, self._location_header(resource)), res
+            builder, (res, status.CREATED, self._location_header(resource)),
+            resource if model.is_versioned() else res
+        )
+
+    @staticmethod
+    def _preferences():
+        """
+
+        :return: set of preferences of Prefer header
+        """
+        prefer = flask.request.headers.get('Prefer') or ''
+        return {p.strip().replace(' ', '') for p in prefer.split(',') if p.strip()}
+
+    def _upsert(self, builder):
+        """
+        creates or updates a resource in one statement, the conflict is detected
+        on primary key or on a unique constraint given by payload
+
+        :param builder: response builder
+        :return:
+        """
+        model = self._model
+        data = flask.request.get_json()
+
+        if not isinstance(data, dict) or not data:
+            flask.abort(status.BAD_REQUEST)
+
+        missing, unknown = model.validate(data)
+        unknown = [u for u in unknown or [] if u != model.primary_key_field()]
+        if unknown or missing:
+            flask.abort(status.UNPROCESSABLE_ENTITY, response=dict(
+                unknown=unknown, missing=missing or []
+            ))
+
+        session = self._db.session()
+        try:
+            pk, created = upsert(session, model, data)
+            session.commit()
+        except ValueError as exc:
+            pk, created = None, False  # prevent warning
+            session.rollback()
+            flask.abort(status.UNPROCESSABLE_ENTITY, response=dict(error=str(exc)))
+        except NotImplementedError as exc:
+            pk, created = None, False  # prevent warning
+            session.rollback()
+            flask.abort(status.NOT_IMPLEMENTED, str(exc))
+        except IntegrityError as exc:
+            pk, created = None, False  # prevent warning
+            session.rollback()
+            flask.abort(status.CONFLICT, response=dict(error=str(exc.orig)))
+
+        self._invalidate()
+        resource = model.query.get(pk)
+        res = resource.to_dict(links=True)
+        headers = {**self._location_header(resource), 'Preference-Applied': 'resolution=merge-duplicates'}
+
+        return self._response_with_etag(
+            builder, (res, status.CREATED if created else status.SUCCESS, headers),
+            resource if model.is_versioned() else res
+        )
+
+    def _bulk_create(self, builder, items):
+        """
+        inserts valid items in batches within a single transaction,
+        invalid items are skipped and reported with their status
+
+        :param builder: response builder
+        :param items: list of resources
+        :return:
+        """
+        model = self._model
+        max_size = cap.config['AUTOCRUD_BULK_MAX_SIZE']
+
+        if not items:
+            flask.abort(status.BAD_REQUEST)
+        if max_size and len(items) > max_size:
+            flask.abort(status.PAYLOAD_TOO_LARGE, response=dict(max_size=max_size))
+
+        results, valid = [], []
+        for item in items:
+            if not isinstance(item, dict) or not item:
+                results.append(dict(status=status.BAD_REQUEST))
+                continue
+
+            missing, unknown = model.validate(item)
+            if missing or unknown:
+                results.append(dict(
+                    status=status.UNPROCESSABLE_ENTITY, unknown=unknown or [], missing=missing or []
+                ))
+            else:
+                results.append(None)
+                valid.append(item)
+
+        if not valid:
+            flask.abort(status.UNPROCESSABLE_ENTITY, response=dict(invalid=results))
+
+        session = self._db.session()
+        try:
+            pks = insert_many(session, model, valid, cap.config['AUTOCRUD_BULK_CHUNK_SIZE'])
+            session.commit()
+        except IntegrityError as exc:
+            pks = []  # prevent warning
+            session.rollback()
+            flask.abort(status.CONFLICT, response=dict(error=str(exc.orig)))
+
+        self._invalidate()
+
+        # rows are read again in order to return server defaults and generated columns
+        pk_field = model.primary_key_field()
+        known = [pk for pk in pks if pk is not None]
+        stored = {}
+        for chunk in chunks(known, cap.config['AUTOCRUD_BULK_CHUNK_SIZE']):
+            stored.update((getattr(r, pk_field), r) for r in model.query.filter(getattr(model, pk_field).in_(chunk)))
+
+        created = iter(zip(valid, pks))
+        for n, r in enumerate(results):
+            if r is None:
+                item, pk = next(created)
+                resource = stored.get(pk) or model(**item)
+                results[n] = dict(status=status.CREATED, resource=resource.to_dict(links=pk in stored))
+
+        code = status.CREATED if len(valid) == len(results) else status.MULTI_STATUS
+        return self._response.build_response(
+            builder, ({model.__name__ + model.collection_suffix: results}, code)
         )
 
+    def _bulk_query(self):
+        """
+        rows selected by filters in query string, at least one filter is required
+
+        :return: query with filters applied
+        """
+        qsqla = Qs2Sqla(self._model, self.syntax, self.arguments, self._plans)
+        if cap.config['AUTOCRUD_QUERY_STRING_FILTERS_ENABLED'] is True:
+            data, invalid = qsqla.parse(flask.request.args)
+        else:
+            data, invalid = {}, []
+
+        if not data.get('filters'):
+            flask.abort(status.BAD_REQUEST, response=dict(error='at least one filter is required'))
+
+        query, error = qsqla.dict2sqla(dict(filters=data['filters']))
+        invalid += error
+        if len(invalid) > 0:
+            flask.abort(status.BAD_REQUEST, response=dict(invalid=invalid))
+
+        return query
+
+    def _bulk_write(self, builder, action):
+        """
+        executes a set based UPDATE or DELETE, the transaction is rolled back
+        if affected rows exceed the configured limit
+
+        :param builder: response builder
+        :param action: function that executes the statement on query and returns rows matched
+        :return:
+        """
+        max_rows = cap.config['AUTOCRUD_BULK_MAX_ROWS']
+        session = self._db.session()
+
+        try:
+            affected = action(self._bulk_query())
+            if max_rows and affected > max_rows:
+                session.rollback()
+                flask.abort(status.BAD_REQUEST, response=dict(affected=affected, max_rows=max_rows))
+            session.commit()
+        except IntegrityError as exc:
+            affected = 0  # prevent warning
+            session.rollback()
+            flask.abort(status.CONFLICT, response=dict(error=str(exc.orig)))
+
+        self._invalidate()
+        return self._response.build_response(builder, dict(affected=affected))
+
     def put(self, resource_id):
         """
 
@@ -107,13 +469,15 @@ class Service(MethodView):
             self._check_etag(resource)
             res = self._merge_resource(resource, data)
             return self._response_with_etag(
-                builder, (res, self._link_header(resource)), res
+                builder, (res, self._link_header(resource)),
+                resource if model.is_versioned() else res
             )
 
         resource = model(**{model.primary_key_field(): resource_id, **data})
         res = self._add_resource(resource)
         return self._response_with_etag(
-            builder, (res, self._location_header(resource), status.CREATED), res
+            builder, (res, self._location_header(resource), status.CREATED),
+            resource if model.is_versioned() else res
         )
 
     def patch(self, resource_id):
@@ -130,6 +494,11 @@ class Service(MethodView):
         if unknown:
             flask.abort(status.UNPROCESSABLE_ENTITY, response=dict(unknown=unknown))
 
+        if resource_id is None:
+            if not data:
+                flask.abort(status.BAD_REQUEST)
+            return self._bulk_write(builder, lambda q: update_many(q, model, data))
+
         resource = model.query.get(resource_id)
         if not resource:
             flask.abort(status.NOT_FOUND)
@@ -137,14 +506,16 @@ class Service(MethodView):
         self._check_etag(resource)
         res = self._merge_resource(resource, data)
         return self._response_with_etag(
-            builder, (res, self._link_header(resource)), res
+            builder, (res, self._link_header(resource)),
+            resource if model.is_versioned() else res
         )
 
-    def get(self, resource_id=None, subresource=None):
+    def get(self, resource_id=None, subresource=None, facets=None):
         """
 
         :param resource_id:
         :param subresource:
+        :param facets: columns separated by ; of distinct values endpoint
         :return:
         """
         related = {}
@@ -157,15 +528,19 @@ class Service(MethodView):
             )
         ]
 
+        if facets is not None:
+            return self._build_response_distinct(model, builder, facets)
+
         if resource_id is None and flask.request.path.endswith(cap.config['AUTOCRUD_METADATA_URL']):
-            return self._response.build_response(builder, model.description())
+            conditional = cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True
+            return model.schema().meta.response(self._response, conditional)
 
         if subresource is not None:
             model = model.submodel_from_url("/" + subresource)
             if not model:
                 flask.abort(status.NOT_FOUND)
 
-        qsqla = Qs2Sqla(model, self.syntax, self.arguments)
+        qsqla = Qs2Sqla(model, self.syntax, self.arguments, self._plans)
         if qsqla.arguments.scalar.related in flask.request.args:
             extended = flask.request.args[qsqla.arguments.scalar.related] or ''
             rels = [r for r in extended.split(qsqla.syntax.SEP) if r]
@@ -173,22 +548,32 @@ class Service(MethodView):
             related.update({k: "*" for k in model_related})
 
         if resource_id is not None:
-            query, _ = qsqla.dict2sqla(dict(filters=filter_by_id, related=related), isouter=True)
+            nodes, _ = self._related_nodes(qsqla, dict(related=related))
+            joined = related if nodes is None else None
+            query, _ = qsqla.dict2sqla(dict(filters=filter_by_id, related=joined), isouter=True)
 
             if subresource is None:
+                self._check_version(model, resource_id)
                 resource = query.one_or_none()
                 if not resource:
                     flask.abort(status.NOT_FOUND)
 
+                if nodes:
+                    relations.load(query.session, model, [resource], nodes)
+
                 res = resource.to_dict(links=True)
-                self._check_etag(res)
+                if not model.is_versioned():
+                    self._check_etag(res)
 
                 return self._response_with_etag(
-                    builder, (res, self._link_header(resource)), res
+                    builder, (res, self._link_header(resource)),
+                    resource if model.is_versioned() else res
                 )
 
+        spec, args = self._aggregate_args(qsqla, flask.request.args)
+
         if cap.config['AUTOCRUD_QUERY_STRING_FILTERS_ENABLED'] is True:
-            data, error = qsqla.parse(flask.request.args)
+            data, error = qsqla.parse(args)
         else:
             data, error = {}, []
 
@@ -198,10 +583,21 @@ class Service(MethodView):
             else:
                 data['filters'] += filter_by_id
 
-        return self._build_response_list(
-            model, builder, {**data, 'related': related}, error, isouter=True,
+        terms = flask.request.args.get(qsqla.arguments.scalar.search)
+        if spec is not None:
+            return self._build_response_aggregate(
+                model, builder, {**data, 'search': terms, 'aggregate': spec}, error,
+                only_head=flask.request.method == 'HEAD'
+            )
+
+        started = time.perf_counter()
+        response = self._build_response_list(
+            model, builder, {**data, 'related': related, 'search': terms}, error, isouter=True,
             only_head=(resource_id is None and flask.request.method == 'HEAD')
         )
+        if resource_id is None:
+            self._observe(model, data, started, response)
+        return response
 
     def fetch(self, **kwargs):
         """
@@ -220,8 +616,220 @@ class Service(MethodView):
             data = {}  # prevent warning
             flask.abort(status.UNPROCESSABLE_ENTITY, response=exc.asdict())
 
-        return self._build_response_list(self._model, builder, data, only_head=only_head)
+        if data.get('aggregate') is not None:
+            spec = dict(data['aggregate'], sorting=data.get('sorting'))
+            return self._build_response_aggregate(
+                self._model, builder, {**data, 'aggregate': spec}, only_head=only_head
+            )
+
+        started = time.perf_counter()
+        response = self._build_response_list(self._model, builder, data, only_head=only_head)
+        self._observe(self._model, data, started, response)
+        return response
+
+    def _observe(self, model, data, started, response):
+        """
+        records filter and sort columns of a collection request for the index advisor,
+        those of a streamed response when all rows are sent. Indexes are created by another thread
+
+        :param model: self model or subresource model
+        :param data: filters and sorting passed to _build_response_list
+        :param started: time.perf_counter() before the query
+        :param response: response of the request
+        """
+        advisor = self._advisor
+        if advisor is None:
+            return
+
+        app = cap._get_current_object()
+        bind = self._db.session().get_bind()
+
+        def create(p):
+            try:
+                advisor.create_index(bind, model, p)
+            except Exception:
+                app.logger.exception('unable to create index suggested for %s', model.__name__)
+
+        def observe():
+            p = advisor.observe(model, data, started)
+            if p is not None:
+                threading.Thread(target=create, args=(p,), daemon=True).start()
+
+        if response.is_streamed:
+            response.call_on_close(observe)
+        else:
+            observe()
+
+    @staticmethod
+    def _aggregate_args(qsqla, args):
+        """
+        with _group or _agg in query string, arguments named as aggregate functions are
+        filters of groups (HAVING) and _sort accepts aggregate functions too
+
+        :param qsqla: Qs2Sqla instance
+        :param args: query string arguments
+        :return: aggregate spec or None, arguments left to Qs2Sqla.parse
+        """
+        scalar, vector = qsqla.arguments.scalar, qsqla.arguments.vector
+        if scalar.group not in args and scalar.agg not in args:
+            return None, args
+
+        having, sorting, others = [], [], []
+        for k, v in args.items(multi=True):
+            if aggregate.is_expression(k):
+                having.append(qsqla.get_filter(k, v))
+            elif k == vector.sort:
+                for item in qsqla.clear_empty(v):
+                    d = 'desc' if item.startswith(qsqla.syntax.REVERSE) else 'asc'
+                    sorting.append(dict(field=qsqla.clear_escape(item, escape=qsqla.syntax.REVERSE), direction=d))
+            else:
+                others.append((k, v))
+
+        spec = dict(
+            group=qsqla.clear_empty(args.get(scalar.group) or ''),
+            functions=qsqla.clear_empty(args.get(scalar.agg) or ''),
+            having=having,
+            sorting=sorting
+        )
+        return spec, MultiDict(others)
+
+    def _build_response_distinct(self, model, builder, facets):
+        """
+        distinct values of every column with their count of rows, most frequent first,
+        rows are selected by query string filters and _search, one query for each column
+
+        :param model: model class
+        :param builder: response builder
+        :param facets: columns separated by ;
+        :return:
+        """
+        qsqla = Qs2Sqla(model, self.syntax, self.arguments, self._plans)
+        args = flask.request.args
+        columns = qsqla.clear_empty(facets)
+        invalid = [c for c in columns if c not in model.columns()] if columns else [facets]
+
+        if cap.config['AUTOCRUD_QUERY_STRING_FILTERS_ENABLED'] is True:
+            data, error = qsqla.parse(args)
+            invalid += error
+        else:
+            data = {}
+
+        search_spec, error = self._search_spec(qsqla, dict(search=args.get(qsqla.arguments.scalar.search)))
+        invalid += error
+
+        _, limit, error = qsqla.get_pagination(args, cap.config['AUTOCRUD_MAX_QUERY_LIMIT'])
+        invalid += error
+
+        query, error = qsqla.dict2sqla(dict(filters=data.get('filters'), search=search_spec), ranked=False)
+        invalid += error
 
+        if len(invalid) > 0:
+            flask.abort(status.BAD_REQUEST, response=dict(invalid=invalid))
+
+        session = self._db.session()
+        prefix = args.get(qsqla.arguments.scalar.prefix)
+        response = {}
+
+        for c in columns:
+            selected = query.filter(aggregate.prefix_filter(model.columns()[c], prefix)) if prefix else query
+            aggregation = aggregate.Aggregation(
+                model, [c], ['count(*)'], sorting=[dict(field='count(*)', direction='desc')]
+            )
+            statement = aggregation.statement(selected)
+            if limit:
+                statement = statement.limit(limit)
+
+            response[c] = [
+                dict(value=r[c], count=r['count(*)']) for r in aggregation.rows(session.execute(statement))
+            ]
+
+        etag = self._compute_etag(response)
+        self._check_etag(etag)
+        return self._response_with_etag(builder, response, etag)
+
+    @search_fallback
+    def _build_response_aggregate(self, model, builder, data, error=None, only_head=False):
+        """
+        groups and aggregate functions are computed by database, filters are the same of collections
+
+        :param model: self model or subresource model
+        :param builder: response builder
+        :param data: dict passed to dict2sqla with aggregate spec
+        :param error: previous error to add to response
+        :param only_head: enable HEAD method response
+        :return:
+        """
+        qsqla = Qs2Sqla(model, self.syntax, self.arguments, self._plans)
+        args = flask.request.args
+        invalid = error or []
+
+        if cap.config['AUTOCRUD_AGGREGATE_ENABLED'] is not True:
+            flask.abort(status.BAD_REQUEST, response=dict(invalid=[qsqla.arguments.scalar.agg]))
+
+        spec = data['aggregate']
+        aggregation = aggregate.Aggregation(
+            model, spec.get('group'), spec.get('functions'), spec.get('having'), spec.get('sorting')
+        )
+        invalid += aggregation.invalid
+        if not aggregation.functions and not aggregation.invalid:
+            invalid.append(qsqla.arguments.scalar.agg)
+
+        # rows are groups, arguments about rows of the collection do not apply
+        scalar, vector = qsqla.arguments.scalar, qsqla.arguments.vector
+        invalid += [k for k in (vector.fields, scalar.related, scalar.cursor) if k in args]
+
+        search_spec, error = self._search_spec(qsqla, data)
+        invalid += error
+
+        page, limit, error = qsqla.get_pagination(args, cap.config['AUTOCRUD_MAX_QUERY_LIMIT'])
+        invalid += error
+
+        query, error = qsqla.dict2sqla(
+            dict(filters=data.get('filters'), related=data.get('related'), search=search_spec), ranked=False
+        )
+        invalid += error
+
+        if len(invalid) > 0:
+            flask.abort(status.BAD_REQUEST, response=dict(invalid=invalid))
+
+        session = self._db.session()
+        statement = aggregation.statement(query)
+        headers, code, pagination = {}, status.SUCCESS, None
+
+        if aggregation.group:
+            total = None
+            if cap.config['AUTOCRUD_COUNT_POLICY'] != 'none' and qsqla.arguments.scalar.no_count not in args:
+                total = session.execute(aggregation.count(statement)).scalar()
+
+            statement, pagination = paginate(statement, page, limit, total)
+            headers, code = self._pagination_headers(pagination)
+
+        if only_head is True or code == status.NO_CONTENT:
+            return self._response.no_content(lambda *arg: (None, code, headers))()
+
+        rows = aggregation.rows(session.execute(statement))
+        if pagination is not None and pagination.total_results is None:
+            more = limit is not None and len(rows) > limit
+            rows = rows[:limit] if limit else rows
+            pagination = pagination._replace(has_next=more)
+            headers, code = self._pagination_headers(pagination)
+
+        if cap.config['AUTOCRUD_EXPORT_ENABLED'] and qsqla.arguments.scalar.export in args:
+            csv_builder = self._response.csv(filename=self._export_filename(qsqla, page, limit))
+            return csv_builder(data=rows)
+
+        if isinstance(builder, NdJsonBuilder):
+            return self._response.build_response(builder, (rows, code, headers))
+
+        response = {model.__name__ + model.collection_suffix: rows}
+        if pagination is not None and qsqla.arguments.scalar.no_links not in args:
+            response.update({'_meta': self._pagination_meta(pagination)})
+
+        etag = self._compute_etag(response)
+        self._check_etag(etag)
+        return self._response_with_etag(builder, (response, code, headers), etag)
+
+    @search_fallback
     def _build_response_list(self, model, builder, data, error=None, only_head=False, **kwargs):
         """
 
@@ -232,14 +840,25 @@ class Service(MethodView):
         :param only_head: enable HEAD method response
         :return:
         """
-        qsqla = Qs2Sqla(model, self.syntax, self.arguments)
+        qsqla = Qs2Sqla(model, self.syntax, self.arguments, self._plans)
         invalid = error or []
 
+        nodes, error = self._related_nodes(qsqla, data)
+        invalid += error
+
+        spec, error = self._search_spec(qsqla, data)
+        data = {**data, 'search': spec}
+        invalid += error
+
         export_enabled = cap.config['AUTOCRUD_EXPORT_ENABLED']
         links_enabled = not (
             (export_enabled and qsqla.arguments.scalar.export in flask.request.args)
             or qsqla.arguments.scalar.no_links in flask.request.args
         )
+        templates = self._link_templates(qsqla, data, nodes) if links_enabled else None
+        row_links = links_enabled and templates is None
+        stream = self._stream_enabled(qsqla, builder)
+        ndjson = isinstance(builder, NdJsonBuilder)
 
         page, limit, error = qsqla.get_pagination(
             flask.request.args,
@@ -247,47 +866,600 @@ class Service(MethodView):
         )
         invalid += error
 
-        query, error = qsqla.dict2sqla(data, **kwargs)
+        cursor = qsqla.get_cursor(flask.request.args)
+        sorting = data.get('sorting') or []
+        if cursor is not None:
+            data = {**data, 'sorting': []}
+
+        joined = data if nodes is None else {**data, 'related': None}
+        query, error = qsqla.dict2sqla(joined, ranked=cursor is None, **kwargs)
+        invalid += error
+
+        export_format, error = self._columnar_format(qsqla, data)
         invalid += error
 
+        if cursor is not None:
+            query, _, backward, error = qsqla.keyset(query, sorting, cursor, limit)
+            invalid += error
+
         if len(invalid) > 0:
             flask.abort(status.BAD_REQUEST, response=dict(invalid=invalid))
 
-        query, pagination = sqlaf.apply_pagination(query, page, limit)
-        headers, code = self._pagination_headers(pagination)
+        if export_format is not None:
+            return self._columnar_export(qsqla, query, data, page, limit, export_format)
 
-        if only_head is True or code == status.NO_CONTENT:
-            # return no content with headers and status code
-            return self._response.no_content(lambda *arg: (None, code, headers))()
+        if self._stream_export_enabled(qsqla):
+            return self._stream_export(qsqla, query, data, page, limit, nodes)
 
-        response = []
-        result = query.all()
+        etag, modified = self._list_version(qsqla, query, data)
+        version_headers = self._version_headers(etag, modified)
+
+        if cursor is not None:
+            page = None
+            result, meta = self._keyset_result(qsqla, self._fetch(qsqla, query, data, nodes), cursor, backward, limit)
+            headers, code = self._cursor_headers(meta, limit)
+            headers.update(version_headers)
+            if only_head is True:
+                return self._response.no_content(lambda *arg: (None, code, headers))()
 
+            if stream is True:
+                return self._stream_list(
+                    model, builder, result, code, headers, links_enabled, lambda: meta, row_links, templates
+                )
+        elif not stream and self._window_count_enabled(qsqla, limit, only_head, nodes is None and data.get('related')):
+            rows = self._fetch(qsqla, windowed(query, page, limit), data, nodes)
+            total = rows[0][-1] if rows else self._count_results(qsqla, query, data)
+            _, pagination = paginate(query, page, limit, total)
+            headers, code = self._pagination_headers(pagination)
+            headers.update(version_headers)
+
+            if code == status.NO_CONTENT:
+                return self._response.no_content(lambda *arg: (None, code, headers))()
+
+            result = [r[0] for r in rows]
+            meta = self._pagination_meta(pagination)
+        else:
+            total = self._count_results(qsqla, query, data)
+            query, pagination = paginate(query, page, limit, total)
+            headers, code = self._pagination_headers(pagination)
+            headers.update(version_headers)
+
+            if only_head is True or code == status.NO_CONTENT:
+                # return no content with headers and status code
+                return self._response.no_content(lambda *arg: (None, code, headers))()
+
+            if stream is True:
+                rows = self._iterate(qsqla, query, data, nodes)
+                return self._stream_page(
+                    model, builder, rows, pagination, code, headers, links_enabled, row_links, templates
+                )
+
+            result = self._fetch(qsqla, query, data, nodes)
+            if pagination.total_results is None:
+                more = limit is not None and len(result) > limit
+                result = result[:limit] if limit else result
+                pagination = pagination._replace(has_next=more)
+                headers, code = self._pagination_headers(pagination)
+                headers.update(version_headers)
+
+                if not result and pagination.page_number > 1:
+                    return self._response.no_content(lambda *arg: (None, status.NO_CONTENT, headers))()
+
+            meta = self._pagination_meta(pagination)
+
+        response = []
         for r in result:
             if qsqla.arguments.scalar.as_table in flask.request.args:
-                response += to_flatten(r, to_dict=model.to_dict)
+                response += to_flatten(r, to_dict=lambda i: i.to_dict())
             else:
-                response.append(r.to_dict(links_enabled))
+                response.append(r.to_dict(row_links))
 
         if export_enabled:
             if qsqla.arguments.scalar.export in flask.request.args:
-                filename = flask.request.args.get(qsqla.arguments.scalar.export)
-                filename = filename or "{}{}{}".format(
-                    model.__name__,
-                    "_{}".format(page) if page else "",
-                    "_{}".format(limit) if limit else ""
-                )
+                filename = self._export_filename(qsqla, page, limit)
                 csv_builder = self._response.csv(filename=filename)
                 return csv_builder(data=response)
 
+        if ndjson is True:
+            return self._response.build_response(builder, (response, code, headers))
+
         response = {model.__name__ + model.collection_suffix: response}
         if links_enabled:
-            response.update({'_meta': self._pagination_meta(pagination)})
+            response.update({'_meta': self._with_templates(meta, templates)})
+
+        if etag is None:
+            etag = self._compute_etag(response)
+            self._check_etag(etag)
 
-        etag = self._compute_etag(response)
-        self._check_etag(etag)
         return self._response_with_etag(builder, (response, code, headers), etag)
 
+    def _search_spec(self, qsqla, data):
+        """
+        words of _search argument or of search in FETCH payload are looked for in searchable columns
+
+        :param qsqla: Qs2Sqla instance
+        :param data: dict with search terms
+        :return: search passed to dict2sqla or None, invalid
+        """
+        terms = data.get('search')
+        if terms is None:
+            return None, []
+
+        conf = cap.config
+        words = search.words(terms)
+        if not (words and conf['AUTOCRUD_SEARCH_ENABLED'] is True):
+            return None, [qsqla.arguments.scalar.search]
+
+        backend = search.resolve(
+            self._db.session(), qsqla.model, conf['AUTOCRUD_SEARCH_BACKEND'], conf['AUTOCRUD_SEARCH_LANGUAGE']
+        )
+        if backend is None:
+            return None, [qsqla.arguments.scalar.search]
+
+        return dict(backend=backend.name, language=backend.language, values=backend.values(words)), []
+
+    @staticmethod
+    def _related_nodes(qsqla, data):
+        """
+        with selectin strategy related models are loaded after parents instead of joined
+
+        :param qsqla: Qs2Sqla instance
+        :param data: dict passed to dict2sqla
+        :return: list of relations.Node or None if related are joined, invalid
+        """
+        if not data.get('related') or cap.config['AUTOCRUD_RELATED_STRATEGY'] != 'selectin':
+            return None, []
+
+        return relations.parse(qsqla.model, data['related'], qsqla.syntax)
+
+    @staticmethod
+    def _core_enabled(qsqla, data, nodes=None):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param data: dict passed to dict2sqla
+        :param nodes: related loaded after parents
+        :return: True if rows are read by core statements
+        """
+        if cap.config['AUTOCRUD_READ_ENGINE'] != 'core':
+            return False
+        if nodes is not None:
+            return all(core.supported(n.model) for node in nodes for n in node.walk()) \
+                and core.supported(qsqla.model)
+
+        return core.supported(qsqla.model, data.get('related'))
+
+    def _fetch(self, qsqla, query, data, nodes=None):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query to execute
+        :param data: dict passed to dict2sqla
+        :param nodes: related loaded after parents
+        :return: list of rows
+        """
+        if nodes is not None:
+            data = {**data, 'related': None}
+
+        if self._core_enabled(qsqla, data, nodes):
+            rows = core.fetch(query, data, qsqla.syntax)
+        else:
+            rows = query.all()
+
+        if nodes:
+            parents = [r[0] if isinstance(r, tuple) else r for r in rows]
+            relations.load(query.session, qsqla.model, parents, nodes)
+
+        return rows
+
+    def _iterate(self, qsqla, query, data, nodes=None):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query to execute
+        :param data: dict passed to dict2sqla
+        :param nodes: related loaded after parents, for every chunk of rows
+        :return: iterator of rows
+        """
+        chunk_size = cap.config['AUTOCRUD_STREAM_CHUNK_SIZE']
+        if nodes is not None:
+            data = {**data, 'related': None}
+
+        if self._core_enabled(qsqla, data, nodes):
+            rows = core.iterate(query, data, chunk_size, qsqla.syntax)
+        else:
+            rows = iterate(query, chunk_size, bool(data.get('related')))
+
+        if not nodes:
+            return rows
+
+        def chunks():
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                relations.load(query.session, qsqla.model, chunk, nodes)
+                yield from chunk
+
+        return chunks()
+
+    def _stream_enabled(self, qsqla, builder):
+        """
+        streaming is available only for json collections not exported or flattened,
+        ndjson collections are always streamed
+
+        :param qsqla: Qs2Sqla instance
+        :param builder: response builder negotiated
+        :return:
+        """
+        args = qsqla.arguments.scalar
+        if args.as_table in flask.request.args:
+            return False
+        if cap.config['AUTOCRUD_EXPORT_ENABLED'] and args.export in flask.request.args:
+            return False
+        if isinstance(builder, NdJsonBuilder):
+            return True
+
+        return bool(
+            cap.config['AUTOCRUD_STREAM_ENABLED'] is True
+            and args.stream in flask.request.args
+            and isinstance(builder, JsonBuilder)
+        )
+
+    @staticmethod
+    def _export_filename(qsqla, page, limit):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param page: page number
+        :param limit: page size
+        :return:
+        """
+        filename = flask.request.args.get(qsqla.arguments.scalar.export)
+        return filename or "{}{}{}".format(
+            qsqla.model.__name__,
+            "_{}".format(page) if page else "",
+            "_{}".format(limit) if limit else ""
+        )
+
+    @staticmethod
+    def _export_pagination(qsqla, page, limit):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param page: page number
+        :param limit: page size
+        :return: page and limit of streamed export
+        """
+        args = qsqla.arguments.scalar
+        if cap.config['AUTOCRUD_EXPORT_UNLIMITED'] is True and args.limit not in flask.request.args:
+            return None, None
+        return page, limit
+
+    @staticmethod
+    def _columnar_format(qsqla, data):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param data: dict passed to dict2sqla
+        :return: arrow or parquet or None for csv, invalid arguments
+        """
+        args = qsqla.arguments.scalar
+        if not (cap.config['AUTOCRUD_EXPORT_ENABLED'] is True and args.export in flask.request.args):
+            return None, []
+
+        fmt = flask.request.args.get(args.format) or 'csv'
+        if fmt == 'csv':
+            return None, []
+        if fmt not in columnar.FORMATS:
+            return None, [args.format]
+        if data.get('related'):
+            return None, list(data.get('related').keys())
+
+        if not columnar.available():
+            flask.abort(status.NOT_IMPLEMENTED, 'pyarrow is required in order to export in {}'.format(fmt))
+
+        return fmt, []
+
+    def _columnar_export(self, qsqla, query, data, page, limit, fmt):
+        """
+        exports in arrow ipc stream or parquet, rows are read via core
+        and converted into record batches without building model instances
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query with filters applied
+        :param data: dict passed to dict2sqla
+        :param page: page number
+        :param limit: page size
+        :param fmt: arrow or parquet
+        :return:
+        """
+        model = qsqla.model
+        columns = model.columns()
+        chunk_size = cap.config['AUTOCRUD_STREAM_CHUNK_SIZE']
+        fields = data.get('fields') or list(columns.keys())
+
+        stm = query.statement.with_only_columns([columns[f] for f in fields])
+        page, limit = self._export_pagination(qsqla, page, limit)
+        if limit:
+            stm = stm.offset(((page or 1) - 1) * limit).limit(limit)
+
+        result = self._db.session().execute(stm.execution_options(stream_results=True))
+        arrow_schema = columnar.schema(model, fields)
+        batches = columnar.record_batches(result, arrow_schema, chunk_size)
+
+        mimetype, extension = columnar.FORMATS[fmt]
+        return stream_response(
+            columnar.columnar_stream(fmt, batches, arrow_schema), mimetype, headers={
+                'Total-Columns': len(fields),
+                'Content-Disposition': 'attachment; filename={}.{}'.format(
+                    self._export_filename(qsqla, page, limit), extension
+                )
+            }
+        )
+
+    @staticmethod
+    def _stream_export_enabled(qsqla):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :return:
+        """
+        args = qsqla.arguments.scalar
+        return bool(
+            cap.config['AUTOCRUD_STREAM_ENABLED'] is True
+            and cap.config['AUTOCRUD_EXPORT_ENABLED'] is True
+            and args.stream in flask.request.args
+            and args.export in flask.request.args
+        )
+
+    def _stream_export(self, qsqla, query, data, page, limit, nodes=None):
+        """
+        streams csv export, header is built from requested fields and related columns,
+        Total-Rows header is not sent because rows are not counted
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query with filters applied
+        :param data: dict passed to dict2sqla
+        :param page: page number
+        :param limit: page size
+        :param nodes: related loaded after parents, nested ones are not exported
+        :return:
+        """
+        model = qsqla.model
+        conf = cap.config
+        sep = conf.get('RB_FLATTEN_SEPARATOR', '_')
+        prefix = conf.get('RB_FLATTEN_PREFIX', '')
+
+        page, limit = self._export_pagination(qsqla, page, limit)
+        if limit:
+            query = query.offset(((page or 1) - 1) * limit).limit(limit)
+
+        def key(*names):
+            return sep.join(n for n in (prefix, *names) if n)
+
+        fields = list(data.get('fields') or model.columns().keys())
+        pk = model.primary_key_field()
+        if pk not in fields:
+            # primary key is always loaded, so it is exported by buffered response too
+            fields.insert(0, pk)
+
+        header = [key(c) for c in fields]
+        if nodes:
+            for node in nodes:
+                name = node.name + model.collection_suffix if node.uselist else node.name
+                header += [key(name, c) for c in node.columns]
+        else:
+            for rel, cols in (data.get('related') or {}).items():
+                instance, columns = model.related(rel)
+                name = rel + model.collection_suffix if instance.property.uselist else rel
+                cols = columns.keys() if not cols or cols[0] == qsqla.syntax.ALL else cols
+                header += [key(name, c) for c in cols]
+
+        options = dict(quoting=csv.QUOTE_ALL)
+        for k, o in (
+                ('RB_CSV_DIALECT', 'dialect'),
+                ('RB_CSV_DELIMITER', 'delimiter'),
+                ('RB_CSV_QUOTING_CHAR', 'quotechar')
+        ):
+            if conf.get(k):
+                options[o] = conf.get(k)
+
+        generator = csv_stream(
+            header,
+            self._iterate(qsqla, query, data, nodes),
+            lambda r: to_flatten(r, to_dict=lambda i: i.to_dict(False), sep=sep, parent_key=prefix),
+            chunk_size=conf['AUTOCRUD_STREAM_CHUNK_SIZE'],
+            **options
+        )
+        return stream_response(generator, 'text/csv', headers={
+            'Total-Columns': len(header),
+            'Content-Disposition': 'attachment; filename={}.csv'.format(
+                self._export_filename(qsqla, page, limit)
+            )
+        })
+
+    def _stream_page(self, model, builder, rows, pagination, code, headers, links_enabled,
+                     row_links=None, templates=None):
+        """
+        streams a page of offset pagination, if the count is skipped
+        the next page is known only after all rows are read
+
+        :param model: self model or subresource model
+        :param builder: response builder negotiated
+        :param rows: iterator of rows
+        :param pagination: pagination object
+        :param code: status code
+        :param headers: pagination headers
+        :param links_enabled:
+        :param row_links: links in every row, default links_enabled
+        :param templates: link templates sent in _meta
+        :return:
+        """
+        limit = pagination.page_size
+        if pagination.total_results is not None:
+            return self._stream_list(
+                model, builder, rows, code, headers, links_enabled,
+                lambda: self._pagination_meta(pagination), row_links, templates
+            )
+
+        more = []
+
+        def page_rows():
+            for i, r in enumerate(rows):
+                if limit and i >= limit:
+                    more.append(True)
+                    break
+                yield r
+
+        def meta():
+            return self._pagination_meta(pagination._replace(has_next=bool(more)))
+
+        return self._stream_list(model, builder, page_rows(), code, headers, links_enabled, meta, row_links, templates)
+
+    def _stream_list(self, model, builder, rows, code, headers, links_enabled, meta, row_links=None, templates=None):
+        """
+        payload etag is not sent because the body is unknown when headers are written,
+        version etag of versioned models is already in headers,
+        ndjson sends pagination only in headers
+
+        :param model: self model or subresource model
+        :param builder: response builder negotiated
+        :param rows: iterable of rows
+        :param code: status code
+        :param headers: pagination headers
+        :param links_enabled:
+        :param meta: callable that returns _meta
+        :param row_links: links in every row, default links_enabled
+        :param templates: link templates sent in _meta
+        :return:
+        """
+        chunk_size = cap.config['AUTOCRUD_STREAM_CHUNK_SIZE']
+        row_links = links_enabled if row_links is None else row_links
+        if isinstance(builder, NdJsonBuilder):
+            generator = ndjson_stream(rows, lambda r: r.to_dict(row_links), chunk_size)
+            return stream_response(generator, builder.mimetype, code, headers)
+
+        generator = json_stream(
+            model.__name__ + model.collection_suffix, rows,
+            lambda r: r.to_dict(row_links),
+            meta=(lambda: self._with_templates(meta(), templates)) if links_enabled else None,
+            chunk_size=chunk_size
+        )
+        return stream_response(generator, builder.mimetype, code, headers)
+
+    @staticmethod
+    def _link_templates(qsqla, data, nodes=None):
+        """
+        with _links=template links are sent once as templates instead of in every row
+
+        :param qsqla: Qs2Sqla instance
+        :param data: dict passed to dict2sqla
+        :param nodes: related loaded after parents
+        :return: templates of model and of related models or None
+        """
+        if flask.request.args.get(qsqla.arguments.scalar.links) != 'template':
+            return None
+
+        model = qsqla.model
+        templates = {model.__name__: model.link_templates()}
+        for n in (n for node in nodes or () for n in node.walk()):
+            templates[n.model.__name__] = n.model.link_templates()
+
+        for rel in (data.get('related') or {}).keys() if not nodes else ():
+            instance, _ = model.related(rel)
+            if instance is not None:
+                related = instance.property.mapper.class_
+                templates[related.__name__] = related.link_templates()
+
+        return templates
+
+    @staticmethod
+    def _with_templates(meta, templates):
+        """
+
+        :param meta: _meta of collection
+        :param templates: link templates or None
+        :return:
+        """
+        if templates is None:
+            return meta
+        return {**meta, 'links': templates}
+
+    def _window_count_enabled(self, qsqla, limit, only_head, joined=False):
+        """
+        total count can be fetched with the page only if it is exact and the dialect supports it,
+        rows joined to related ones would be counted many times
+
+        :param qsqla: Qs2Sqla instance
+        :param limit: page size
+        :param only_head: HEAD request does not need rows
+        :param joined: True if related models are joined to rows
+        :return:
+        """
+        return bool(
+            limit and not only_head
+            and not joined
+            and cap.config['AUTOCRUD_WINDOW_COUNT_ENABLED'] is True
+            and cap.config['AUTOCRUD_COUNT_POLICY'] == 'exact'
+            and qsqla.arguments.scalar.no_count not in flask.request.args
+            and supports_window(self._db.session().bind.dialect)
+        )
+
+    def _count_results(self, qsqla, query, data):
+        """
+        applies the configured count policy
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query with filters applied
+        :param data: dict passed to dict2sqla
+        :return: total rows or None if count is skipped
+        """
+        model = qsqla.model
+        policy = cap.config['AUTOCRUD_COUNT_POLICY']
+        if policy == 'none' or qsqla.arguments.scalar.no_count in flask.request.args:
+            return None
+
+        session = self._db.session()
+        if policy == 'estimated' and not (data.get('filters') or data.get('related') or data.get('search')):
+            total = estimated_count(session, model.__table__)
+            if total is not None:
+                return total
+
+        key = None
+        if policy == 'cached' and self._counter is not None:
+            key = CountCache.key(model, data)
+            total = self._counter.get(key)
+            if total is not None:
+                return total
+
+        pk = getattr(model, model.primary_key_field()) if data.get('related') else None
+        total = session.execute(count_query(query, pk)).scalar()
+        if key is not None:
+            self._counter.set(key, total)
+
+        return total
+
+    @classmethod
+    def _invalidate(cls, model=None):
+        """
+        invalidates cached data of a model after a write
+
+        :param model: model class, default self model
+        """
+        model = model or cls._model
+        pending = flask.g.get('autocrud_batch') if flask.has_app_context() else None
+        if pending is not None:
+            # within a batch data is committed only at the end
+            pending.add((cls, model))
+            return
+
+        name = model.__name__
+        if cls._counter is not None:
+            cls._counter.invalidate(name)
+        if cls._cache is not None:
+            cls._cache.invalidate(name)
+
     def _response_with_etag(self, builder, data, etag):
         """
 
@@ -300,9 +1472,134 @@ class Service(MethodView):
 
         if cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True:
             response.set_etag(etag if isinstance(etag, str) else self._compute_etag(etag))
+            if isinstance(etag, Model) and isinstance(etag.version_info()[2], datetime.datetime):
+                response.last_modified = etag.version_info()[2]
 
         return response
 
+    def _check_version(self, model, resource_id):
+        """
+        answers conditional requests of a versioned resource
+        reading only version columns before the row is loaded
+
+        :param model: model class
+        :param resource_id: primary key
+        """
+        if not (model.is_versioned() and cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True):
+            return
+
+        columns = model.version_columns()
+        row = model.query.with_entities(*[c for c in columns if c is not None]) \
+            .filter(columns[0] == resource_id).first()
+        if row is None:
+            flask.abort(status.NOT_FOUND)
+
+        values = iter(row)
+        version = tuple(next(values) if c is not None else None for c in columns)
+        self._check_etag(self._version_etag(model, version))
+        self._check_modified(version[2])
+
+    def _list_version(self, qsqla, query, data):
+        """
+        etag of a collection derived from the request and from an aggregate of version columns,
+        related resources are not versioned so the payload etag is used for them
+
+        :param qsqla: Qs2Sqla instance
+        :param query: query with filters applied
+        :param data: dict passed to dict2sqla
+        :return: etag and last modification time, None if model is not versioned
+        """
+        model = qsqla.model
+        if not (model.is_versioned() and cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True):
+            return None, None
+        if data.get('related'):
+            return None, None
+
+        pk, version, updated = model.version_columns()
+        columns = [func.count()]
+        if version is not None:
+            # count and sum of versions do not change if a row is replaced by one with the same version
+            if updated is None and pk.type.python_type is not int:
+                return None, None
+            columns.append(func.sum(version))
+            if pk.type.python_type is int:
+                columns += [func.max(pk), func.sum(pk), func.sum(pk * version)]
+        if updated is not None:
+            columns.append(func.max(updated))
+
+        row = self._db.session().execute(aggregate_query(query, columns)).first()
+        modified = row[-1] if updated is not None else None
+        mimetype, _ = self._response.get_mimetype_accept()
+
+        etag = generate_etag(json.dumps([
+            model.__name__,
+            flask.request.path,
+            sorted(flask.request.args.items(multi=True)),
+            flask.request.get_json(silent=True),
+            mimetype,
+            [str(v) for v in row]
+        ], sort_keys=True, default=str).encode('utf-8'))
+
+        self._check_etag(etag)
+        self._check_modified(modified)
+        return etag, modified
+
+    @staticmethod
+    def _version_headers(etag, modified):
+        """
+        headers known before rows are loaded, sent also by streamed responses
+
+        :param etag: etag string
+        :param modified: last modification time
+        :return:
+        """
+        headers = {}
+        if etag:
+            headers['ETag'] = quote_etag(etag)
+        if isinstance(modified, datetime.datetime):
+            headers['Last-Modified'] = http_date(modified)
+        return headers
+
+    @staticmethod
+    def _version_etag(model, version):
+        """
+        etag derived from primary key, version and modification time without serializing the row
+
+        :param model: model class
+        :param version: values returned by version_info
+        :return:
+        """
+        data = "{}:{}".format(model.__name__, ":".join(str(v) for v in version))
+        return generate_etag(data.encode('utf-8'))
+
+    @staticmethod
+    def _utc(date):
+        """
+
+        :param date: naive datetime is considered utc
+        :return: naive utc datetime truncated to seconds as http dates
+        """
+        if date.tzinfo is not None:
+            date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date.replace(microsecond=0)
+
+    @classmethod
+    def _check_modified(cls, modified):
+        """
+        If-Modified-Since is evaluated only if If-None-Match is missing
+
+        :param modified: last modification time
+        """
+        if cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is not True:
+            return
+        if not isinstance(modified, datetime.datetime) or flask.request.if_none_match:
+            return
+
+        since = flask.request.if_modified_since
+        if since is not None and flask.request.method in ('GET', 'FETCH'):
+            if cls._utc(modified) <= cls._utc(since):
+                flask.abort(flask.Response(status=status.NOT_MODIFIED))
+
     def _validate_new_data(self):
         """
         validates new json resource object
@@ -335,6 +1632,7 @@ class Service(MethodView):
         session.flush()
         res = resource.to_dict(links=True)
         session.commit()
+        cls._invalidate()
         return res
 
     @classmethod
@@ -351,6 +1649,7 @@ class Service(MethodView):
         session.flush()
         res = resource.to_dict(links=True)
         session.commit()
+        cls._invalidate()
         return res
 
     @classmethod
@@ -366,12 +1665,20 @@ class Service(MethodView):
         num_pages = pagination.num_pages
         page_size = pagination.page_size
 
-        if num_pages == 0:
-            return dict(first=None, last=None, next=None, prev=None)
-
         def format_link(p):
             return "{}?{}={}&{}={}".format(flask.request.path, args.page, p, args.limit, page_size)
 
+        if num_pages is None:
+            return dict(
+                first=format_link(1) if page_number > 1 else None,
+                last=None,
+                next=format_link(page_number + 1) if pagination.has_next else None,
+                prev=format_link(page_number - 1) if page_number > 1 else None
+            )
+
+        if num_pages == 0:
+            return dict(first=None, last=None, next=None, prev=None)
+
         return dict(
             first=format_link(1) if page_number > 1 else None,
             last=format_link(num_pages) if page_number != num_pages else None,
@@ -379,6 +1686,58 @@ class Service(MethodView):
             prev=format_link(page_number - 1) if page_number != 1 else None
         )
 
+    @classmethod
+    def _keyset_result(cls, qsqla, rows, cursor, backward, limit):
+        """
+
+        :param qsqla: Qs2Sqla instance
+        :param rows: rows returned by keyset query: resource followed by keyset values
+        :param cursor: cursor token of current request
+        :param backward: True if the current page was requested via prev cursor
+        :param limit: page size
+        :return: list of resources, meta links
+        """
+        more = bool(limit) and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+        if backward:
+            rows.reverse()
+
+        if not rows:
+            return [], dict(first=None, last=None, next=None, prev=None)
+
+        first, last = tuple(rows[0][1:]), tuple(rows[-1][1:])
+        has_next = more if not backward else bool(cursor)
+        has_prev = more if backward else bool(cursor)
+
+        args = qsqla.arguments.scalar
+        params = {
+            k: v for k, v in flask.request.args.items(multi=True)
+            if k not in (args.cursor, args.page)
+        }
+
+        def format_link(token):
+            return "{}?{}".format(flask.request.path, url_encode({**params, args.cursor: token}))
+
+        return [r[0] for r in rows], dict(
+            first=format_link('') if cursor else None,
+            last=None,
+            next=format_link(qsqla.encode_cursor(last)) if has_next else None,
+            prev=format_link(qsqla.encode_cursor(first, backward=True)) if has_prev else None
+        )
+
+    @classmethod
+    def _cursor_headers(cls, meta, limit):
+        """
+
+        :param meta: links returned by _keyset_result
+        :param limit: page size
+        :return:
+        """
+        headers = {'Pagination-Page-Size': limit} if limit else {}
+        link_headers = cls._link_header(None, **meta)
+        code = status.PARTIAL_CONTENT if meta.get('next') else status.SUCCESS
+        return {**headers, **link_headers}, code
+
     @classmethod
     def _pagination_headers(cls, pagination):
         """
@@ -399,7 +1758,11 @@ class Service(MethodView):
             'Pagination-Page-Size': page_size,
         }
 
-        if page_number > num_pages > 0:
+        if total_results is None:
+            headers = {k: v for k, v in headers.items() if v is not None}
+            link_headers = cls._link_header(None, **cls._pagination_meta(pagination))
+            code = status.PARTIAL_CONTENT if pagination.has_next else status.SUCCESS
+        elif page_number > num_pages > 0:
             code = status.NO_CONTENT
         elif num_pages == 0:
             code = status.SUCCESS
@@ -450,6 +1813,8 @@ class Service(MethodView):
         :return:
         """
         if cap.config['AUTOCRUD_CONDITIONAL_REQUEST_ENABLED'] is True:
+            if isinstance(data, Model) and data.is_versioned():
+                return cls._version_etag(data.__class__, data.version_info())
             if not isinstance(data, str):
                 data = str(data if isinstance(data, (dict, list)) else data.to_dict(True))
             return generate_etag(data.encode('utf-8'))
@@ -0,0 +1,124 @@
+import csv
+import io
+
+import flask
+from flask_response_builder.builders.json import JsonBuilder
+
+from .builders import NdJsonBuilder
+
+
+def iterate(query, chunk_size, related=False):
+    """
+    fetches rows in chunks, server side cursors are used if the driver supports them
+
+    :param query: query to iterate
+    :param chunk_size: number of rows fetched at once
+    :param related: yield_per is not safe with eager loaded collections
+    :return: iterator of rows
+    """
+    if related:
+        return iter(query)
+
+    return iter(query.yield_per(chunk_size).execution_options(stream_results=True))
+
+
+def dumps(data):
+    """
+
+    :param data:
+    :return:
+    """
+    return JsonBuilder.to_me(data, separators=(',', ':'))
+
+
+def json_stream(name, rows, to_dict, meta=None, chunk_size=100):
+    """
+    writes a collection response as json one chunk of rows at a time
+
+    :param name: name of the collection
+    :param rows: iterable of rows
+    :param to_dict: function that converts a row into dict
+    :param meta: callable that returns _meta, called after all rows are written
+    :param chunk_size: rows serialized before sending data to client
+    :return: generator of str
+    """
+    yield '{' + dumps(name) + ':['
+
+    sep, chunk = '', []
+    for r in rows:
+        chunk.append(dumps(to_dict(r)))
+        if len(chunk) >= chunk_size:
+            yield sep + ','.join(chunk)
+            sep, chunk = ',', []
+
+    if len(chunk) > 0:
+        yield sep + ','.join(chunk)
+
+    yield ']'
+    if meta is not None:
+        yield ',"_meta":' + dumps(meta())
+    yield '}'
+
+
+def ndjson_stream(rows, to_dict, chunk_size=100):
+    """
+    writes one json object per line
+
+    :param rows: iterable of rows
+    :param to_dict: function that converts a row into dict
+    :param chunk_size: rows serialized before sending data to client
+    :return: generator of str
+    """
+    chunk = []
+    for r in rows:
+        chunk.append(to_dict(r))
+        if len(chunk) >= chunk_size:
+            yield NdJsonBuilder.to_me(chunk)
+            chunk = []
+
+    if len(chunk) > 0:
+        yield NdJsonBuilder.to_me(chunk)
+
+
+def csv_stream(header, rows, to_rows, chunk_size=100, **kwargs):
+    """
+    writes csv one chunk of rows at a time, the header is known in advance
+
+    :param header: list of columns name
+    :param rows: iterable of rows
+    :param to_rows: function that converts a row into a list of flatten dict
+    :param chunk_size: rows written before sending data to client
+    :param kwargs: csv writer options
+    :return: generator of str
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, header, restval='', extrasaction='ignore', **kwargs)
+    writer.writeheader()
+
+    count = 0
+    for r in rows:
+        writer.writerows(to_rows(r))
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+def stream_response(generator, mimetype, status=200, headers=None):
+    """
+
+    :param generator: generator of body chunks
+    :param mimetype:
+    :param status:
+    :param headers:
+    :return: chunked response bound to request context
+    """
+    return flask.Response(
+        flask.stream_with_context(generator),
+        status=status,
+        mimetype=mimetype,
+        headers=headers
+    )
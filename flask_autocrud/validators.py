@@ -59,8 +59,26 @@ class FieldsSchema(colander.SequenceSchema):
     fields = colander.SchemaNode(colander.String())
 
 
+class HavingSchema(colander.MappingSchema):
+    field = colander.SchemaNode(colander.String())
+    op = colander.SchemaNode(colander.String())
+    value = colander.SchemaNode(FilterValue(), missing=None)
+
+
+class Having(colander.SequenceSchema):
+    having = HavingSchema()
+
+
+class AggregateSchema(colander.MappingSchema):
+    group = FieldsSchema(missing=[])
+    functions = FieldsSchema(missing=[])
+    having = Having(missing=[])
+
+
 class FetchPayloadSchema(colander.MappingSchema):
     filters = Filters(missing=[])
     sorting = Sorting(missing=[])
     fields = FieldsSchema(missing=[])
     related = colander.SchemaNode(RelatedSchema(), missing={})
+    search = colander.SchemaNode(colander.String(), missing=None)
+    aggregate = AggregateSchema(missing=None)
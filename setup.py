@@ -96,6 +96,9 @@ setup(
         'colander >= 1.7',
         'PyYAML',
     ],
+    extras_require={
+        'columnar': ['pyarrow'],
+    },
     cmdclass={'test': PyTest},
     test_suite='tests',
     classifiers=[
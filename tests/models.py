@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
 
@@ -23,3 +25,15 @@ class albums(db.Model, Model):
     title = db.Column('Title', db.String(80), unique=True, nullable=False)
     artist_id = db.Column('ArtistId', db.Integer, ForeignKey("Artist.ArtistId"), nullable=False)
     artists = relationship(artists, backref="albums")
+
+
+class versioned(db.Model, Model):
+    __tablename__ = "Versioned"
+    __updated_field__ = 'updated_at'
+    id = db.Column('VersionedId', db.Integer, primary_key=True)
+    name = db.Column('Name', db.String(80), unique=True, nullable=False)
+    version = db.Column('Version', db.Integer, nullable=False)
+    updated_at = db.Column(
+        'UpdatedAt', db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    __mapper_args__ = {'version_id_col': version}
@@ -1,6 +1,20 @@
+import csv
+import io
+import json
+import shutil
+import sqlite3
+import time
+from sqlite3 import dbapi2
+
 import flask
 import pytest
 from flask_errors_handler import ErrorHandler
+from sqlalchemy import Index
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.inspection import inspect
+
+from flask_autocrud.bulk import delete_many, update_many
+from flask_autocrud.serializer import generic_to_dict
 
 from . import assert_export, create_app
 
@@ -232,6 +246,34 @@ def test_resource_meta(client):
         'url'
     ))
 
+    etag = res.headers.get('ETag')
+    assert etag is not None and not etag.startswith('W/')
+    res = client.get('/artist/meta', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    res = client.get('/resources')
+    etag = res.headers.get('ETag')
+    res = client.get('/resources', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    res = client.get('/resources', headers={'Accept': 'application/xml'})
+    assert res.status_code == 200
+    assert res.headers.get('ETag') != etag
+
+
+def test_schema(client):
+    autocrud = client.application.extensions['autocrud']
+    for m in autocrud.models.values():
+        schema = m.schema()
+        assert isinstance(schema.required, frozenset)
+        assert schema.fields == schema.required | schema.optional
+        assert m.submodel_from_url('/missing') is None
+        for rel in m.related().values():
+            assert rel['instance'].property.mapper.class_.__url__ in schema.submodels
+
+        with pytest.raises(AttributeError):
+            schema.required = frozenset()
+
 
 def test_get_list(client):
     res = client.get('/artist')
@@ -296,3 +338,442 @@ def test_subresource(client):
     assert data['TrackId'] == 2
     assert data['_links']['Invoice'] == '/invoiceline/1/invoice'
     assert data['_links']['Track'] == '/invoiceline/1/track'
+
+
+def test_stream(client):
+    expected = client.get('/track?_page=2&_limit=200')
+    res = client.get('/track?_page=2&_limit=200&_stream')
+    assert res.status_code == 206
+    assert res.is_streamed
+    assert res.headers.get('ETag') is None
+    assert res.headers.get('Pagination-Count') == expected.headers.get('Pagination-Count')
+    assert res.get_json() == expected.get_json()
+
+    expected = client.get('/album/5/track?_related&_no_count')
+    res = client.get('/album/5/track?_related&_no_count&_stream')
+    assert res.status_code == 200
+    assert res.get_json() == expected.get_json()
+
+    res = client.get('/artist?_cursor&_limit=5&_stream')
+    assert res.status_code == 206
+    assert len(res.get_json()['ArtistList']) == 5
+
+    res = client.get('/artist?_stream', headers={'Accept': 'application/xml'})
+    assert res.status_code == 200
+    assert res.headers.get('Content-Type') == 'application/xml; charset=utf-8'
+
+
+def test_stream_export(client):
+    def read(r):
+        return list(csv.DictReader(io.StringIO(r.data.decode()), delimiter=';'))
+
+    expected = client.get('/album?_export=pippo&_related=Artist')
+    res = client.get('/album?_export=pippo&_related=Artist&_stream')
+    assert res.status_code == 200
+    assert res.is_streamed
+    assert res.headers.get('Total-Rows') is None
+    assert res.headers.get('Content-Type') == 'text/csv; charset=utf-8'
+    assert res.headers.get('Content-Disposition') == 'attachment; filename=pippo.csv'
+    assert read(res) == read(expected)
+
+    expected = client.get('/album?_export&_fields=Title&_related=Artist')
+    res = client.get('/album?_export&_fields=Title&_related=Artist&_stream')
+    assert read(res) == read(expected)
+    assert 'AlbumId' in read(res)[0]
+
+    res = client.get('/track?_export&_stream')
+    assert len(read(res)) == 1000
+    assert res.headers.get('Content-Disposition') == 'attachment; filename=Track_1_1000.csv'
+
+    client.application.config['AUTOCRUD_EXPORT_UNLIMITED'] = True
+    res = client.get('/track?_export&_stream&_fields=TrackId;Name')
+    assert len(read(res)) == int(client.get('/track').headers.get('Pagination-Count'))
+    assert res.headers.get('Total-Columns') == '2'
+
+
+def test_ndjson(client):
+    ndjson = {'Accept': 'application/x-ndjson'}
+    expected = client.get('/track?_page=2&_limit=200').get_json()['TrackList']
+
+    res = client.get('/track?_page=2&_limit=200', headers=ndjson)
+    assert res.status_code == 206
+    assert res.is_streamed
+    assert res.headers.get('Content-Type') == 'application/x-ndjson'
+    assert res.headers.get('Pagination-Count') is not None
+    assert 'rel=next' in res.headers.get('Link')
+
+    lines = res.data.decode().splitlines()
+    assert len(lines) == 200
+    assert [json.loads(line) for line in lines] == expected
+
+    res = client.get('/artist/1', headers=ndjson)
+    assert res.status_code == 200
+    assert json.loads(res.data)['ArtistId'] == 1
+
+
+def test_columnar_export(client):
+    pyarrow = pytest.importorskip('pyarrow')
+    from pyarrow import ipc, parquet
+
+    res = client.get('/invoice?_export=pippo&_format=arrow&_fields=InvoiceId;InvoiceDate;Total&_limit=100')
+    assert res.status_code == 200
+    assert res.headers.get('Content-Type') == 'application/vnd.apache.arrow.stream'
+    assert res.headers.get('Content-Disposition') == 'attachment; filename=pippo.arrow'
+
+    table = ipc.open_stream(res.data).read_all()
+    assert table.num_rows == 100
+    assert table.column_names == ['InvoiceId', 'InvoiceDate', 'Total']
+    assert pyarrow.types.is_timestamp(table.schema.field('InvoiceDate').type)
+
+    res = client.get('/track?_export&_format=parquet&_sort=-TrackId')
+    assert res.status_code == 200
+    table = parquet.read_table(io.BytesIO(res.data))
+    assert table.num_rows == 1000
+    assert table.column('TrackId')[0].as_py() > table.column('TrackId')[1].as_py()
+    assert parquet.ParquetFile(io.BytesIO(res.data)).metadata.num_row_groups == 1
+
+    res = client.get('/track?_export&_format=xls')
+    assert res.status_code == 400
+
+    res = client.get('/track?_export&_format=arrow&_related')
+    assert res.status_code == 400
+
+
+def test_serializer(app):
+    with app.app_context():
+        for m in app.extensions['autocrud'].models.values():
+            for uselist in (None, False, True):
+                m.query.session.expunge_all()
+                rows = m.query.limit(10).all()
+                for r in rows:
+                    for rel in inspect(m).relationships:
+                        if rel.uselist is uselist:
+                            getattr(r, rel.key)
+
+                assert all(
+                    json.dumps(r.to_dict(links), default=str) == json.dumps(generic_to_dict(r, links), default=str)
+                    for r in rows for links in (False, True)
+                )
+
+
+@pytest.mark.parametrize('strategy', ['selectin', 'join'])
+def test_core_read_engine(strategy):
+    client = create_app(conf={'AUTOCRUD_RELATED_STRATEGY': strategy}).test_client()
+    core = create_app(conf={'AUTOCRUD_RELATED_STRATEGY': strategy, 'AUTOCRUD_READ_ENGINE': 'core'}).test_client()
+    ndjson = {'Accept': 'application/x-ndjson'}
+
+    for url, headers in (
+        ('/artist', None),
+        ('/artist?_page=3&_limit=7&_sort=-Name', None),
+        ('/artist?_related=Album&_limit=20', None),
+        ('/album?_related&_fields=Title&_no_count', None),
+        ('/album?_related=Artist;Track&_limit=15', ndjson),
+        ('/track?_fields=Name;Milliseconds&AlbumId=1;2;3', ndjson),
+        ('/track?_cursor&_limit=5&_sort=-Milliseconds', None),
+        ('/track?_page=2&_limit=200&_stream', None),
+        ('/album/5/track?_related&_no_count&_stream', None),
+        ('/album?_related=Artist&_as_table', None),
+        ('/album?_export=pippo&_related=Artist&_stream', None),
+        ('/invoice?Total=__lte__10&_sort=Total&_links=template', None),
+        ('/invoice?_no_links&InvoiceDate=(2008-01-01;2013-12-20 00:00:00)', None),
+    ):
+        expected = client.get(url, headers=headers)
+        data = expected.data
+        res = core.get(url, headers=headers)
+        assert res.status_code == expected.status_code, url
+        assert res.data == data, url
+
+    payload = {
+        'fields': ['Title'],
+        'related': {'Artist': ['Name']},
+        'sorting': [{'field': 'Title', 'direction': 'desc'}]
+    }
+    expected = client.fetch('/album', json=payload)
+    res = core.fetch('/album', json=payload)
+    assert res.data == expected.data
+
+    # parents repeated by the join of a filter on related rows
+    payload = {'filters': [{'model': 'Track', 'field': 'Milliseconds', 'op': '>', 'value': 300000}]}
+    expected = client.fetch('/album?_limit=1000', json=payload)
+    res = core.fetch('/album?_limit=1000', json=payload)
+    assert res.data == expected.data
+
+
+def test_related_count():
+    for conf in ({}, {'AUTOCRUD_WINDOW_COUNT_ENABLED': False}):
+        client = create_app(conf=conf).test_client()
+        count = client.get('/artist?_limit=5').headers.get('Pagination-Count')
+        res = client.get('/artist?_limit=5&_related=Album')
+        assert res.headers.get('Pagination-Count') == count
+
+
+def test_related_selectin(monkeypatch):
+    selectin = create_app(conf={'AUTOCRUD_RELATED_STRATEGY': 'selectin'}).test_client()
+    core = create_app(conf={'AUTOCRUD_RELATED_STRATEGY': 'selectin', 'AUTOCRUD_READ_ENGINE': 'core'}).test_client()
+
+    res = selectin.get('/artist?_related=Album&_limit=20')
+    assert res.status_code == 206
+    assert len(res.json['ArtistList']) == 20
+
+    res = selectin.get('/artist?_related=Album:1.Track:2&_fields=Name&_limit=5')
+    assert res.status_code == 206
+    for artist in res.json['ArtistList']:
+        assert set(artist.keys()) == {'AlbumList', 'ArtistId', 'Name', '_links'}
+        assert len(artist['AlbumList']) <= 1
+        for album in artist['AlbumList']:
+            assert 0 < len(album['TrackList']) <= 2
+
+    res = selectin.get('/artist?_related=Album.Track&_limit=1')
+    tracks = res.json['ArtistList'][0]['AlbumList'][0]['TrackList']
+    assert len(tracks) > 2
+    assert [t['TrackId'] for t in tracks] == sorted(t['TrackId'] for t in tracks)
+
+    res = selectin.get('/track/5?_related=Album.Artist')
+    assert res.status_code == 200
+    assert res.json['Album']['Artist']['ArtistId'] == res.json['Album']['ArtistId']
+
+    expected = selectin.get('/artist?_related=Album:2.Track:3&_limit=10').data
+    with monkeypatch.context() as m:
+        m.setattr(dbapi2, 'sqlite_version_info', (3, 24, 0))
+        for c in (selectin, core):
+            assert c.get('/artist?_related=Album:2.Track:3&_limit=10').data == expected
+
+    res = selectin.get('/artist?_related=Album:0')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['Album:0']
+
+    res = selectin.get('/artist?_related=Nope')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['Nope']
+
+    for url in (
+        '/artist?_related=Album:2.Track:3&_limit=10',
+        '/album?_related=Artist;Track&_limit=15&_links=template',
+        '/album?_export=pippo&_related=Artist&_stream',
+    ):
+        expected = selectin.get(url)
+        data = expected.data
+        res = core.get(url)
+        assert res.status_code == expected.status_code, url
+        assert res.data == data, url
+
+
+def test_bulk_joined(tmp_path):
+    path = tmp_path / 'db.sqlite3'
+    shutil.copyfile('tests/db.sqlite3', str(path))
+    app = create_app(conf={'SQLALCHEMY_DATABASE_URI': 'sqlite+pysqlite:///{}'.format(path)})
+    models = app.extensions['autocrud'].models
+    track, album = models['Track'], models['Album']
+
+    with app.app_context():
+        def query():
+            return track.query.join(album).filter(album.Title == 'Let There Be Rock')
+
+        assert update_many(query(), track, {'Composer': 'pippo'}) == 8
+        assert track.query.filter_by(Composer='pippo').count() == 8
+        assert delete_many(query(), track) == 8
+        assert query().count() == 0
+
+
+def test_search(tmp_path):
+    # the index and the updated track must not be left into the shared database
+    path = tmp_path / 'db.sqlite3'
+    shutil.copyfile('tests/db.sqlite3', str(path))
+    app = create_app(conf={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite+pysqlite:///{}'.format(path),
+        'AUTOCRUD_CONDITIONAL_REQUEST_ENABLED': False
+    })
+    client = app.test_client()
+
+    res = client.get('/track?_search=love you&_limit=5')
+    assert res.status_code == 206
+    like = [t['TrackId'] for t in res.json['TrackList']]
+    for t in res.json['TrackList']:
+        text = ' '.join(str(v) for v in t.values()).lower()
+        assert 'love' in text and 'you' in text
+
+    res = client.get('/track?_search=!!')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['_search']
+
+    runner = app.test_cli_runner()
+    res = runner.invoke(args=['autocrud-search-index', 'Track'])
+    assert res.exit_code == 0
+    assert 'built fts5 index of Track' in res.output
+    try:
+        res = client.get('/track?_search=love you&_limit=5')
+        assert res.status_code == 206
+        ranked = [t['TrackId'] for t in res.json['TrackList']]
+        assert ranked != like
+        assert int(res.headers.get('Pagination-Count')) > 5
+
+        res = client.get('/track?_search=love you&_limit=5&_page=2')
+        assert not set(ranked) & {t['TrackId'] for t in res.json['TrackList']}
+
+        res = client.get('/track?_search=love&_limit=5&_cursor')
+        ids = [t['TrackId'] for t in res.json['TrackList']]
+        assert ids == sorted(ids)
+
+        res = client.patch('/track/1', json={'Name': 'Zzqqxx'})
+        assert res.status_code == 200
+        res = client.get('/track?_search=zzqqxx')
+        assert [t['TrackId'] for t in res.json['TrackList']] == [1]
+    finally:
+        res = runner.invoke(args=['autocrud-search-index', '--drop'])
+        assert res.output == 'dropped fts5 index of Track\n'
+
+    res = client.get('/track?_search=zzqqxx')
+    assert [t['TrackId'] for t in res.json['TrackList']] == [1]
+
+    # index dropped by another process
+    runner.invoke(args=['autocrud-search-index', 'Track'])
+    assert client.get('/track?_search=zzqqxx').status_code == 200
+    conn = sqlite3.connect(str(path))
+    conn.execute('DROP TABLE Track_fts')
+    conn.close()
+    res = client.get('/track?_search=zzqqxx')
+    assert [t['TrackId'] for t in res.json['TrackList']] == [1]
+
+
+def test_aggregate(client):
+    res = client.get(
+        '/invoice?_group=BillingCountry&_agg=count(*);sum(Total);max(InvoiceDate)&_sort=-sum(Total)&_limit=3'
+    )
+    assert res.status_code == 206
+    assert res.headers.get('Pagination-Count') == '24'
+    rows = res.json['InvoiceList']
+    assert len(rows) == 3
+    assert set(rows[0].keys()) == {'BillingCountry', 'count(*)', 'sum(Total)', 'max(InvoiceDate)'}
+    assert rows[0]['sum(Total)'] >= rows[1]['sum(Total)'] >= rows[2]['sum(Total)']
+
+    usa = client.get('/invoice?_agg=count(*);sum(Total)&BillingCountry=USA')
+    assert usa.status_code == 200
+    assert usa.json['InvoiceList'] == [{'count(*)': rows[0]['count(*)'], 'sum(Total)': rows[0]['sum(Total)']}]
+
+    res = client.get('/invoice?_group=BillingCountry&_agg=sum(Total)&sum(Total)=__gt__100')
+    assert res.status_code == 200
+    countries = [r['BillingCountry'] for r in res.json['InvoiceList']]
+    assert countries == sorted(countries)
+    assert all(r['sum(Total)'] > 100 for r in res.json['InvoiceList'])
+
+    res = client.get('/invoice?_group=BillingCountry&_limit=5&_page=5')
+    assert res.status_code == 200
+    assert len(res.json['InvoiceList']) == 4
+    assert all(set(r.keys()) == {'BillingCountry', 'count(*)'} for r in res.json['InvoiceList'])
+
+    res = client.get('/invoice?_group=Nope&_agg=sum(BillingCountry);count(Total)&_sort=Total')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['Nope', 'sum(BillingCountry)', 'count(Total)', 'Total']
+
+    res = client.get('/invoice?_agg=')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['_agg']
+
+    res = client.get('/invoice?_group=BillingCountry&_cursor&_fields=Total&_related=Customer')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['_fields', '_related', '_cursor']
+
+
+def test_distinct(client):
+    res = client.get('/invoice/_distinct/BillingCountry;BillingCity?_limit=3')
+    assert res.status_code == 200
+    assert set(res.json.keys()) == {'BillingCountry', 'BillingCity'}
+    countries = res.json['BillingCountry']
+    assert len(countries) == 3
+    assert countries[0] == {'value': 'USA', 'count': 91}
+    assert [c['count'] for c in countries] == sorted((c['count'] for c in countries), reverse=True)
+
+    etag = res.headers.get('ETag')
+    res = client.get('/invoice/_distinct/BillingCountry;BillingCity?_limit=3', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    res = client.get('/invoice/_distinct/BillingCountry?_prefix=u&Total=__gt__10')
+    assert res.status_code == 200
+    assert {c['value'] for c in res.json['BillingCountry']} == {'USA', 'United Kingdom'}
+
+    res = client.get('/track/_distinct/GenreId?_prefix=1&_limit=5')
+    assert all(str(c['value']).startswith('1') for c in res.json['GenreId'])
+
+    res = client.get('/invoice/_distinct/Nope;BillingCountry')
+    assert res.status_code == 400
+    assert res.json['response']['invalid'] == ['Nope']
+
+
+def test_index_advisor():
+    app = create_app(conf={'AUTOCRUD_INDEX_ADVISOR_ENABLED': True})
+    client = app.test_client()
+    assert client.get('/_admin/index-advice').json == {'advice': []}
+
+    for _ in range(3):
+        assert client.get('/invoice?BillingCountry=USA&_sort=-InvoiceDate').status_code == 200
+    assert client.get('/track?AlbumId=1&_sort=Name').status_code == 200
+    assert client.get('/track?AlbumId=2').status_code == 200
+    assert client.get('/track?TrackId=1').status_code == 200
+
+    res = client.get('/_admin/index-advice')
+    assert res.status_code == 200
+    advice = res.json['advice']
+    assert sorted((a['table'], a['columns'], a['calls']) for a in advice) == [
+        ('Invoice', ['BillingCountry', 'InvoiceDate'], 3),
+        ('Track', ['AlbumId', 'Name'], 1),
+    ]
+    advice = {a['table']: a for a in advice}
+    assert advice['Invoice']['patterns'] == [dict(equality=['BillingCountry'], ranges=[], sorting=['InvoiceDate'])]
+    assert advice['Invoice']['max_ms'] <= advice['Invoice']['total_ms']
+
+    res = client.get('/track?Composer=AC/DC&_stream')
+    assert sorted(a['table'] for a in client.get('/_admin/index-advice').json['advice']) == ['Invoice', 'Track']
+    assert len(b''.join(res.response)) > 0
+    res.close()
+    assert [a['table'] for a in client.get('/_admin/index-advice').json['advice']].count('Track') == 2
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_auto_index():
+    app = create_app(conf={
+        'AUTOCRUD_INDEX_ADVISOR_ENABLED': True,
+        'AUTOCRUD_AUTO_INDEX': True,
+        'AUTOCRUD_AUTO_INDEX_THRESHOLD': 2
+    })
+    client = app.test_client()
+    with app.app_context():
+        engine = app.extensions['autocrud']._db.engine
+    try:
+        for _ in range(2):
+            assert client.get('/customer?Country=Brazil&_sort=City').status_code == 200
+
+        wait_for(lambda: 'ix_autocrud_customer_country_city' in [
+            i['name'] for i in inspect(engine).get_indexes('Customer')
+        ])
+        assert client.get('/_admin/index-advice').json == {'advice': []}
+    finally:
+        with app.app_context():
+            engine.execute('DROP INDEX IF EXISTS ix_autocrud_customer_country_city')
+
+
+def test_auto_index_error(monkeypatch):
+    def create(self, bind=None):
+        calls.append(self.name)
+        raise OperationalError('CREATE INDEX', {}, Exception('database is locked'))
+
+    calls = []
+    monkeypatch.setattr(Index, 'create', create)
+    app = create_app(conf={
+        'AUTOCRUD_INDEX_ADVISOR_ENABLED': True,
+        'AUTOCRUD_INDEX_ADVISOR_URL': None,
+        'AUTOCRUD_AUTO_INDEX': True,
+        'AUTOCRUD_AUTO_INDEX_THRESHOLD': 2
+    })
+    client = app.test_client()
+    for _ in range(3):
+        assert client.get('/customer?Country=Brazil&_sort=City').status_code == 200
+    wait_for(lambda: calls)
+
+    assert calls == ['ix_autocrud_customer_country_city']
+    assert client.get('/_admin/index-advice').status_code == 404
@@ -1,6 +1,15 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
 import pytest
 
+from flask_autocrud.cache import MemoryCache, SQLiteCache
 from . import create_app
+from .models import db
 
 
 @pytest.fixture
@@ -75,3 +84,257 @@ def test_export_disabled(client):
     res = client.get('/artist?_export=pippo')
     assert res.status_code == 200
     assert res.headers.get('Content-Type') == 'application/json'
+
+
+def test_count_policy():
+    with pytest.raises(ValueError):
+        create_app(conf={'AUTOCRUD_COUNT_POLICY': 'invalid'})
+
+    client = create_app(conf={'AUTOCRUD_COUNT_POLICY': 'cached'}).test_client()
+    res = client.get('/genre?_limit=5')
+    count = int(res.headers.get('Pagination-Count'))
+
+    res = client.post('/genre', json={'Name': 'count policy'})
+    assert res.status_code == 201
+    id = res.get_json().get('GenreId')
+
+    res = client.get('/genre?_limit=5')
+    assert int(res.headers.get('Pagination-Count')) == count + 1
+
+    res = client.get('/genre/{}'.format(id))
+    res = client.delete('/genre/{}'.format(id), headers={'If-Match': res.headers.get('ETag')})
+    assert res.status_code == 204
+
+    client = create_app(conf={'AUTOCRUD_COUNT_POLICY': 'estimated'}).test_client()
+    res = client.get('/genre?_limit=5')
+    assert int(res.headers.get('Pagination-Count')) == count
+
+    client = create_app(conf={'AUTOCRUD_COUNT_POLICY': 'none'}).test_client()
+    res = client.get('/genre?_limit=5')
+    assert res.status_code == 206
+    assert res.headers.get('Pagination-Count') is None
+
+
+def test_estimated_count(tmp_path):
+    path = tmp_path / 'db.sqlite3'
+    shutil.copyfile('tests/db.sqlite3', str(path))
+    conn = sqlite3.connect(str(path))
+    conn.execute('ANALYZE')
+    conn.execute("UPDATE sqlite_stat1 SET stat = '1000' WHERE tbl = 'Genre'")
+    conn.commit()
+
+    client = create_app(conf={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite+pysqlite:///{}'.format(path),
+        'AUTOCRUD_COUNT_POLICY': 'estimated'
+    }).test_client()
+    res = client.get('/genre?_limit=5')
+    assert res.headers.get('Pagination-Count') == '1000'
+
+    res = client.get('/genre?_limit=5&GenreId=1')
+    assert res.headers.get('Pagination-Count') == '1'
+
+    conn.execute('DELETE FROM sqlite_stat1')
+    conn.commit()
+    conn.close()
+
+    res = client.get('/genre?_limit=5')
+    assert int(res.headers.get('Pagination-Count')) < 1000
+
+
+def test_shared_cache_key(tmp_path):
+    code = (
+        "from flask_autocrud.cache import SQLiteCache\n"
+        "from flask_autocrud.pagination import CountCache\n"
+        "from tests.models import albums\n"
+        "key = CountCache.key(albums, dict(related={'artists': ['*'], 'tracks': ['*']}, filters=[\n"
+        "    dict(model='genres', field='name', op='in', value=['Rock'])\n"
+        "]))\n"
+        "print(SQLiteCache(%r, 'secret')._hash(('count', *key)))\n"
+    ) % str(tmp_path / 'cache.sqlite3')
+
+    digests = set()
+    for seed in ('1', '2', '3'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        digests.add(subprocess.check_output([sys.executable, '-c', code], env=env))
+    assert len(digests) == 1
+
+
+def test_window_count():
+    windowed = create_app().test_client()
+    res = windowed.get('/track?_page=2&_limit=50')
+    assert res.status_code == 206
+
+    client = create_app(conf={'AUTOCRUD_WINDOW_COUNT_ENABLED': False}).test_client()
+    expected = client.get('/track?_page=2&_limit=50')
+    assert all(res.headers.get(h) == expected.headers.get(h) for h in (
+        'Pagination-Count',
+        'Pagination-Num-Pages',
+        'Pagination-Page',
+        'Pagination-Page-Size',
+        'Link'
+    ))
+    assert res.get_json() == expected.get_json()
+
+    res = windowed.get('/track?_page=1000&_limit=50')
+    assert res.status_code == 204
+
+
+def test_response_cache():
+    app = create_app(conf={'AUTOCRUD_CACHE_ENABLED': True})
+    client = app.test_client()
+    cache = app.extensions['autocrud'].cache
+
+    res = client.get('/genre?_limit=5')
+    etag = res.headers.get('ETag')
+    count = res.headers.get('Pagination-Count')
+    assert len(cache) == 1
+
+    with app.app_context():
+        db.session.execute("INSERT INTO Genre (Name) VALUES ('not through service')")
+        db.session.commit()
+
+    res = client.get('/genre?_limit=5')
+    assert res.headers.get('ETag') == etag
+    assert res.headers.get('Pagination-Count') == count
+
+    res = client.get('/genre?_limit=5', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    res = client.post('/genre', json={'Name': 'response cache'})
+    assert res.status_code == 201
+
+    res = client.get('/genre?_limit=5')
+    assert int(res.headers.get('Pagination-Count')) == int(count) + 2
+
+    with app.app_context():
+        db.session.execute("DELETE FROM Genre WHERE Name IN ('not through service', 'response cache')")
+        db.session.commit()
+
+
+def test_response_cache_tags(tmp_path):
+    path = tmp_path / 'db.sqlite3'
+    shutil.copyfile('tests/db.sqlite3', str(path))
+    app = create_app(conf={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite+pysqlite:///{}'.format(path),
+        'AUTOCRUD_CACHE_ENABLED': True,
+        'AUTOCRUD_RELATED_STRATEGY': 'selectin',
+    })
+    client = app.test_client()
+
+    def names(r):
+        return [t['Name'] for a in r.get_json()['ArtistList'] for b in a['AlbumList'] for t in b.get('TrackList', [])]
+
+    url = '/artist?ArtistId=1&_related=Album.Track'
+    assert 'Go Down' in names(client.get(url))
+
+    res = client.get('/track/15')
+    res = client.patch('/track/15', json={'Name': 'Gone Down'}, headers={'If-Match': res.headers.get('ETag')})
+    assert res.status_code == 200
+    assert 'Gone Down' in names(client.get(url))
+
+    cache = app.extensions['autocrud'].cache
+    assert [tags for _, _, tags in cache._data.values()] == [{'Artist', 'Album', 'Track'}]
+
+    cache.clear()
+    client.get('/artist/1', headers={'Authorization': 'Bearer one'})
+    client.get('/artist/1', headers={'Authorization': 'Bearer two'})
+    assert len(cache) == 2
+
+
+def test_response_cache_stale():
+    app = create_app(conf={
+        'AUTOCRUD_CACHE_ENABLED': True,
+        'AUTOCRUD_CACHE_TTL': 0,
+        'AUTOCRUD_CACHE_STALE_TTL': 60,
+    })
+    client = app.test_client()
+
+    res = client.get('/artist/1')
+    assert res.status_code == 200
+
+    res = client.get('/artist/1')
+    assert res.status_code == 200
+    assert res.get_json().get('ArtistId') == 1
+
+    # a conditional request served from a stale entry still refreshes it
+    etag = res.headers.get('ETag')
+    cache = app.extensions['autocrud'].cache
+    while cache._refreshing:
+        time.sleep(0.01)
+    expires = {k: v[1] for k, v in cache._data.items()}
+
+    res = client.get('/artist/1', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    for _ in range(100):
+        if any(cache._data[k][1] > e for k, e in expires.items() if k in cache._data):
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail('stale entry not refreshed')
+
+
+def test_shared_cache(tmp_path):
+    conf = {
+        'AUTOCRUD_CACHE_ENABLED': True,
+        'AUTOCRUD_CACHE_BACKEND': 'sqlite',
+        'AUTOCRUD_CACHE_PATH': str(tmp_path / 'cache.sqlite3'),
+        'SECRET_KEY': 'secret',
+    }
+    worker1 = create_app(conf=conf)
+    worker2 = create_app(conf=conf)
+    assert isinstance(worker1.extensions['autocrud'].cache, SQLiteCache)
+
+    count = worker1.test_client().get('/genre?_limit=5').headers.get('Pagination-Count')
+    assert len(worker2.extensions['autocrud'].cache) == 1
+
+    with worker1.app_context():
+        db.session.execute("INSERT INTO Genre (Name) VALUES ('shared cache')")
+        db.session.commit()
+
+    res = worker2.test_client().get('/genre?_limit=5')
+    assert res.headers.get('Pagination-Count') == count
+
+    res = worker2.test_client().patch('/genre/1', json={}, headers={
+        'If-Match': worker2.test_client().get('/genre/1').headers.get('ETag')
+    })
+    assert res.status_code == 200
+
+    res = worker1.test_client().get('/genre?_limit=5')
+    assert int(res.headers.get('Pagination-Count')) == int(count) + 1
+
+    with worker1.app_context():
+        db.session.execute("DELETE FROM Genre WHERE Name = 'shared cache'")
+        db.session.commit()
+
+    # other apps or other secrets do not read entries
+    other = create_app(conf={**conf, 'AUTOCRUD_BASE_URL': '/api'})
+    assert len(other.extensions['autocrud'].cache) == 0
+    cache = worker1.extensions['autocrud'].cache
+    key = ('k',)
+    cache.set(key, 'value', tags=('Genre',))
+    assert cache.get(key) == 'value'
+    forged = SQLiteCache(conf['AUTOCRUD_CACHE_PATH'], 'other', namespace=cache._namespace)
+    assert forged.get(key) is None
+    assert os.stat(conf['AUTOCRUD_CACHE_PATH']).st_mode & 0o077 == 0
+
+    for missing in ('AUTOCRUD_CACHE_PATH', 'SECRET_KEY'):
+        with pytest.raises(ValueError):
+            create_app(conf={**conf, missing: None})
+
+    with pytest.raises(ValueError):
+        create_app(conf={'AUTOCRUD_CACHE_ENABLED': True, 'AUTOCRUD_CACHE_BACKEND': 'invalid'})
+
+    app = create_app(conf={'AUTOCRUD_CACHE_ENABLED': True, 'AUTOCRUD_CACHE_BACKEND': MemoryCache})
+    assert isinstance(app.extensions['autocrud'].cache, MemoryCache)
+
+
+def test_batch_config():
+    assert create_app().test_client().post('/batch', json=[]).status_code == 404
+
+    with pytest.raises(ValueError):
+        create_app(conf={'AUTOCRUD_BATCH_ENABLED': True, 'AUTOCRUD_BATCH_URL': '/artist/'})
+
+    client = create_app(conf={'AUTOCRUD_BATCH_ENABLED': True}).test_client()
+    res = client.post('/batch', json=[{'method': 'GET', 'url': '/artist/1'}])
+    assert res.status_code == 200
@@ -1,7 +1,14 @@
+from datetime import datetime, timedelta
+from sqlite3 import dbapi2
+
+import flask
 import pytest
+from sqlalchemy import event
+from werkzeug.http import http_date
 
+from flask_autocrud.cache import MemoryCache
 from . import create_app
-from .models import albums, artists
+from .models import albums, artists, db, versioned
 
 
 @pytest.fixture
@@ -93,6 +100,27 @@ def test_hateoas(client):
     assert data['_links'].get('self') == '/artists/1'
 
 
+def test_link_templates(client):
+    res = client.get('/myalbum?_related=artists&_links=template&_limit=5')
+    assert res.status_code == 206
+
+    data = res.get_json()
+    assert all('_links' not in r and '_links' not in r['artists'] for r in data['albumsList'])
+    assert data['_meta']['links'] == {
+        'albums': {'self': '/myalbum/{id}', 'artists': '/myalbum/{id}/artists'},
+        'artists': {'self': '/artists/{id}', 'albums': '/artists/{id}/myalbum'},
+    }
+    assert data['_meta']['next'] is not None
+
+    res = client.get('/artists?_links=template&_stream&_limit=5')
+    data = res.get_json()
+    assert '_links' not in data['artistsList'][0]
+    assert data['_meta']['links']['artists']['self'] == '/artists/{id}'
+
+    res = client.get('/artists?_links=template&_no_links')
+    assert '_meta' not in res.get_json()
+
+
 def test_extended(client):
     res = client.get('/myalbum/5?_related')
     assert res.status_code == 200
@@ -226,3 +254,341 @@ def test_hidden_field(client):
 
     data = res.get_json()
     assert len(data['fields']) == 2
+
+
+def test_bulk_create(client):
+    res = client.post('/artists', json=[{'name': 'bulk1'}, {'name': 'bulk2'}, {'nome': 'bulk3'}, 1])
+    assert res.status_code == 207
+
+    data = res.get_json()['artistsList']
+    assert [i['status'] for i in data] == [201, 201, 422, 400]
+    assert data[0]['resource']['name'] == 'bulk1'
+    assert data[2]['unknown'] == ['nome']
+    assert data[2]['missing'] == ['name']
+
+    res = client.get('/artists?name=bulk1;bulk2&_sort=name')
+    assert res.status_code == 200
+    ids = [i['id'] for i in res.get_json()['artistsList']]
+    assert len(ids) == 2
+    assert [i['resource']['id'] for i in data[:2]] == ids
+    assert [i['resource']['_links']['self'] for i in data[:2]] == ['/artists/{}'.format(i) for i in ids]
+
+    res = client.post('/artists', json=[{'nome': 'bulk5'}])
+    assert res.status_code == 422
+
+    for i in ids:
+        assert client.delete('/artists/{}'.format(i)).status_code == 204
+
+
+def test_bulk_max_size():
+    client = create_app(m=[artists], conf={'AUTOCRUD_BULK_MAX_SIZE': 2}).test_client()
+    res = client.post('/artists', json=[{'name': 'bulk1'}, {'name': 'bulk2'}, {'name': 'bulk3'}])
+    assert res.status_code == 413
+
+
+@pytest.fixture
+def versioned_client():
+    app = create_app(m=[versioned], conf={'AUTOCRUD_BATCH_ENABLED': True})
+    with app.app_context():
+        versioned.__table__.drop(db.engine, checkfirst=True)
+        versioned.__table__.create(db.engine)
+
+    yield app.test_client()
+
+    with app.app_context():
+        db.session.remove()
+        versioned.__table__.drop(db.engine)
+
+
+def test_version_etag(versioned_client):
+    client = versioned_client
+    res = client.post('/versioned', json={'name': 'pippo'})
+    assert res.status_code == 201
+    etag = res.headers.get('ETag')
+    assert etag is not None
+    assert res.headers.get('Last-Modified') is not None
+
+    id = res.get_json().get('id')
+    assert res.get_json().get('version') == 1
+
+    res = client.get('/versioned/{}'.format(id))
+    assert res.status_code == 200
+    assert res.headers.get('ETag') == etag
+
+    res = client.get('/versioned/{}'.format(id), headers={'If-None-Match': etag})
+    assert res.status_code == 304
+
+    since = datetime.utcnow() + timedelta(minutes=1)
+    res = client.get('/versioned/{}'.format(id), headers={'If-Modified-Since': http_date(since)})
+    assert res.status_code == 304
+
+    res = client.get('/versioned/{}'.format(id), headers={'If-Modified-Since': http_date(0)})
+    assert res.status_code == 200
+
+    res = client.get('/versioned')
+    assert res.status_code == 200
+    list_etag = res.headers.get('ETag')
+    assert list_etag is not None
+
+    res = client.get('/versioned', headers={'If-None-Match': list_etag})
+    assert res.status_code == 304
+
+    res = client.get('/versioned?_stream')
+    assert res.status_code == 200
+    assert res.headers.get('ETag') is not None
+    assert res.get_json()['versionedList'][0]['id'] == id
+
+    res = client.get('/versioned?_stream', headers={'If-None-Match': res.headers.get('ETag')})
+    assert res.status_code == 304
+
+    res = client.patch('/versioned/{}'.format(id), json={'name': 'pluto'}, headers={'If-Match': etag})
+    assert res.status_code == 200
+    assert res.get_json().get('version') == 2
+    assert res.headers.get('ETag') != etag
+
+    res = client.patch('/versioned/{}'.format(id), json={'name': 'paperino'}, headers={'If-Match': etag})
+    assert res.status_code == 412
+
+    res = client.get('/versioned', headers={'If-None-Match': list_etag})
+    assert res.status_code == 200
+    assert res.headers.get('ETag') != list_etag
+
+    res = client.get('/versioned/404')
+    assert res.status_code == 404
+
+
+def test_version_list_etag(versioned_client, monkeypatch):
+    client = versioned_client
+    monkeypatch.setattr(versioned, '__updated_field__', None)
+    assert client.post('/versioned', json=[{'name': 'pippo'}, {'name': 'pluto'}]).status_code == 201
+
+    res = client.get('/versioned')
+    list_etag = res.headers.get('ETag')
+    assert list_etag is not None
+    assert client.get('/versioned', headers={'If-None-Match': list_etag}).status_code == 304
+
+    # same count and same sum of versions
+    with client.application.app_context():
+        db.session.execute("DELETE FROM Versioned WHERE Name = 'pippo'")
+        db.session.execute(
+            "INSERT INTO Versioned (Name, Version, UpdatedAt) VALUES ('paperino', 1, '2020-01-01 00:00:00')"
+        )
+        db.session.commit()
+
+    res = client.get('/versioned', headers={'If-None-Match': list_etag})
+    assert res.status_code == 200
+    assert {i['name'] for i in res.get_json()['versionedList']} == {'pluto', 'paperino'}
+
+
+def test_bulk_create_versioned(versioned_client):
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT'):
+            inserts.append(executemany)
+
+    inserts = []
+    client = versioned_client
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        res = client.post('/versioned', json=[{'name': 'pippo'}, {'name': 'pluto'}])
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert res.status_code == 201
+    assert inserts == [True]
+    created = [i['resource'] for i in res.get_json()['versionedList']]
+
+    res = client.get('/versioned?_sort=name')
+    data = res.get_json()['versionedList']
+    assert [(i['name'], i['version']) for i in data] == [('pippo', 1), ('pluto', 1)]
+    assert all(i['updated_at'] is not None for i in data)
+    assert [{k: v for k, v in i.items() if k != '_links'} for i in created] == \
+        [{k: v for k, v in i.items() if k != '_links'} for i in data]
+
+    res = client.post('/versioned', json=[{'name': 'paperino'}, {'name': 'pippo'}])
+    assert res.status_code == 409
+
+    res = client.get('/versioned?name=paperino')
+    assert len(res.get_json()['versionedList']) == 0
+
+
+def test_upsert(versioned_client, monkeypatch):
+    client = versioned_client
+    headers = {'Prefer': 'resolution=merge-duplicates'}
+    res = client.post('/versioned', json={'name': 'pippo'}, headers=headers)
+    assert res.status_code == 201
+    assert res.headers.get('Preference-Applied') == 'resolution=merge-duplicates'
+    data = res.get_json()
+    assert data['version'] == 1
+
+    res = client.post('/versioned', json={'id': data['id'], 'name': 'pluto'}, headers=headers)
+    assert res.status_code == 200
+    assert res.headers.get('Location').endswith('/versioned/{}'.format(data['id']))
+    assert res.get_json()['name'] == 'pluto'
+    assert res.get_json()['version'] == 2
+
+    res = client.post('/versioned', json={'name': 'pluto'}, headers=headers)
+    assert res.status_code == 200
+    assert res.get_json()['id'] == data['id']
+    assert res.get_json()['version'] == 3
+
+    res = client.post('/versioned', json={'name': 'paperino'}, headers=headers)
+    assert res.status_code == 201
+    assert res.get_json()['id'] != data['id']
+
+    monkeypatch.setattr(dbapi2, 'sqlite_version_info', (3, 23, 0))
+    res = client.post('/versioned', json={'name': 'pluto'}, headers=headers)
+    assert res.status_code == 501
+
+    res = client.post('/versioned', json={'nome': 'pluto'}, headers=headers)
+    assert res.status_code == 422
+
+
+def test_optimistic_insert():
+    app = create_app(m=[versioned], conf={'AUTOCRUD_OPTIMISTIC_INSERT': True})
+    with app.app_context():
+        versioned.__table__.drop(db.engine, checkfirst=True)
+        versioned.__table__.create(db.engine)
+
+    client = app.test_client()
+    res = client.post('/versioned', json={'name': 'pippo'})
+    assert res.status_code == 201
+
+    res = client.post('/versioned', json={'name': 'pippo'})
+    assert res.status_code == 409
+
+    with app.app_context():
+        db.session.remove()
+        versioned.__table__.drop(db.engine)
+
+
+def test_bulk_update_delete(versioned_client):
+    client = versioned_client
+    res = client.post('/versioned', json=[{'name': 'pippo'}, {'name': 'pluto'}, {'name': 'paperino'}])
+    assert res.status_code == 201
+
+    res = client.patch('/versioned', json={'name': 'topolino'})
+    assert res.status_code == 400
+
+    res = client.patch('/versioned?nome=pippo', json={'name': 'topolino'})
+    assert res.status_code == 400
+
+    res = client.patch('/versioned?name=pippo', json={'nome': 'topolino'})
+    assert res.status_code == 422
+
+    res = client.patch('/versioned?name=pippo', json={'name': 'topolino'})
+    assert res.status_code == 200
+    assert res.get_json()['affected'] == 1
+
+    res = client.get('/versioned?name=topolino')
+    data = res.get_json()['versionedList']
+    assert len(data) == 1
+    assert data[0]['version'] == 2
+
+    res = client.patch('/versioned?name=pluto;paperino', json={'name': 'topolino'})
+    assert res.status_code == 409
+
+    res = client.delete('/versioned')
+    assert res.status_code == 400
+
+    res = client.delete('/versioned?name=!null')
+    assert res.status_code == 200
+    assert res.get_json()['affected'] == 3
+
+    res = client.get('/versioned')
+    assert len(res.get_json()['versionedList']) == 0
+
+
+def test_bulk_max_rows():
+    client = create_app(m=[artists], conf={'AUTOCRUD_BULK_MAX_ROWS': 2}).test_client()
+    res = client.delete('/artists?id=(1;3)')
+    assert res.status_code == 400
+    assert res.get_json()['response']['affected'] == 3
+
+    res = client.get('/artists?id=(1;3)')
+    assert len(res.get_json()['artistsList']) == 3
+
+
+def test_version_cache_modified(versioned_client):
+    client = create_app(m=[versioned], conf={'AUTOCRUD_CACHE_ENABLED': True}).test_client()
+    res = client.post('/versioned', json={'name': 'pippo'})
+    url = '/versioned/{}'.format(res.get_json().get('id'))
+
+    res = client.get(url)
+    modified = res.headers.get('Last-Modified')
+    assert modified is not None
+
+    res = client.get(url, headers={'If-Modified-Since': modified})
+    assert res.status_code == 304
+
+    res = client.get(url, headers={'If-Modified-Since': http_date(datetime(2000, 1, 1))})
+    assert res.status_code == 200
+
+
+def test_batch(versioned_client):
+    client = versioned_client
+    res = client.post('/batch', json=[
+        {'method': 'POST', 'url': '/versioned', 'body': {'name': 'pippo'}},
+        {'method': 'POST', 'url': '/versioned', 'body': {'name': 'pippo'}},
+        {'method': 'GET', 'url': '/versioned?name=pippo'},
+        {'method': 'PATCH', 'url': '/versioned?name=pippo', 'body': {'name': 'pluto'}},
+        {'method': 'GET', 'url': '/resources'},
+        {'url': 'versioned'},
+    ])
+    assert res.status_code == 200
+
+    data = res.get_json()
+    assert [i['status'] for i in data] == [201, 409, 200, 200, 404, 400]
+    assert data[0]['headers']['Location'].endswith('/versioned/{}'.format(data[0]['body']['id']))
+    assert data[2]['body']['versionedList'][0]['name'] == 'pippo'
+    assert data[3]['body']['affected'] == 1
+
+    res = client.get('/versioned')
+    assert [i['name'] for i in res.get_json()['versionedList']] == ['pluto']
+
+    res = client.post('/batch', json={'atomic': True, 'requests': [
+        {'method': 'POST', 'url': '/versioned', 'body': {'name': 'paperino'}},
+        {'method': 'POST', 'url': '/versioned', 'body': {'name': 'pluto'}},
+        {'method': 'GET', 'url': '/versioned'},
+    ]})
+    assert res.status_code == 409
+    assert [i['status'] for i in res.get_json()] == [201, 409]
+
+    res = client.get('/versioned')
+    assert [i['name'] for i in res.get_json()['versionedList']] == ['pluto']
+
+    res = client.post('/batch', json={'requests': []})
+    assert res.status_code == 400
+
+
+def test_batch_request_context():
+    class Cache(MemoryCache):
+        def invalidate(self, tag):
+            invalidated.append((tag, flask.g.get('autocrud_batch')))
+            super().invalidate(tag)
+
+    invalidated = []
+    app = create_app(m=[artists], conf={
+        'AUTOCRUD_CACHE_ENABLED': True,
+        'AUTOCRUD_CACHE_BACKEND': Cache(),
+        'AUTOCRUD_BATCH_ENABLED': True
+    })
+
+    @app.before_request
+    def auth():
+        if flask.request.headers.get('Authorization') != 'Bearer token':
+            flask.abort(401)
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer token'}
+    res = client.post('/batch', headers=headers, json=[
+        {'method': 'POST', 'url': '/artists', 'body': {'name': 'batch'}},
+        {'method': 'GET', 'url': '/artists/1', 'headers': {'Authorization': 'Bearer other'}},
+    ])
+    assert res.status_code == 200
+    assert [i['status'] for i in res.get_json()] == [201, 401]
+    assert invalidated == [('artists', None)]
+
+    with app.app_context():
+        db.session.query(artists).filter_by(name='batch').delete()
+        db.session.commit()
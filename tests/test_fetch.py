@@ -241,3 +241,37 @@ def test_validators(client):
         "pluto",
         "paperino"
     ))
+
+
+def test_search(client):
+    res = client.fetch('/artist', json={'search': 'black', 'fields': ['Name']})
+    assert res.status_code == 200
+
+    data = res.get_json()
+    assert len(data['ArtistList']) > 0
+    for a in data['ArtistList']:
+        assert 'black' in a['Name'].lower()
+
+    res = client.fetch('/artist', json={'search': 1})
+    assert res.status_code == 422
+
+
+def test_aggregate(client):
+    res = client.fetch('/invoice', json={
+        'filters': [{'model': 'Invoice', 'field': 'Total', 'op': '>', 'value': 5}],
+        'sorting': [{'model': 'Invoice', 'field': 'sum(Total)', 'direction': 'desc'}],
+        'aggregate': {
+            'group': ['BillingCountry'],
+            'functions': ['count(*)', 'sum(Total)'],
+            'having': [{'field': 'count(*)', 'op': '>=', 'value': 10}]
+        }
+    })
+    assert res.status_code == 200
+
+    rows = res.get_json()['InvoiceList']
+    assert len(rows) > 0
+    assert all(r['count(*)'] >= 10 for r in rows)
+    assert [r['sum(Total)'] for r in rows] == sorted((r['sum(Total)'] for r in rows), reverse=True)
+
+    res = client.fetch('/invoice', json={'aggregate': {'having': [{'field': 'count(*)'}]}})
+    assert res.status_code == 422
@@ -1,3 +1,6 @@
+import base64
+import json
+
 import pytest
 
 from . import assert_pagination, create_app
@@ -26,6 +29,93 @@ def test_pagination(client):
     assert res.headers.get('Links') is None
 
 
+def test_no_count(client):
+    res = client.get('/artist?_page=1&_limit=5&_no_count')
+    assert res.status_code == 206
+    assert res.headers.get('Pagination-Count') is None
+    assert res.headers.get('Pagination-Num-Pages') is None
+    assert res.headers.get('Pagination-Page') == '1'
+
+    data = res.get_json()
+    assert len(data['ArtistList']) == 5
+    assert data['_meta']['next'] == '/artist?_page=2&_limit=5'
+    assert data['_meta']['last'] is None
+
+    res = client.get('/artist?_page=100&_limit=100&_no_count')
+    assert res.status_code == 204
+
+
+def test_cursor_pagination(client):
+    res = client.get('/artist?_cursor&_limit=5&_sort=-Name')
+    assert res.status_code == 206
+    assert res.headers.get('Pagination-Page-Size') == '5'
+    assert 'rel=next' in res.headers.get('Link')
+
+    data = res.get_json()
+    first_page = data['ArtistList']
+    assert len(first_page) == 5
+    assert data['_meta']['first'] is None
+    assert data['_meta']['prev'] is None
+    assert res.headers.get('Pagination-Count') is None
+
+    res = client.get(data['_meta']['next'])
+    assert res.status_code == 206
+
+    data = res.get_json()
+    second_page = data['ArtistList']
+    assert len(second_page) == 5
+    assert second_page[0]['Name'] <= first_page[-1]['Name']
+    assert not {a['ArtistId'] for a in first_page} & {a['ArtistId'] for a in second_page}
+
+    res = client.get(data['_meta']['prev'])
+    data = res.get_json()
+    assert [a['ArtistId'] for a in data['ArtistList']] == [a['ArtistId'] for a in first_page]
+
+    res = client.get('/artist?_cursor=invalid&_limit=5')
+    assert res.status_code == 400
+    assert '_cursor' in res.get_json()['response']['invalid']
+
+    for sort, values in (
+        ('-InvoiceDate', [1, 1]),
+        ('-InvoiceDate', ['2009-13-45', 1]),
+        ('Total', ['pippo', 1]),
+        ('Total', [[1], 1]),
+        ('', [{'a': 1}]),
+    ):
+        token = base64.urlsafe_b64encode(json.dumps(dict(v=values)).encode()).decode().rstrip('=')
+        res = client.get('/invoice?_cursor={}&_limit=5&_sort={}'.format(token, sort))
+        assert res.status_code == 400
+        assert '_cursor' in res.get_json()['response']['invalid']
+
+
+def test_cursor_pagination_nulls(client):
+    tracks = []
+    for page in range(1, 5):
+        res = client.get('/track?_fields=TrackId;Composer&_limit=1000&_no_links&_page={}'.format(page))
+        tracks += res.get_json()['TrackList']
+    nulls = [t['TrackId'] for t in tracks if t['Composer'] is None]
+    assert nulls
+
+    for sort, reverse in (('Composer', False), ('-Composer', True)):
+        # nulls are greater than any value
+        expected = sorted(tracks, key=lambda t: (t['Composer'] is None, t['Composer'] or '', t['TrackId']))
+        if reverse:
+            expected = sorted(expected, key=lambda t: (t['Composer'] is None, t['Composer'] or ''), reverse=True)
+
+        pages, url = [], '/track?_cursor&_limit=500&_fields=TrackId;Composer&_sort=' + sort
+        while url:
+            res = client.get(url)
+            assert res.status_code in (200, 206)
+            data = res.get_json()
+            pages.append([t['TrackId'] for t in data['TrackList']])
+            url = data['_meta']['next']
+
+        assert [i for p in pages for i in p] == [t['TrackId'] for t in expected]
+
+        res = client.get(data['_meta']['prev'])
+        assert [t['TrackId'] for t in res.get_json()['TrackList']] == pages[-2]
+
+
 def test_extended(client):
     res = client.get('/track/5?_related')
     assert res.status_code == 200
@@ -213,3 +303,49 @@ def test_check_etag_list(client):
 
     res = client.get('/album/5/track?_related', headers={'If-None-Match': etag})
     assert res.status_code == 304
+
+
+def test_query_plan_cache(client):
+    plans = client.application.extensions['autocrud'].query_plans
+    plans.clear()
+
+    res = client.get('/artist?ArtistId=__lte__5&_no_links')
+    assert res.status_code == 200
+    assert len(res.get_json()['ArtistList']) == 5
+    info = plans.info()
+    assert info.misses > 0 and info.currsize > 0
+
+    res = client.get('/artist?ArtistId=__lte__3&_no_links')
+    assert res.status_code == 200
+    assert len(res.get_json()['ArtistList']) == 3
+    assert plans.info().hits > info.hits
+    assert plans.info().currsize == info.currsize
+
+    res = client.get('/artist?ArtistId=1;2;4&_no_links')
+    assert [a['ArtistId'] for a in res.get_json()['ArtistList']] == [1, 2, 4]
+
+    res = client.get('/artist?ArtistId=5;6&_no_links')
+    assert [a['ArtistId'] for a in res.get_json()['ArtistList']] == [5, 6]
+
+
+def test_query_plan_cache_types():
+    queries = (
+        'InvoiceDate=2009-01-01%2000:00:00',
+        'InvoiceDate=2009-01-01',
+        'InvoiceDate=__gt__2013-12-01',
+        'InvoiceDate=2009-01-01%2000:00:00;2009-01-02%2000:00:00',
+        'Total=1.98',
+        'Total=__gte__20',
+        'CustomerId=2;4',
+    )
+    results = []
+    for size in (0, 256):
+        client = create_app(conf={'AUTOCRUD_QUERY_PLAN_CACHE_SIZE': size}).test_client()
+        results.append([
+            (res.status_code, res.get_json())
+            for res in (client.get('/invoice?_no_links&' + q) for q in queries)
+        ])
+
+    assert results[0] == results[1]
+    assert all(code in (200, 204) for code, _ in results[1])
+    assert len(results[1][0][1]['InvoiceList']) == 1